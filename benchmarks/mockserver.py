@@ -0,0 +1,244 @@
+"""本機的 OpenAI 相容替身伺服器，供基準測試與離線開發使用。
+
+支援 GET /v1/models 與 POST /v1/chat/completions（串流與非串流），可調整：
+首個 token 延遲、每秒 token 數、回覆長度，以及以固定機率注入 429 / 5xx 錯誤。
+usage 的 prompt_cache_hit_tokens 依與先前請求的最長共同前綴估算（以 64 token 為單位，與 DeepSeek 相同）。
+
+    python benchmarks/mockserver.py --port 8765 --latency 0.3 --tps 80
+    deepseek config set base_url http://127.0.0.1:8765   # CLI 會自動加上 /v1
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Optional, Tuple
+
+CACHE_UNIT = 64      # 前綴快取的計算單位（token）
+CACHE_ENTRIES = 64   # 記住最近幾個請求的提示，供估算前綴快取命中
+
+
+class MockOptions:
+    def __init__(self, latency: float = 0.0, tps: float = 0.0, reply_tokens: int = 64,
+                 error_rate: float = 0.0, error_status: int = 503, retry_after: Optional[float] = None,
+                 chunk_tokens: int = 1, reply: Optional[str] = None, seed: int = 0,
+                 tool_calls: Optional[List[Tuple[str, str]]] = None):
+        self.latency = latency            # 首個 token（或非串流整個回覆）前的等待秒數
+        self.tps = tps                    # 每秒產生的 token 數（0 = 不限）
+        self.reply_tokens = reply_tokens  # 回覆的 token（單字）數
+        self.error_rate = error_rate      # 注入錯誤的機率
+        self.error_status = error_status
+        self.retry_after = retry_after    # 錯誤回應附帶的 Retry-After 秒數
+        self.chunk_tokens = chunk_tokens  # 每個串流 chunk 含幾個 token
+        self.reply = reply                # 固定回覆內容（覆寫 reply_tokens）
+        self.tool_calls = tool_calls or []  # [(工具名稱, JSON 參數)]：請求帶 tools 且最後一則是使用者訊息時改為要求呼叫
+        self.random = random.Random(seed)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive：與真實 API 一樣重用連線
+    disable_nagle_algorithm = True  # 標頭與內容分開寫出；不關 Nagle 會被 delayed ACK 卡住約 40 ms
+    server: "MockServer"
+
+    def log_message(self, *args) -> None:
+        pass
+
+    def _json(self, status: int, body: dict, headers: Optional[dict] = None) -> None:
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self) -> None:
+        if self.path.rstrip("/").endswith("/models"):
+            self._json(200, {"object": "list", "data": [{"id": "deepseek-chat", "object": "model"},
+                                                        {"id": "deepseek-reasoner", "object": "model"}]})
+        else:
+            self._json(404, {"error": {"message": "not found"}})
+
+    def do_POST(self) -> None:
+        length = int(self.headers.get("Content-Length") or 0)
+        req = json.loads(self.rfile.read(length) or b"{}")
+        opts = self.server.options
+        self.server.requests += 1
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._json(404, {"error": {"message": "not found"}})
+            return
+        with self.server.lock:
+            fail = opts.error_rate and opts.random.random() < opts.error_rate
+        if fail:
+            self.server.errors += 1
+            headers = {"Retry-After": str(opts.retry_after)} if opts.retry_after is not None else None
+            self._json(opts.error_status, {"error": {"message": "injected error", "type": "server_error"}}, headers)
+            return
+
+        prompt = "".join(f"<{m.get('role')}>{m.get('content', '')}" for m in req.get("messages", []))
+        words = opts.reply.split(" ") if opts.reply is not None else \
+            [f"w{i % 97}" for i in range(opts.reply_tokens)]
+        prompt_tokens = len(prompt) // 4
+        hit = min(self.server.cached_prefix(prompt) // 4 // CACHE_UNIT * CACHE_UNIT, prompt_tokens)
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": len(words),
+            "total_tokens": prompt_tokens + len(words),
+            "prompt_cache_hit_tokens": hit,
+            "prompt_cache_miss_tokens": prompt_tokens - hit,
+        }
+        base = {"id": "mock-1", "created": int(time.time()), "model": req.get("model", "deepseek-chat")}
+        messages = req.get("messages") or [{}]
+        calls = [{"id": f"call_{i}", "type": "function", "function": {"name": name, "arguments": args}}
+                 for i, (name, args) in enumerate(opts.tool_calls)] \
+            if req.get("tools") and messages[-1].get("role") == "user" else []
+        if opts.latency:
+            time.sleep(opts.latency)
+        if calls:
+            self._tool_calls(req, base, calls, usage)
+            return
+        if not req.get("stream"):
+            if opts.tps:
+                time.sleep(len(words) / opts.tps)
+            self._json(200, {**base, "object": "chat.completion", "usage": usage, "choices": [{
+                "index": 0, "finish_reason": "stop",
+                "message": {"role": "assistant", "content": " ".join(words)}}]})
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        step = max(opts.chunk_tokens, 1)
+        started = time.perf_counter()
+        for i in range(0, len(words), step):
+            piece = " ".join(words[i:i + step]) + (" " if i + step < len(words) else "")
+            self._event({**base, "object": "chat.completion.chunk", "choices": [{
+                "index": 0, "delta": {"content": piece}, "finish_reason": None}]})
+            if opts.tps:
+                ahead = started + (i + step) / opts.tps - time.perf_counter()
+                if ahead > 0:
+                    time.sleep(ahead)
+        self._event({**base, "object": "chat.completion.chunk", "choices": [{
+            "index": 0, "delta": {}, "finish_reason": "stop"}]})
+        if (req.get("stream_options") or {}).get("include_usage"):
+            self._event({**base, "object": "chat.completion.chunk", "choices": [], "usage": usage})
+        self._chunk(b"data: [DONE]\n\n")
+        self._chunk(b"")
+
+    def _tool_calls(self, req: dict, base: dict, calls: List[dict], usage: dict) -> None:
+        if not req.get("stream"):
+            self._json(200, {**base, "object": "chat.completion", "usage": usage, "choices": [{
+                "index": 0, "finish_reason": "tool_calls",
+                "message": {"role": "assistant", "content": None, "tool_calls": calls}}]})
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        # 與真實 API 相同：第一段帶 id 與名稱，arguments 分成多段
+        for i, call in enumerate(calls):
+            args = call["function"]["arguments"]
+            half = len(args) // 2
+            for delta in ({"index": i, "id": call["id"], "type": "function",
+                           "function": {"name": call["function"]["name"], "arguments": args[:half]}},
+                          {"index": i, "function": {"arguments": args[half:]}}):
+                self._event({**base, "object": "chat.completion.chunk", "choices": [{
+                    "index": 0, "delta": {"tool_calls": [delta]}, "finish_reason": None}]})
+        self._event({**base, "object": "chat.completion.chunk", "choices": [{
+            "index": 0, "delta": {}, "finish_reason": "tool_calls"}]})
+        if (req.get("stream_options") or {}).get("include_usage"):
+            self._event({**base, "object": "chat.completion.chunk", "choices": [], "usage": usage})
+        self._chunk(b"data: [DONE]\n\n")
+        self._chunk(b"")
+
+    def _event(self, body: dict) -> None:
+        self._chunk(b"data: " + json.dumps(body).encode() + b"\n\n")
+
+    def _chunk(self, data: bytes) -> None:
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+
+def _common_prefix(a: str, b: str, block: int = 4096) -> int:
+    """最長共同前綴長度：先逐塊比較（切片比較在 C 中進行），再於第一個不同的塊內逐字比較。"""
+    n = min(len(a), len(b))
+    i = 0
+    while i < n and a[i:i + block] == b[i:i + block]:
+        i += block
+    while i < n and a[i] == b[i]:
+        i += 1
+    return min(i, n)
+
+
+class MockServer(ThreadingHTTPServer):
+    """在背景執行緒提供服務；url 可直接作為 config 的 base_url。"""
+
+    daemon_threads = True
+
+    def __init__(self, options: Optional[MockOptions] = None, host: str = "127.0.0.1", port: int = 0):
+        super().__init__((host, port), _Handler)
+        self.options = options or MockOptions()
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self._prompts: List[str] = []
+        self._thread: Optional[threading.Thread] = None
+
+    def handle_error(self, request, client_address) -> None:
+        import sys
+        if not isinstance(sys.exc_info()[1], (ConnectionError, TimeoutError)):
+            super().handle_error(request, client_address)  # 用戶端關閉閒置連線屬正常情況
+
+    def cached_prefix(self, prompt: str) -> int:
+        """回傳 prompt 與先前請求的最長共同前綴字數，並記住這次的 prompt。"""
+        with self.lock:
+            best = max((_common_prefix(prompt, p) for p in self._prompts), default=0)
+            self._prompts = (self._prompts + [prompt])[-CACHE_ENTRIES:]
+        return best
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def __enter__(self) -> "MockServer":
+        self._thread = threading.Thread(target=self.serve_forever, name="mock-openai", daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.shutdown()
+        self.server_close()
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8765)
+    ap.add_argument("--latency", type=float, default=0.0, help="首個 token 前的延遲（秒）")
+    ap.add_argument("--tps", type=float, default=0.0, help="每秒 token 數（0 = 不限）")
+    ap.add_argument("--reply-tokens", type=int, default=64, help="回覆長度（token 數）")
+    ap.add_argument("--error-rate", type=float, default=0.0, help="注入錯誤的機率（0~1）")
+    ap.add_argument("--error-status", type=int, default=503)
+    ap.add_argument("--retry-after", type=float, default=None)
+    ap.add_argument("--tool-call", action="append", default=[], metavar="NAME=JSON",
+                    help="請求帶 tools 時要求的工具呼叫，可重複（例：list_dir='{\"path\": \".\"}'）")
+    args = ap.parse_args()
+    opts = MockOptions(latency=args.latency, tps=args.tps, reply_tokens=args.reply_tokens,
+                       error_rate=args.error_rate, error_status=args.error_status, retry_after=args.retry_after,
+                       tool_calls=[tuple(c.split("=", 1)) for c in args.tool_call])
+    server = MockServer(opts, args.host, args.port)
+    print(f"mock OpenAI server on {server.url}（base_url 設為此位址）")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
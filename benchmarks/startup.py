@@ -0,0 +1,134 @@
+"""`deepseek` 冷啟動基準測試。
+
+每個情境以全新的 Python 行程執行數次，取牆鐘時間中位數；另以
+`python -X importtime` 跑一次，列出最耗時的匯入並檢查不該出現的重量級模組
+（例如 config 子指令不應載入 openai / readline）。任何情境超出預算即以 1 結束。
+
+    python benchmarks/startup.py                # 使用 startup_budget.json 的預算
+    python benchmarks/startup.py --scale 1.5    # 較慢的機器（如 CI）放寬預算
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+BUDGET_PATH = Path(__file__).with_name("startup_budget.json")
+
+# 情境名稱 → (CLI 參數, stdin)
+SCENARIOS = {
+    "help": (["-h"], ""),
+    "repl": ([], ""),  # stdin 立即 EOF：量到 REPL 可接受輸入為止
+    "config show": (["config", "show"], ""),
+    "config set": (["config", "set", "stream_fps", "12"], ""),
+    "config unset": (["config", "unset", "stream_fps"], ""),
+    "config edit": (["config", "edit"], "\n\n\n\n"),
+    "pipe": (["-p", "hi"], ""),  # 沒有 api_key：量到回報設定錯誤為止（結束碼 2）
+}
+
+# 預期的結束碼（預設 0）
+EXPECTED_EXIT = {"pipe": 2}
+
+# 啟動時不應載入的模組（只有真正連線或進入 REPL 才需要）
+FORBIDDEN = {
+    "help": {"openai", "readline", "pygments"},
+    "repl": {"openai", "pygments"},
+    "config show": {"openai", "readline", "pygments"},
+    "config set": {"openai", "readline", "pygments"},
+    "config unset": {"openai", "readline", "pygments"},
+    "config edit": {"openai", "readline", "pygments"},
+    "pipe": {"openai", "readline", "pygments", "rich", "typer", "click"},
+}
+
+
+def _env(home: str) -> dict:
+    env = dict(os.environ)
+    env.update(
+        HOME=home,
+        XDG_CONFIG_HOME=os.path.join(home, ".config"),
+        XDG_CACHE_HOME=os.path.join(home, ".cache"),
+        PYTHONPATH=str(ROOT) + os.pathsep + env.get("PYTHONPATH", ""),
+        TERM="dumb",
+        COLUMNS="100",
+    )
+    return env
+
+
+def _run(args, stdin: str, env: dict, importtime: bool = False):
+    cmd = [sys.executable] + (["-X", "importtime"] if importtime else []) + ["-m", "deepseek_cli", *args]
+    t0 = time.perf_counter()
+    p = subprocess.run(cmd, input=stdin, capture_output=True, text=True, env=env, cwd=ROOT)
+    return (time.perf_counter() - t0) * 1000, p
+
+
+def _parse_importtime(stderr: str):
+    """回傳 [(累計 µs, 模組名)]，只取 -X importtime 的輸出行；巢狀匯入的名稱保留前置縮排。"""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|", 2)
+        try:
+            rows.append((int(cumulative), name[1:].rstrip()))
+        except ValueError:
+            continue
+    return rows
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("-n", "--runs", type=int, default=5, help="每個情境執行次數（取中位數）")
+    ap.add_argument("--scale", type=float, default=1.0, help="預算倍率")
+    ap.add_argument("--top", type=int, default=5, help="列出最耗時的前 N 個頂層匯入")
+    ap.add_argument("--only", action="append", help="只跑指定情境（可重複）")
+    args = ap.parse_args()
+
+    budgets = json.loads(BUDGET_PATH.read_text(encoding="utf-8"))
+    failed = False
+    with tempfile.TemporaryDirectory(prefix="deepseek-bench-") as home:
+        env = _env(home)
+        _run(["config", "show"], "", env)  # 預熱 .pyc，避免首次編譯計入
+        for name, (cli_args, stdin) in SCENARIOS.items():
+            if args.only and name not in args.only:
+                continue
+            times = []
+            for _ in range(args.runs):
+                ms, p = _run(cli_args, stdin, env)
+                if p.returncode != EXPECTED_EXIT.get(name, 0):
+                    print(f"✗ {name}: exit {p.returncode}\n{p.stderr[-2000:]}")
+                    failed = True
+                    break
+                times.append(ms)
+            if not times:
+                continue
+            median = statistics.median(times)
+            budget = budgets.get(name, budgets.get("default", 1000)) * args.scale
+
+            _, p = _run(cli_args, stdin, env, importtime=True)
+            rows = _parse_importtime(p.stderr)
+            loaded = {mod.strip() for _, mod in rows}
+            leaked = sorted(FORBIDDEN.get(name, set()) & loaded)
+            top_level = sorted(
+                ((us, mod) for us, mod in rows if not mod.startswith(" ")),
+                reverse=True,
+            )[: args.top]
+
+            ok = median <= budget and not leaked
+            failed |= not ok
+            print(f"{'✓' if ok else '✗'} {name:<13} {median:7.1f} ms (budget {budget:.0f} ms)")
+            for us, mod in top_level:
+                print(f"      {us / 1000:7.1f} ms  {mod}")
+            if leaked:
+                print(f"      不應載入：{', '.join(leaked)}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,308 @@
+"""`deepseek` 執行期基準測試：以本機 OpenAI 相容替身伺服器（mockserver.py）取代 DeepSeek API。
+
+只量 CLI 本身的成本：呼叫層、串流解析與顯示、提示組裝、寫檔區塊解析、ShellRunner。
+每個指標取多次執行的最佳值，與 suite_baseline.json 比較；
+超出基準 (1 + tolerance) 倍且差距大於 --floor 毫秒即視為退步並以 1 結束。
+
+    python benchmarks/suite.py                      # 與基準比較
+    python benchmarks/suite.py --update-baseline    # 重新記錄基準
+    python benchmarks/suite.py --only stream --only shell --tolerance 0.5
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, Dict, List
+
+ROOT = Path(__file__).resolve().parent.parent
+BASELINE_PATH = Path(__file__).with_name("suite_baseline.json")
+sys.path[:0] = [str(ROOT), str(Path(__file__).resolve().parent)]
+
+from mockserver import MockOptions, MockServer  # noqa: E402
+
+
+def _best_ms(fn: Callable[[], object], runs: int) -> float:
+    """先暖身一次，再取 runs 次中的最佳值（最不受排程、GC 等雜訊影響）。"""
+    fn()
+    times = []
+    for _ in range(runs):
+        t0 = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - t0) * 1000)
+    return min(times)
+
+
+def _console():
+    from rich.console import Console
+    return Console(file=io.StringIO(), width=100, force_terminal=True, color_system="truecolor")
+
+
+def _cfg(server: MockServer, **extra) -> dict:
+    from deepseek_cli.core.config import normalize_with_defaults
+    return normalize_with_defaults({"api_key": "bench", "base_url": server.url, "max_retries": "0", **extra})
+
+
+def _make_tree(root: Path, files: int, kb: int) -> List[Path]:
+    line = "def handler_{i}(request, retries=3):  # 處理請求並回傳結果\n"
+    paths = []
+    for i in range(files):
+        p = root / f"pkg{i % 10}" / f"module_{i}.py"
+        p.parent.mkdir(parents=True, exist_ok=True)
+        body = "".join(line.format(i=j) for j in range(kb * 1024 // len(line)))
+        p.write_text(body, encoding="utf-8")
+        paths.append(p)
+    return paths
+
+
+# ───────────────────────────── 情境 ─────────────────────────────
+def bench_model_say(work: Path, runs: int) -> Dict[str, float]:
+    """非串流呼叫：ChatClient + model_say 每次呼叫的額外成本（替身伺服器零延遲）。"""
+    from deepseek_cli.core.chat import model_say
+    from deepseek_cli.core.client import ChatClient
+    with MockServer(MockOptions(reply_tokens=64)) as server:
+        client = ChatClient.from_config(_cfg(server))
+        usage: dict = {}
+        ms = _best_ms(lambda: model_say(client, "deepseek-chat", "hello", usage=usage), runs * 6)
+        assert usage.get("completion_tokens") == 64, usage
+    return {"call_ms": ms}
+
+
+def _show_stream(printer, chunks) -> str:
+    """以 REPL 的方式驅動 StreamPrinter：依 min_interval 節流更新 Live，結束後 finish。"""
+    from rich.live import Live
+    reply, reasoning = [], []
+    ttft = None
+    start = last = time.perf_counter()
+    with Live(printer.update("", ""), console=printer.console, auto_refresh=False, transient=True) as live:
+        for kind, piece in chunks:
+            now = time.perf_counter()
+            if ttft is None:
+                ttft = now - start
+            (reasoning if kind == "reasoning" else reply).append(piece)
+            if now - last >= printer.min_interval:
+                live.update(printer.update("".join(reply), "".join(reasoning)), refresh=True)
+                last = time.perf_counter()
+    return printer.finish("".join(reply), "".join(reasoning), ttft, time.perf_counter() - start)
+
+
+def bench_stream(work: Path, runs: int) -> Dict[str, float]:
+    """串流 4000 個 chunk：解析成本，以及加上 StreamPrinter（Live 節流重繪）的總成本。"""
+    from deepseek_cli.core.chat import StreamPrinter, iter_model_stream
+    from deepseek_cli.core.client import ChatClient
+    with MockServer(MockOptions(reply_tokens=4000)) as server:
+        client = ChatClient.from_config(_cfg(server))
+
+        def parse():
+            n = sum(1 for _ in iter_model_stream(client, "deepseek-chat", "go"))
+            assert n == 4000, n
+
+        def render():
+            _show_stream(StreamPrinter(_console(), fps=12), iter_model_stream(client, "deepseek-chat", "go"))
+
+        return {"parse_4k_chunks_ms": _best_ms(parse, runs), "render_4k_chunks_ms": _best_ms(render, runs)}
+
+
+def bench_stream_latency(work: Path, runs: int) -> Dict[str, float]:
+    """替身伺服器 TTFT 50 ms、每秒 2000 token：CLI 觀測到的 TTFT 與總時間扣掉伺服器端理論值的差距。"""
+    from deepseek_cli.core.chat import StreamPrinter, iter_model_stream
+    from deepseek_cli.core.client import ChatClient
+    opts = MockOptions(latency=0.05, tps=2000, reply_tokens=400)
+    with MockServer(opts) as server:
+        client = ChatClient.from_config(_cfg(server))
+        ttft, extra = [], []
+        for _ in range(runs):
+            printer = StreamPrinter(_console(), fps=12)
+            _show_stream(printer, iter_model_stream(client, "deepseek-chat", "go"))
+            ttft.append((printer.ttft - opts.latency) * 1000)
+            extra.append((printer.elapsed - opts.latency - opts.reply_tokens / opts.tps) * 1000)
+    return {"ttft_overhead_ms": min(ttft), "total_overhead_ms": min(extra)}
+
+
+def bench_retry(work: Path, runs: int) -> Dict[str, float]:
+    """注入 30% 的 503：每次呼叫最終都要成功；退避等待不計入（只量重試路徑本身的成本）。"""
+    import deepseek_cli.core.client as client_mod
+    from deepseek_cli.core.chat import model_say
+    opts = MockOptions(reply_tokens=16, error_rate=0.3, seed=1)
+    with MockServer(opts) as server:
+        client = client_mod.ChatClient.from_config(_cfg(server, max_retries="8"))
+        sleep = client_mod.time.sleep
+        client_mod.time.sleep = lambda s: None
+        try:
+            def call():
+                reply = model_say(client, "deepseek-chat", "hi")
+                assert not reply.startswith("(呼叫失敗"), reply
+            ms = _best_ms(call, runs * 6)
+        finally:
+            client_mod.time.sleep = sleep
+        assert client.retries > 0 and server.errors == client.retries
+    return {"call_ms": ms}
+
+
+def bench_chat_turn(work: Path, runs: int) -> Dict[str, float]:
+    """ChatManager 一整輪（讀 @檔案、組提示與歷史、串流顯示、寫檔區塊解析），附 3 個 32 KB 檔案。"""
+    import deepseek_cli.main as main_mod
+    files = _make_tree(work / "turn", 3, 32)
+    mentions = " ".join(f"@{p}" for p in files)
+    main_mod.console = _console()
+    with MockServer(MockOptions(reply_tokens=200, chunk_tokens=4)) as server:
+        chat = main_mod.ChatManager(_cfg(server, allow_fs_read=True, history_compact="false"))
+
+        def turn():
+            s = f"請說明 handler 的重試邏輯 {mentions}"
+            at_paths = chat._expand_at_mentions(s)
+            file_map = chat._read_files_for_context(at_paths)
+            prompt, history = chat._prepare_turn(s, file_map)
+            reply = asyncio.run(chat._say(prompt, history))
+            chat.history.add(s, reply, list(file_map.values()))
+            chat._apply_write_blocks(reply, at_paths)
+
+        return {"turn_ms": _best_ms(turn, runs * 2)}
+
+
+def bench_tool_turn(work: Path, runs: int) -> Dict[str, float]:
+    """模型一次要求 6 個工具呼叫（read_file、list_dir、grep 與 3 個各睡 50 ms 的 run_shell），並行執行後送回。"""
+    import json
+    import deepseek_cli.main as main_mod
+    _make_tree(work / "tools", 20, 16)
+    nap = f"{sys.executable} -c 'import time; time.sleep(0.05)'"
+    calls = [("read_file", json.dumps({"path": "pkg0/module_0.py", "max_lines": 200})),
+             ("list_dir", json.dumps({"path": "pkg1"})),
+             ("grep", json.dumps({"pattern": r"handler_1\d\b"}))] + [("run_shell", json.dumps({"command": nap}))] * 3
+    main_mod.console = _console()
+    with MockServer(MockOptions(reply_tokens=50, chunk_tokens=4, tool_calls=calls)) as server:
+        chat = main_mod.ChatManager(_cfg(server, allow_fs_read=True, allow_shell=True, history="false"))
+        chat.tools.root = (work / "tools").resolve()
+        return {"turn_ms": _best_ms(lambda: asyncio.run(chat._say("看看 pkg0 的 handler")), runs)}
+
+
+def bench_map(work: Path, runs: int) -> Dict[str, float]:
+    """deepseek map：200 個檔案、每個請求 20 ms 延遲、並行 32（吞吐量應取決於並行度而非檔案數）。"""
+    from deepseek_cli.core.batch import make_async_client
+    from deepseek_cli.core.mapper import MapRunner
+    paths = _make_tree(work / "map", 200, 4)
+    with MockServer(MockOptions(latency=0.02, reply_tokens=20)) as server:
+        async def run() -> None:
+            runner = MapRunner(make_async_client(_cfg(server)), "deepseek-chat", "加上型別註記", io.StringIO(),
+                               concurrency=32)
+            await runner.run(paths)
+            await runner.client.close()  # AsyncOpenAI 綁定在這次的事件迴圈上
+            assert runner.counts == {"unchanged": 200}
+        return {"200_files_ms": _best_ms(lambda: asyncio.run(run()), max(runs // 2, 1))}
+
+
+def bench_build_prompt(work: Path, runs: int) -> Dict[str, float]:
+    """200 個 16 KB 檔案（約 3 MB）：冷讀取、組提示（快取命中）與本地 token 估算。"""
+    from deepseek_cli.core.context import build_chat_prompt, read_context_files
+    from deepseek_cli.core.filecache import FileCache
+    from deepseek_cli.core.history import estimate_tokens
+    paths = _make_tree(work / "prompt", 200, 16)
+    cfg = {"dir_max_total_kb": 1 << 20}
+    read = _best_ms(lambda: read_context_files(paths, FileCache(), cfg), runs)
+    cache = FileCache()
+    file_map = read_context_files(paths, cache, cfg)
+    build = _best_ms(lambda: build_chat_prompt("問題", file_map, cache), runs)
+    prompt = build_chat_prompt("問題", file_map, cache)
+    estimate = _best_ms(lambda: estimate_tokens(prompt), runs)
+    dir_read = _best_ms(lambda: read_context_files([work / "prompt"], FileCache(), cfg), runs)
+    return {"read_200_files_ms": read, "read_dir_ms": dir_read, "build_ms": build, "estimate_tokens_ms": estimate}
+
+
+def bench_write_blocks(work: Path, runs: int) -> Dict[str, float]:
+    """約 3.6 MB 的回覆含 60 個 WRITE 區塊；另有 2 MB、100 個未結束區塊的異常回覆。"""
+    from deepseek_cli.core.context import WRITE_BLOCK_RE
+    from deepseek_cli.core.edits import parse_edit_blocks
+    body = "x = 1\n" * 10000
+    reply = "".join(f"說明\n<<<WRITE f{i}.py\n{body}>>>END\n" for i in range(60))
+    broken = "".join(f"<<<WRITE f{i}.py\n{'y' * 20000}\n" for i in range(100))
+    assert len(WRITE_BLOCK_RE.findall(reply)) == 60 and len(parse_edit_blocks(reply)) == 60
+    return {
+        "write_block_re_ms": _best_ms(lambda: WRITE_BLOCK_RE.findall(reply), runs),
+        "parse_edit_blocks_ms": _best_ms(lambda: parse_edit_blocks(reply), runs),
+        "unterminated_ms": _best_ms(lambda: parse_edit_blocks(broken), runs),
+    }
+
+
+def bench_shell(work: Path, runs: int) -> Dict[str, float]:
+    """ShellRunner 串流 50 萬行輸出（只保留頭尾，Live 只畫尾端）。"""
+    from deepseek_cli.tool.shell import ShellRunner
+    cmd = f"{shlex_quote(sys.executable)} -c \"import sys; sys.stdout.write(''.join(f'line {{i}}\\n' for i in range(500000)))\""
+    return {"500k_lines_ms": _best_ms(lambda: ShellRunner(_console()).run(cmd), max(runs // 2, 1))}
+
+
+def shlex_quote(s: str) -> str:
+    import shlex
+    return shlex.quote(s)
+
+
+SCENARIOS: Dict[str, Callable[[Path, int], Dict[str, float]]] = {
+    "model_say": bench_model_say,
+    "stream": bench_stream,
+    "stream_latency": bench_stream_latency,
+    "retry": bench_retry,
+    "chat_turn": bench_chat_turn,
+    "tool_turn": bench_tool_turn,
+    "map": bench_map,
+    "build_prompt": bench_build_prompt,
+    "write_blocks": bench_write_blocks,
+    "shell": bench_shell,
+}
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("-n", "--runs", type=int, default=5, help="每個指標的執行次數（取最佳值）")
+    ap.add_argument("--tolerance", type=float, default=0.5, help="容許比基準慢的比例")
+    ap.add_argument("--floor", type=float, default=5.0, help="差距小於此毫秒數不算退步（避免雜訊）")
+    ap.add_argument("--update-baseline", action="store_true", help="把本次結果寫入基準檔")
+    ap.add_argument("--only", action="append", help="只跑指定情境（可重複）")
+    args = ap.parse_args()
+
+    baseline = json.loads(BASELINE_PATH.read_text(encoding="utf-8")) if BASELINE_PATH.exists() else {}
+    results: Dict[str, float] = {}
+    failed = False
+    home = tempfile.mkdtemp(prefix="deepseek-bench-")
+    # 設定與快取目錄在匯入 deepseek_cli 前導向暫存目錄，不碰使用者的檔案
+    os.environ.update(HOME=home, XDG_CONFIG_HOME=os.path.join(home, ".config"),
+                      XDG_CACHE_HOME=os.path.join(home, ".cache"))
+    try:
+        for name, fn in SCENARIOS.items():
+            if args.only and name not in args.only:
+                continue
+            try:
+                metrics = fn(Path(home), args.runs)
+            except Exception as e:
+                print(f"✗ {name}: {type(e).__name__}: {e}")
+                failed = True
+                continue
+            for metric, ms in metrics.items():
+                key = f"{name}.{metric}"
+                results[key] = round(ms, 3)
+                base = baseline.get(key)
+                if base is None:
+                    print(f"· {key:<36} {ms:9.2f} ms  （無基準）")
+                    continue
+                regressed = ms > base * (1 + args.tolerance) and ms - base > args.floor
+                failed |= regressed and not args.update_baseline
+                change = (ms - base) / base * 100 if base else 0.0
+                print(f"{'✗' if regressed else '✓'} {key:<36} {ms:9.2f} ms  基準 {base:9.2f} ms  ({change:+.0f}%)")
+    finally:
+        shutil.rmtree(home, ignore_errors=True)
+
+    if args.update_baseline:
+        merged = {**baseline, **results}
+        BASELINE_PATH.write_text(json.dumps(merged, indent=2, sort_keys=True, ensure_ascii=False) + "\n",
+                                 encoding="utf-8")
+        print(f"已更新 {BASELINE_PATH.name}（{len(results)} 項）")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,32 @@
+"""`deepseek` 進入點。
+
+命令列含 -p / --print（且不是子指令）時直接交給 core.pipe 的管線模式，
+完全不載入 typer / rich / readline；其餘一律交給 main.app。
+"""
+import sys
+
+SUBCOMMANDS = {"batch", "cache", "config", "map", "sessions"}
+
+
+def _wants_pipe(argv) -> bool:
+    if not argv or argv[0] in SUBCOMMANDS:
+        return False
+    for arg in argv:
+        if arg == "--":
+            return False
+        if arg in ("-p", "--print") or arg.startswith("--print="):
+            return True
+    return False
+
+
+def run() -> None:
+    argv = sys.argv[1:]
+    if _wants_pipe(argv):
+        from .core.pipe import main as pipe_main
+        sys.exit(pipe_main(argv))
+    from .main import app
+    app()
+
+
+if __name__ == "__main__":
+    run()
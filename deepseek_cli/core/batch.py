@@ -0,0 +1,229 @@
+from __future__ import annotations
+import asyncio
+import json
+import os
+import sys
+import time
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, TextIO
+
+from .config import DEFAULT_BASEURL
+from .retry import backoff_delay, is_retryable, retry_after
+
+
+def make_async_client(cfg: dict):
+    """建立 AsyncOpenAI；沒有 api_key 時回傳 None。openai 延遲載入。"""
+    if not cfg.get("api_key"):
+        return None
+    from openai import AsyncOpenAI
+    base_url = (cfg.get("base_url") or DEFAULT_BASEURL).rstrip("/")
+    return AsyncOpenAI(api_key=cfg["api_key"], base_url=base_url + "/v1", max_retries=0)
+
+
+class TokenBucket:
+    """非同步 token bucket：平均每秒 rate 次、最多累積 burst 次。rate <= 0 表示不限速。"""
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        self.rate = rate
+        self.capacity = burst if burst else max(rate, 1.0)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        if self.rate <= 0:
+            return
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+def checkpoint_offset(path: Path, block: int = 1 << 16) -> int:
+    """續跑用：回傳輸出檔中已完整寫入的筆數，並截掉中斷時殘留的半行。
+
+    結果依輸入順序寫出，所以已寫入的前 N 行恰好就是前 N 筆輸入的結果。
+    最後一個換行從檔尾往回找；計算行數時分段讀取，不把整個檔案載入記憶體。
+    """
+    if not path.exists():
+        return 0
+    with open(path, "rb+") as f:
+        size = f.seek(0, os.SEEK_END)
+        end = size
+        while end > 0:
+            start = max(0, end - block)
+            f.seek(start)
+            i = f.read(end - start).rfind(b"\n")
+            if i >= 0:
+                end = start + i + 1
+                break
+            end = start
+        if end != size:
+            f.truncate(end)
+        f.seek(0)
+        count = 0
+        while f.tell() < end:
+            count += f.read(min(block, end - f.tell())).count(b"\n")
+    return count
+
+
+def parse_record(line: str, index: int) -> dict:
+    """解析一行輸入。接受 {"messages": [...]}、{"prompt": ...}、{"title", "body"}（如 requests.jsonl）或純字串。"""
+    obj = json.loads(line)
+    if isinstance(obj, str):
+        obj = {"prompt": obj}
+    if not isinstance(obj, dict):
+        raise ValueError("每行需為 JSON 物件或字串")
+    rid = obj.get("id") or obj.get("request_id") or str(index)
+    item = {"index": index, "id": rid, "model": obj.get("model")}
+    if isinstance(obj.get("messages"), list):
+        item["messages"] = obj["messages"]
+        return item
+    text = obj.get("prompt") or obj.get("content")
+    if text is None and obj.get("body") is not None:
+        text = f"{obj['title']}\n\n{obj['body']}" if obj.get("title") else obj["body"]
+    if not isinstance(text, str) or not text.strip():
+        raise ValueError("找不到 prompt / body / messages 欄位")
+    item["prompt"] = text
+    return item
+
+
+class BatchRunner:
+    """以有限並行度處理 JSONL 提示，結果依輸入順序寫出。
+
+    - concurrency：同時進行中的請求上限
+    - rps：token bucket 速率（每秒請求數，0 = 不限）
+    - 讀取與寫出之間最多保留 concurrency * 4 筆，慢請求不會讓記憶體無限增長
+    - prepare：把 prompt 文字展開為最終提示（如 @檔案），於執行緒中執行
+    - cache：ResponseCache（可省略），重跑相同提示時不再呼叫 API
+    """
+
+    def __init__(self, client, model: str, out: TextIO, *, concurrency: int = 8, rps: float = 0.0,
+                 retries: int = 4, prepare: Optional[Callable[[str], str]] = None,
+                 on_record: Optional[Callable[[dict], None]] = None, cache=None):
+        self.client = client
+        self.model = model
+        self.out = out
+        self.concurrency = max(1, concurrency)
+        self.bucket = TokenBucket(rps)
+        self.retries = retries
+        self.prepare = prepare
+        self.on_record = on_record
+        self.cache = cache
+        self.ok = 0
+        self.failed = 0
+
+    async def _call(self, item: dict) -> dict:
+        record = {"index": item["index"], "id": item["id"]}
+        try:
+            messages: List[dict] = item.get("messages") or []
+            if not messages:
+                prompt = item["prompt"]
+                if self.prepare is not None:
+                    prompt = await asyncio.to_thread(self.prepare, prompt)
+                messages = [{"role": "user", "content": prompt}]
+        except Exception as e:
+            record["error"] = f"展開失敗：{e}"
+            return record
+        model = item.get("model") or self.model
+        key = None
+        if self.cache is not None:
+            key = self.cache.key_for(model, str(getattr(self.client, "base_url", "")), messages)
+            hit = self.cache.get(key)
+            if hit is not None:
+                record.update(model=model, reply=hit, cached=True)
+                return record
+        for attempt in range(self.retries + 1):
+            await self.bucket.acquire()
+            try:
+                resp = await self.client.chat.completions.create(model=model, messages=messages)
+                # 回覆格式不符（例如 choices 為空）同樣記為錯誤：不能讓例外中斷 worker，否則依序寫出會卡在這一筆
+                reply = resp.choices[0].message.content or ""
+                usage = getattr(resp, "usage", None)
+                usage = usage.model_dump() if hasattr(usage, "model_dump") else None
+            except Exception as e:
+                if attempt >= self.retries or not is_retryable(e):
+                    record.update(error=str(e), attempts=attempt + 1)
+                    return record
+                await asyncio.sleep(max(backoff_delay(attempt), retry_after(e) or 0.0))
+                continue
+            if key is not None:
+                self.cache.put(key, reply)
+            record.update(
+                model=model,
+                reply=reply,
+                usage=usage,
+                attempts=attempt + 1,
+            )
+            return record
+        return record
+
+    async def run(self, lines: Iterable[str], skip: int = 0) -> None:
+        loop = asyncio.get_running_loop()
+        window = asyncio.Semaphore(self.concurrency * 4)
+        slots = asyncio.Semaphore(self.concurrency)
+        done: Dict[int, dict] = {}
+        next_write = skip
+        tasks = set()
+
+        def flush() -> None:
+            nonlocal next_write
+            while next_write in done:
+                record = done.pop(next_write)
+                self.out.write(json.dumps(record, ensure_ascii=False) + "\n")
+                self.out.flush()
+                if "error" in record:
+                    self.failed += 1
+                else:
+                    self.ok += 1
+                if self.on_record:
+                    self.on_record(record)
+                next_write += 1
+                window.release()
+
+        async def work(item: dict) -> None:
+            async with slots:
+                record = await self._call(item)
+            done[item["index"]] = record
+            flush()
+
+        it = iter(lines)
+        index = 0
+        while True:
+            await window.acquire()
+            # 逐行讀取放在執行緒：stdin 等待輸入時不阻塞進行中的請求
+            line = await loop.run_in_executor(None, next, it, None)
+            if line is None:
+                window.release()
+                break
+            if not line.strip():
+                window.release()
+                continue
+            if index < skip:
+                index += 1
+                window.release()
+                continue
+            try:
+                item = parse_record(line, index)
+            except ValueError as e:
+                done[index] = {"index": index, "id": str(index), "error": f"無法解析：{e}"}
+                flush()
+            else:
+                task = asyncio.ensure_future(work(item))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            index += 1
+        if tasks:
+            await asyncio.gather(*tasks)
+
+
+def open_input(path: str):
+    """'-' 代表 stdin；否則以文字模式開檔（逐行讀取，不一次載入）。"""
+    if path == "-":
+        return sys.stdin
+    return open(os.path.expanduser(path), encoding="utf-8")
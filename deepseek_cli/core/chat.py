@@ -1,21 +1,337 @@
-from rich.console import Console
-from rich.panel import Panel
-from rich.prompt import Prompt
-from rich.text import Text
+from __future__ import annotations
+import threading
+import time
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterator, List, Optional, Tuple
 
-def model_say(client, model: str, prompt: str) -> str:
+if TYPE_CHECKING:
+    from rich.console import Console
+
+# rich 延到真正顯示時才載入：deepseek -p（管線模式）只用 iter_model_stream，不需要它
+
+def build_messages(prompt: str, history: Optional[List[Dict[str, str]]] = None,
+                   followup: Optional[List[Dict[str, Any]]] = None) -> List[Dict[str, Any]]:
+    """把先前對話（可為空）與本輪提示組成 messages；followup 是本輪的工具呼叫與結果，接在提示之後。"""
+    return list(history or []) + [{"role": "user", "content": prompt}] + list(followup or [])
+
+def _cache_key(cache, client, model: str, messages: List[Dict[str, str]],
+               tools: Optional[List[dict]] = None) -> Optional[str]:
+    """提供工具與否會改變回覆（可能改為要求工具呼叫），工具定義一併納入快取鍵。"""
+    if cache is None:
+        return None
+    return cache.key_for(model, str(getattr(client, "base_url", "")), messages,
+                         {"tools": tools} if tools else None)
+
+def _record_usage(usage: Optional[dict], raw) -> None:
+    if usage is not None and raw is not None:
+        from .perf import usage_dict
+        usage.update(usage_dict(raw))
+
+def _collect_calls(calls: List[Dict[str, str]], deltas) -> None:
+    """把 tool_calls 累積成 {"id", "name", "arguments"}；串流時依 index 分段送達，arguments 是 JSON 片段。"""
+    for i, d in enumerate(deltas or ()):
+        index = getattr(d, "index", None)
+        index = i if index is None else index
+        while len(calls) <= index:
+            calls.append({"id": "", "name": "", "arguments": ""})
+        call = calls[index]
+        if getattr(d, "id", None):
+            call["id"] = d.id
+        fn = getattr(d, "function", None)
+        if fn is not None:
+            if fn.name:
+                call["name"] = fn.name
+            if fn.arguments:
+                call["arguments"] += fn.arguments
+
+def _tool_kwargs(tools: Optional[List[dict]]) -> Dict[str, Any]:
+    return {"tools": tools} if tools else {}
+
+def model_say(client, model: str, prompt: str,
+              history: Optional[List[Dict[str, str]]] = None, cache=None,
+              usage: Optional[dict] = None, tools: Optional[List[dict]] = None,
+              followup: Optional[List[Dict[str, Any]]] = None,
+              calls: Optional[List[Dict[str, str]]] = None, raise_errors: bool = False) -> str:
+    """cache 為 ResponseCache（可省略）：相同的 model/base_url/messages 直接回傳先前的回覆。
+    usage 為 dict 時會填入本次的 token 用量（prompt_tokens、prompt_cache_hit_tokens 等）。
+    tools 為 function calling 的工具定義；calls 為 list 時會填入模型要求的工具呼叫（見 _collect_calls）。
+    帶有工具結果（followup）或要求工具呼叫的回覆不寫入快取。
+    呼叫失敗時預設回傳「(呼叫失敗：…)」文字；raise_errors=True 則直接拋出例外。"""
     if client is None:
         return f"(離線) {prompt}"
+    messages = build_messages(prompt, history, followup)
+    key = None if followup else _cache_key(cache, client, model, messages, tools)
+    if key is not None:
+        hit = cache.get(key)
+        if hit is not None:
+            return hit
     try:
         resp = client.chat.completions.create(
             model=model,
-            messages=[{"role": "user", "content": prompt}],
+            messages=messages,
+            **_tool_kwargs(tools),
         )
-        return resp.choices[0].message.content or ""
+        message = resp.choices[0].message
+        reply = message.content or ""
+        _record_usage(usage, getattr(resp, "usage", None))
+        if calls is not None:
+            _collect_calls(calls, getattr(message, "tool_calls", None))
     except Exception as e:
+        if raise_errors:
+            raise
         return f"(呼叫失敗：{e})"
+    if key is not None and not calls:
+        cache.put(key, reply)
+    return reply
+
+# ───────────────────────────── 串流 ─────────────────────────────
+def iter_model_stream(client, model: str, prompt: str,
+                      history: Optional[List[Dict[str, str]]] = None,
+                      cache=None, usage: Optional[dict] = None,
+                      raise_errors: bool = False,
+                      on_open: Optional[Callable[[Any], None]] = None,
+                      tools: Optional[List[dict]] = None,
+                      followup: Optional[List[Dict[str, Any]]] = None,
+                      calls: Optional[List[Dict[str, str]]] = None) -> Iterator[Tuple[str, str]]:
+    """以 stream=True 呼叫模型，逐塊產出 ("reasoning" | "content", 文字)。
+
+    deepseek-reasoner 的思考過程放在 delta.reasoning_content，與正文分開回傳。
+    命中 cache 時直接一次產出先前的正文；串流完整結束才寫入快取。
+    usage 為 dict 時會要求伺服器在最後一個 chunk 附上用量並填入。
+    呼叫失敗時預設產出「(呼叫失敗：…)」文字；raise_errors=True 則直接拋出例外。
+    on_open 會在串流建立後收到串流物件，供其他執行緒中途關閉（見 ReplyStream）；搭配 ChatClient 時
+    在等待首個 chunk 之前就會收到，重試與 hedge 時可能呼叫多次。
+    tools / followup / calls 同 model_say：工具呼叫不產出片段，串流結束後整理在 calls 中。
+    """
+    if client is None:
+        yield "content", f"(離線) {prompt}"
+        return
+    messages = build_messages(prompt, history, followup)
+    key = None if followup else _cache_key(cache, client, model, messages, tools)
+    if key is not None:
+        hit = cache.get(key)
+        if hit is not None:
+            yield "content", hit
+            return
+    parts: List[str] = []
+    stream = None
+    # ChatClient 等到首個 chunk 才從 create 返回：on_open 改交給它，在請求送出後就收到串流
+    early = {"on_open": on_open} if on_open is not None and getattr(client, "early_open", False) else {}
+    try:
+        stream = client.chat.completions.create(
+            model=model,
+            messages=messages,
+            stream=True,
+            **({"stream_options": {"include_usage": True}} if usage is not None else {}),
+            **_tool_kwargs(tools),
+            **early,
+        )
+        if on_open is not None:
+            on_open(stream)
+        for chunk in stream:
+            if not chunk.choices:
+                _record_usage(usage, getattr(chunk, "usage", None))
+                continue
+            delta = chunk.choices[0].delta
+            reasoning = getattr(delta, "reasoning_content", None)
+            if reasoning:
+                yield "reasoning", reasoning
+            if delta.content:
+                parts.append(delta.content)
+                yield "content", delta.content
+            if calls is not None and getattr(delta, "tool_calls", None):
+                _collect_calls(calls, delta.tool_calls)
+    except Exception as e:
+        if raise_errors:
+            raise
+        yield "content", f"(呼叫失敗：{e})"
+        return
+    finally:
+        close = getattr(stream, "close", None)
+        if close is not None:
+            close()  # 提早結束（中斷、下游關閉）時一併關掉 HTTP 串流
+    if key is not None and not calls:
+        cache.put(key, "".join(parts))
+
+
+class ReplyError(Exception):
+    """模型呼叫失敗；已收到的部分回覆不完整，不應存入對話記憶或套用其中的寫檔區塊。"""
+
+
+class ReplyStream:
+    """在背景執行緒消耗串流，讓 asyncio 的 REPL 在等待回覆時仍能處理輸入與 Ctrl-C。
+
+    make_chunks(on_open) 回傳 ("reasoning" | "content", 文字) 的迭代器（通常是 iter_model_stream），
+    片段累積在 reply_parts / reasoning_parts。cancel() 標記取消並關閉底層 HTTP 串流；
+    讀取執行緒是 daemon，取消後不必等它結束。
+    """
+
+    def __init__(self, make_chunks: Callable[[Callable[[Any], None]], Iterator[Tuple[str, str]]]):
+        self._make_chunks = make_chunks
+        self.reply_parts: List[str] = []
+        self.reasoning_parts: List[str] = []
+        self.ttft: Optional[float] = None
+        self.elapsed = 0.0
+        self.cancelled = False
+        self._streams: List[Any] = []  # 重試與 hedge 可能開啟多個串流，取消時全部關閉
+        self._lock = threading.Lock()
+
+    @property
+    def reply(self) -> str:
+        return "".join(self.reply_parts)
+
+    @property
+    def reasoning(self) -> str:
+        return "".join(self.reasoning_parts)
+
+    def _opened(self, stream) -> None:
+        with self._lock:
+            self._streams.append(stream)
+            cancelled = self.cancelled
+        if cancelled:
+            _close_stream(stream)
+
+    def cancel(self) -> None:
+        with self._lock:
+            self.cancelled = True
+            streams = list(self._streams)
+        for stream in streams:
+            _close_stream(stream)
+
+    def start(self, loop):
+        """啟動讀取執行緒，回傳完成時得到完整正文的 asyncio.Future（取消它即取消請求）。"""
+        done = loop.create_future()
+        done.add_done_callback(lambda f: self.cancel() if f.cancelled() else None)
+
+        def settle(error: Optional[BaseException]) -> None:
+            if done.done():
+                return
+            if error is not None:
+                done.set_exception(error)
+            else:
+                done.set_result(self.reply)
+
+        def run() -> None:
+            start = time.perf_counter()
+            error = None
+            chunks = self._make_chunks(self._opened)
+            try:
+                for kind, piece in chunks:
+                    if self.cancelled:
+                        break
+                    if self.ttft is None:
+                        self.ttft = time.perf_counter() - start
+                    (self.reasoning_parts if kind == "reasoning" else self.reply_parts).append(piece)
+            except Exception as e:
+                error = e
+            finally:
+                close = getattr(chunks, "close", None)
+                if close is not None:
+                    close()
+            self.elapsed = time.perf_counter() - start
+            try:
+                loop.call_soon_threadsafe(settle, error)
+            except RuntimeError:
+                pass  # 迴圈已關閉（REPL 已結束）
+
+        threading.Thread(target=run, name="deepseek-reply", daemon=True).start()
+        return done
+
+
+def _close_stream(stream) -> None:
+    close = getattr(stream, "close", None)
+    if close is not None:
+        try:
+            close()
+        except Exception:
+            pass
+
+
+class StreamPrinter:
+    """把串流片段節流後交給 Rich Live 即時顯示。
+
+    串流期間只渲染畫面高度內的尾端（成本固定）；結束後收起 Live，
+    再一次性印出完整回覆，輸出與非串流模式相同。思考過程另置一個面板，
+    結束後預設收合為一行摘要（show_reasoning=True 則完整保留）。
+    """
+
+    def __init__(self, console: Console, fps: float = 12.0, show_reasoning: bool = False):
+        self.console = console
+        self.min_interval = 1.0 / max(fps, 1.0)
+        self.show_reasoning = show_reasoning
+        self.reply = ""
+        self.reasoning = ""
+        self.ttft: Optional[float] = None
+        self.elapsed = 0.0
+        self.render_time = 0.0
+        self.usage: Optional[dict] = None
+
+    @staticmethod
+    def _tail(text: str, lines: int) -> str:
+        parts = text.rsplit("\n", lines)
+        return "\n".join(parts[-lines:])
+
+    def _render(self, footer=None):
+        from rich.console import Group
+        from rich.panel import Panel
+        from rich.text import Text
+        height = max(self.console.size.height - 4 - (2 if footer is not None else 0), 4)
+        items = []
+        if self.reasoning:
+            r_lines = max(height // 3, 3) if self.reply else height
+            items.append(Panel(
+                Text(self._tail(self.reasoning, r_lines), style="dim italic"),
+                title="思考中…" if not self.reply else "思考過程",
+                border_style="grey50",
+            ))
+            height -= r_lines + 2
+        if self.reply:
+            items.append(Text(self._tail(self.reply, max(height, 3)), style="bold cyan"))
+        if not items:
+            items.append(Text("…", style="dim"))
+        if footer is not None:
+            items.append(footer)
+        return Group(*items)
+
+    def update(self, reply: str, reasoning: str, footer=None):
+        """更新內容並回傳要交給 Live 的畫面（由 REPL 依 min_interval 節流呼叫）；footer 附在最下方。"""
+        self.reply, self.reasoning = reply, reasoning
+        return self._render(footer)
+
+    def finish(self, reply: str, reasoning: str, ttft: Optional[float], elapsed: float,
+               usage: Optional[dict] = None) -> str:
+        """收起 Live 後印出完整回覆與耗時；usage 有快取欄位時一併顯示命中率。"""
+        self.reply, self.reasoning = reply, reasoning
+        self.ttft, self.elapsed = ttft, elapsed
+        self.usage = usage
+        start = time.perf_counter()
+        self._print_final()
+        self.render_time += time.perf_counter() - start
+        return reply
+
+    def _print_final(self) -> None:
+        from rich.panel import Panel
+        from rich.text import Text
+        if self.reasoning:
+            if self.show_reasoning:
+                self.console.print(Panel(Text(self.reasoning, style="dim italic"),
+                                         title="思考過程", border_style="grey50"))
+            else:
+                self.console.print(Text(
+                    f"▸ 思考過程（{len(self.reasoning)} 字，已收合；config set show_reasoning true 可展開）",
+                    style="dim"))
+        if self.reply or not self.reasoning:
+            self.console.print(Text(self.reply, style="bold cyan"))
+        from .perf import cache_hit_text
+        ttft = f"{self.ttft:.2f}s" if self.ttft is not None else "—"
+        footer = f"首個 token {ttft} · 總計 {self.elapsed:.2f}s"
+        hit = cache_hit_text(self.usage or {})
+        self.console.print(Text(f"{footer} · {hit}" if hit else footer, style="dim"))
+
 
 def chat_loop(console: Console, model: str, client, base_url: str) -> None:
+    from rich.panel import Panel
+    from rich.prompt import Prompt
+    from rich.text import Text
     console.print(
         Panel.fit(
             f"聊天模式\n模型： {model}\nBase URL： {base_url}\n離開：exit / quit / q",
@@ -32,4 +348,4 @@ def chat_loop(console: Console, model: str, client, base_url: str) -> None:
             continue
         if s.lower() in {"exit", "quit", "q"}:
             break
-        console.print(Text(model_say(client, model, s), style="bold cyan"))
\ No newline at end of file
+        console.print(Text(model_say(client, model, s), style="bold cyan"))
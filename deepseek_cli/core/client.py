@@ -0,0 +1,165 @@
+from __future__ import annotations
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Deque, Dict, Optional
+
+from .config import DEFAULT_BASEURL, cfg_flag, cfg_number
+from .retry import backoff_delay, is_retryable, retry_after
+
+HEDGE_MIN_SAMPLES = 8
+LATENCY_WINDOW = 64
+
+
+class _Stream:
+    """已取得第一個 chunk 的串流；迭代時先交出該 chunk，close() 會關閉底層 HTTP 串流。"""
+
+    def __init__(self, stream, first, rest):
+        self._stream = stream
+        self._first = first
+        self._rest = rest
+
+    def __iter__(self):
+        if self._first is not None:
+            first, self._first = self._first, None
+            yield first
+        yield from self._rest
+
+    def close(self) -> None:
+        close = getattr(self._stream, "close", None)
+        if close:
+            close()
+
+
+class _Completions:
+    def __init__(self, owner: "ChatClient"):
+        self.create = owner.create
+
+
+class _Chat:
+    def __init__(self, owner: "ChatClient"):
+        self.completions = _Completions(owner)
+
+
+class ChatClient:
+    """包住 OpenAI client 的呼叫層：連線預熱、重試退避、逾時與可選的 hedged request。
+
+    對外提供與 OpenAI 相同的 client.chat.completions.create(...)，既有呼叫端不需修改。
+    - 重試：408/409/429/5xx 與連線錯誤，指數退避加 jitter，並尊重 Retry-After
+    - hedge：回應（串流則為首個 chunk）慢於近期 p95 時再送一份相同請求，取先完成者
+    - on_open（OpenAI 沒有的參數）：串流請求送出後、等待首個 chunk 之前就收到底層串流，
+      讓其他執行緒在等待首個 token 時也能關閉連線（重試與 hedge 每送出一份就呼叫一次）
+    """
+
+    early_open = True  # iter_model_stream 據此改把 on_open 交給 create
+
+    def __init__(self, raw, max_retries: int = 3, hedge: bool = False, hedge_after: float = 0.0):
+        self.raw = raw
+        self.base_url = raw.base_url
+        self.max_retries = max_retries
+        self.hedge = hedge
+        self.hedge_after = hedge_after
+        self.chat = _Chat(self)
+        self.retries = 0
+        self.hedged = 0
+        self._latency: Dict[bool, Deque[float]] = {False: deque(maxlen=LATENCY_WINDOW),
+                                                   True: deque(maxlen=LATENCY_WINDOW)}
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, cfg: dict) -> Optional["ChatClient"]:
+        if not cfg.get("api_key"):
+            return None
+        # 延遲載入：openai 的匯入成本佔啟動時間大半，只有真正要連線時才載入
+        from openai import OpenAI, Timeout
+        base_url = (cfg.get("base_url") or DEFAULT_BASEURL).rstrip("/")
+        raw = OpenAI(
+            api_key=cfg["api_key"],
+            base_url=base_url + "/v1",
+            timeout=Timeout(cfg_number(cfg, "timeout", 120.0), connect=cfg_number(cfg, "connect_timeout", 10.0)),
+            max_retries=0,  # 重試由本層處理
+        )
+        return cls(
+            raw,
+            max_retries=int(cfg_number(cfg, "max_retries", 3)),
+            hedge=cfg_flag(cfg, "hedge", False),
+            hedge_after=cfg_number(cfg, "hedge_after", 0.0),
+        )
+
+    # ---------------------- 預熱 ----------------------
+    def warm_up(self) -> threading.Thread:
+        """於背景執行緒打一次 GET /models，先完成 DNS 與 TLS 並把連線留在 pool 中。"""
+        def run():
+            try:
+                self.raw.with_options(timeout=10.0).models.list()
+            except Exception:
+                pass
+        t = threading.Thread(target=run, name="deepseek-warmup", daemon=True)
+        t.start()
+        return t
+
+    # ---------------------- 呼叫 ----------------------
+    def create(self, on_open: Optional[Callable[[Any], None]] = None, **kwargs: Any):
+        stream = bool(kwargs.get("stream"))
+        for attempt in range(self.max_retries + 1):
+            try:
+                return self._attempt(kwargs, stream, on_open)
+            except Exception as e:
+                if attempt >= self.max_retries or not is_retryable(e):
+                    raise
+                self.retries += 1
+                time.sleep(max(backoff_delay(attempt), retry_after(e) or 0.0))
+
+    def _once(self, kwargs: Dict[str, Any], stream: bool, on_open: Optional[Callable[[Any], None]] = None):
+        start = time.perf_counter()
+        resp = self.raw.chat.completions.create(**kwargs)
+        if stream:
+            if on_open is not None:
+                on_open(resp)
+            it = iter(resp)
+            resp = _Stream(resp, next(it, None), it)
+        with self._lock:
+            self._latency[stream].append(time.perf_counter() - start)
+        return resp
+
+    def hedge_threshold(self, stream: bool) -> Optional[float]:
+        """近期延遲的 p95（串流看首個 chunk）；樣本不足時使用 hedge_after（0 表示不 hedge）。"""
+        with self._lock:
+            samples = sorted(self._latency[stream])
+        if len(samples) >= HEDGE_MIN_SAMPLES:
+            return samples[int(0.95 * (len(samples) - 1))]
+        return self.hedge_after or None
+
+    def _attempt(self, kwargs: Dict[str, Any], stream: bool, on_open: Optional[Callable[[Any], None]] = None):
+        threshold = self.hedge_threshold(stream) if self.hedge else None
+        if threshold is None:
+            return self._once(kwargs, stream, on_open)
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="deepseek-hedge")
+        first = self._pool.submit(self._once, kwargs, stream, on_open)
+        done, _ = wait([first], timeout=threshold)
+        if done:
+            return first.result()
+        self.hedged += 1
+        second = self._pool.submit(self._once, kwargs, stream, on_open)
+        pending = {first, second}
+        error: Optional[BaseException] = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            winners = [f for f in done if f.exception() is None]
+            if winners:
+                for loser in winners[1:]:
+                    _close_result(loser)
+                for loser in pending:
+                    loser.add_done_callback(_close_result)
+                return winners[0].result()
+            error = next(iter(done)).exception()
+        raise error  # 兩份請求都失敗
+
+
+def _close_result(fut) -> None:
+    """hedge 落敗的一方：若是串流，完成後立即關閉以釋放連線。"""
+    if fut.exception() is None and isinstance(fut.result(), _Stream):
+        fut.result().close()
@@ -1,24 +1,295 @@
-import os, readline
+from __future__ import annotations
+import os
+import re
+import threading
+import time
+from collections import Counter
 from pathlib import Path
+from typing import Dict, List, Optional, Tuple
 
-def _path_candidates(text: str):
+from .ingest import ALWAYS_SKIP, IgnoreRules, _ancestor_rules, _is_ignored
+
+MAX_CANDIDATES = 50     # 每次 Tab 最多列出的候選數
+MAX_SCAN = 2000         # 最多收集的命中數（之後才排序）
+SCAN_CHUNK = 2048       # 逐行掃描時每批行數（每批檢查一次時間）
+SEARCH_BUDGET = 0.006   # 單次比對的時間上限（秒）
+REFRESH_INTERVAL = 2.0  # 兩次背景刷新的最短間隔（秒）
+
+
+class PathIndex:
+    """專案路徑索引：背景執行緒建立，之後依目錄 mtime 增量刷新。
+
+    所有相對路徑（資料夾以 / 結尾）依深度排序後串成一個以換行分隔的字串；
+    比對時先用 str.find 跳到含最稀有查詢字元的行，十萬個檔案也能在數毫秒內完成。
+    """
+
+    def __init__(self, root: Path):
+        self.root = os.path.realpath(str(root))
+        self.ready = threading.Event()
+        # 相對目錄（根目錄為 ""）→ (mtime_ns, [子項目名稱；資料夾以 / 結尾])
+        self._dirs: Dict[str, Tuple[int, List[str]]] = {}
+        self._rules: Dict[str, Tuple[IgnoreRules, ...]] = {}
+        # (原始 blob, 小寫 blob, 小寫路徑, 原始路徑, 字元出現次數)；整組替換，比對端不需上鎖
+        self._snapshot: Optional[Tuple[str, str, List[str], List[str], Counter]] = None
+        self._refreshed = 0.0
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    # ---------------------- 建立 / 刷新 ----------------------
+    def start(self) -> "PathIndex":
+        self._spawn()
+        return self
+
+    def _spawn(self) -> None:
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._refresh, name="deepseek-pathindex", daemon=True)
+            self._thread.start()
+
+    def maybe_refresh(self) -> None:
+        """距離上次刷新超過 REFRESH_INTERVAL 時於背景刷新；不阻塞呼叫端。"""
+        if time.monotonic() - self._refreshed >= REFRESH_INTERVAL:
+            self._spawn()
+
+    def _scan(self, rel: str, chain: Tuple[IgnoreRules, ...], mtime: int) -> None:
+        """列出單一目錄；已在索引中的子目錄保留原狀，新的子目錄遞迴掃描，消失的整棵移除。"""
+        full = os.path.join(self.root, rel) if rel else self.root
+        rules = IgnoreRules.load(full)
+        if rules:
+            chain = chain + (rules,)
+        self._rules[rel] = chain
+        names: List[str] = []
+        subdirs: List[str] = []
+        try:
+            with os.scandir(full) as it:
+                for entry in it:
+                    if entry.name in ALWAYS_SKIP:
+                        continue
+                    try:
+                        is_dir = entry.is_dir(follow_symlinks=False)
+                    except OSError:
+                        continue
+                    if _is_ignored(chain, entry.path, is_dir):
+                        continue
+                    if is_dir:
+                        names.append(entry.name + "/")
+                        subdirs.append(f"{rel}/{entry.name}" if rel else entry.name)
+                    else:
+                        names.append(entry.name)
+        except OSError:
+            pass
+        old = self._dirs.get(rel)
+        self._dirs[rel] = (mtime, names)
+        if old is not None:
+            prefix = f"{rel}/" if rel else ""
+            for gone in {prefix + n[:-1] for n in old[1] if n.endswith("/")} - set(subdirs):
+                self._drop(gone)
+        for child in subdirs:
+            if child in self._dirs:
+                continue
+            try:
+                child_mtime = os.stat(os.path.join(self.root, child)).st_mtime_ns
+            except OSError:
+                continue
+            self._scan(child, chain, child_mtime)
+
+    def _drop(self, rel: str) -> None:
+        prefix = rel + "/"
+        for d in [d for d in self._dirs if d == rel or d.startswith(prefix)]:
+            self._dirs.pop(d, None)
+            self._rules.pop(d, None)
+
+    def _refresh(self) -> None:
+        """每個已知目錄 stat 一次，只重新列出 mtime 有變的目錄。"""
+        try:
+            if not self._dirs:
+                self._scan("", _ancestor_rules(self.root), os.stat(self.root).st_mtime_ns)
+            else:
+                stale = []
+                for rel, (mtime, _) in list(self._dirs.items()):
+                    try:
+                        now = os.stat(os.path.join(self.root, rel) if rel else self.root).st_mtime_ns
+                    except OSError:
+                        now = None
+                    if now != mtime:
+                        stale.append((rel, now))
+                for rel, now in sorted(stale, key=lambda item: item[0].count("/")):
+                    if rel not in self._dirs:
+                        continue  # 已隨上層一併移除
+                    if now is None:
+                        self._drop(rel)
+                        continue
+                    parent = rel.rpartition("/")[0]
+                    chain = self._rules.get(parent, ()) if rel else _ancestor_rules(self.root)
+                    self._scan(rel, chain, now)
+                if not stale:
+                    return
+            self._rebuild()
+        except Exception:
+            pass
+        finally:
+            self._refreshed = time.monotonic()
+            self.ready.set()
+
+    def _rebuild(self) -> None:
+        paths = []
+        for rel, (_, names) in sorted(self._dirs.items(), key=lambda kv: (kv[0].count("/") + bool(kv[0]), kv[0])):
+            prefix = rel + "/" if rel else ""
+            paths.extend(prefix + n for n in sorted(names))
+        # 小寫版本需與原字串等長，兩份 blob 的位移才能對齊（極少數字元 lower() 會變長，保留原樣）
+        lower = [l if len(l) == len(p) else p for p, l in ((p, p.lower()) for p in paths)]
+        blob = "\n" + "\n".join(lower) + "\n"
+        self._snapshot = (
+            "\n" + "\n".join(paths) + "\n",
+            blob,
+            lower,
+            paths,
+            Counter(blob),
+        )
+
+    def __len__(self) -> int:
+        return len(self._snapshot[3]) if self._snapshot else 0
+
+    # ---------------------- 比對 ----------------------
+    @staticmethod
+    def _matches_by_find(blob: str, lower_blob: str, needle: str, rx, deadline: float):
+        """以 str.find 跳到含 needle 的行（在 C 層跳躍），rx 不為 None 時再做子序列比對。"""
+        find, rfind = lower_blob.find, lower_blob.rfind
+        i = 0
+        n = 0
+        while True:
+            i = find(needle, i)
+            if i < 0:
+                return
+            start = rfind("\n", 0, i) + 1
+            end = find("\n", i)
+            if rx is None or rx.search(lower_blob, start, end):
+                yield blob[start:end], lower_blob[start:end]
+            i = end
+            n += 1
+            if not n % 256 and time.perf_counter() > deadline:
+                return
+
+    @staticmethod
+    def _matches_by_scan(paths: List[str], lower: List[str], rx, deadline: float):
+        for lo in range(0, len(lower), SCAN_CHUNK):
+            chunk = lower[lo:lo + SCAN_CHUNK]
+            for i, line in enumerate(chunk):
+                if rx.search(line):
+                    yield paths[lo + i], line
+            if time.perf_counter() > deadline:
+                return
+
+    def search(self, query: str, limit: int = MAX_CANDIDATES) -> List[str]:
+        """模糊比對（子序列）：@mainpy → deepseek_cli/main.py。
+
+        先找含連續子字串的路徑，不足時再做子序列比對：以最稀有的字元縮小範圍，
+        字元都很常見時改為逐行掃描。整體有 SEARCH_BUDGET 的時間上限，收集 MAX_SCAN 筆後停止。
+        排序：路徑前綴 → 檔名子字串 → 路徑子字串 → 檔名子序列 → 路徑子序列，同層以較短檔名、較淺路徑優先。
+        """
+        snapshot = self._snapshot
+        q = query.lower()
+        if not snapshot or not q:
+            return []
+        blob, lower_blob, lower, paths, counts = snapshot
+        deadline = time.perf_counter() + SEARCH_BUDGET
+        # 每個字元取其後第一次出現：最早的配對即最佳，regex 不需回溯
+        rx = re.compile("".join(f"{re.escape(c)}[^{re.escape(c)}]*" for c in q[:-1]) + re.escape(q[-1]))
+        rare = min(set(q), key=lambda c: counts.get(c, 0))
+        if not counts.get(rare):
+            return []
+
+        ranked = []
+        seen = set()
+        passes = [self._matches_by_find(blob, lower_blob, q, None, deadline)]
+        if counts[rare] * 4 < len(paths):
+            passes.append(self._matches_by_find(blob, lower_blob, rare, rx, deadline))
+        else:
+            passes.append(self._matches_by_scan(paths, lower, rx, deadline))
+        for hits in passes:
+            for path, low in hits:
+                if path in seen:
+                    continue
+                seen.add(path)
+                base = low.rstrip("/").rpartition("/")[2]
+                if low.startswith(q):
+                    tier = 0
+                elif q in base:
+                    tier = 1
+                elif q in low:
+                    tier = 2
+                elif rx.search(base):
+                    tier = 3
+                else:
+                    tier = 4
+                ranked.append((tier, len(base), low.count("/"), len(low), path))
+                if len(ranked) >= MAX_SCAN:
+                    break
+            if len(ranked) >= limit:
+                break  # 連續子字串已足夠，不必再做子序列比對
+        ranked.sort()
+        return [item[-1] for item in ranked[:limit]]
+
+
+_index: Optional[PathIndex] = None
+
+
+def _path_candidates(text: str) -> List[str]:
+    """列出某個目錄中以 text 為前綴的項目（用於 ~/、/、../ 這類專案外的路徑）。"""
     p = Path(os.path.expanduser(text or "."))
-    base = p if p.is_dir() else p.parent
-    prefix = "" if p.is_dir() else p.name
+    is_dir = text.endswith("/") or not text
+    base = p if is_dir else p.parent
+    prefix = "" if is_dir else p.name
+    head = text if is_dir else text[:len(text) - len(prefix)]
     try:
-        return [str((base / e.name).expanduser()) + ("/" if e.is_dir() else "")
-                for e in base.iterdir() if e.name.startswith(prefix)]
-    except Exception:
+        with os.scandir(base) as it:
+            return sorted(head + e.name + ("/" if e.is_dir() else "")
+                          for e in it if e.name.startswith(prefix))
+    except OSError:
         return []
 
+
+def _candidates(text: str) -> List[str]:
+    query = text[1:]
+    if query.startswith(("/", "~", "..")):
+        return ["@" + c for c in _path_candidates(query)[:MAX_CANDIDATES]]
+    literal = _path_candidates(query) if "/" in query or query.startswith(".") else []
+    cands: Dict[str, None] = dict.fromkeys(literal[:MAX_CANDIDATES])
+    if _index is not None:
+        _index.maybe_refresh()
+        for path in _index.search(query.removeprefix("./")):
+            if len(cands) >= MAX_CANDIDATES:
+                break
+            cands.setdefault(path, None)
+    return ["@" + c for c in cands]
+
+
+_last: Tuple[str, List[str]] = ("", [])
+
+
 def _completion_hook(text, state):
-    buf = readline.get_line_buffer().lstrip()
-    if buf.startswith("@"):
-        cands = ["@" + c for c in _path_candidates(buf[1:])]
-        return cands[state] if state < len(cands) else None
-    return None
+    global _last
+    if not text.startswith("@"):
+        return None
+    # readline 對同一次 Tab 會以 state=0,1,2… 反覆呼叫；只在 state 0 時計算一次
+    if state == 0 or _last[0] != text:
+        _last = (text, _candidates(text))
+    cands = _last[1]
+    return cands[state] if state < len(cands) else None
+
 
-def enable_tab_completion():
+def enable_tab_completion(root: Optional[Path] = None):
+    # readline 只在進入 REPL 時載入（子指令用不到；部分平台也沒有 readline）
+    global _index
+    try:
+        import readline
+    except ImportError:
+        return
     try: readline.parse_and_bind("tab: complete")
     except Exception: pass
+    # 以空白切詞：讓 text 拿到完整的 @路徑（預設的分隔字元包含 @ 與 /）
+    readline.set_completer_delims(" \t\n")
     readline.set_completer(_completion_hook)
+    if _index is None:
+        _index = PathIndex(root or Path.cwd()).start()
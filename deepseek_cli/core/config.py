@@ -1,12 +1,14 @@
 from __future__ import annotations
 import json
 from pathlib import Path
-from platformdirs import user_config_dir
+from platformdirs import user_cache_dir, user_config_dir, user_data_dir
 
 APP_NAME = "deepseek"
 APP_AUTHOR = "deepseek"
 CONFIG_DIR = Path(user_config_dir(APP_NAME, APP_AUTHOR))
 CONFIG_PATH = CONFIG_DIR / "config.json"
+CACHE_DIR = Path(user_cache_dir(APP_NAME, APP_AUTHOR))
+DATA_DIR = Path(user_data_dir(APP_NAME, APP_AUTHOR))  # 需長期保留的資料（對話紀錄）
 
 DEFAULT_MODEL = "deepseek-chat"
 SUPPORTED_MODELS = ["deepseek-chat", "deepseek-reasoner"]
@@ -30,3 +32,17 @@ def normalize_with_defaults(cfg: dict) -> dict:
     if not cfg.get("model"):
         cfg["model"] = DEFAULT_MODEL
     return cfg
+
+def cfg_flag(cfg: dict, key: str, default: bool = False) -> bool:
+    """讀取布林設定；`config set` 寫入的是字串，故一併接受 "true"/"1"/"on" 等寫法。"""
+    val = cfg.get(key, default)
+    if isinstance(val, str):
+        return val.strip().lower() in {"1", "true", "yes", "on"}
+    return bool(val)
+
+def cfg_number(cfg: dict, key: str, default: float) -> float:
+    """讀取數值設定；無法解析時回傳預設值。"""
+    try:
+        return float(cfg.get(key, default))
+    except (TypeError, ValueError):
+        return default
@@ -0,0 +1,93 @@
+from __future__ import annotations
+import os
+import re
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+from .config import cfg_number
+from .edits import EDIT_INSTRUCTION
+from .filecache import FileAttachment, FileCache, render_files_first
+from .ingest import IngestStats, ingest_dir
+
+WRITE_BLOCK_RE = re.compile(r"<<<WRITE[ \t]+([^\n]+?)\n(.*?)\n>>>END", re.DOTALL)  # 路徑限單行，避免回溯爆量
+AT_MENTION_RE = re.compile(r"@([^\s]+)")  # 連續非空白視為路徑（支援相對/含副檔名）
+
+
+def expand_at_mentions(s: str) -> List[Path]:
+    """抓出訊息中所有 @路徑，轉為 Path（不檢查存在）。結尾的 !（要求完整內容）會被去掉。"""
+    return [Path(os.path.expanduser(m.group(1).rstrip("!") or m.group(1))) for m in AT_MENTION_RE.finditer(s)]
+
+
+def whole_file_mentions(s: str) -> List[Path]:
+    """以 @路徑! 標注、要求完整送出（不做段落檢索）的檔案。"""
+    return [Path(os.path.expanduser(m.group(1)[:-1])) for m in AT_MENTION_RE.finditer(s)
+            if m.group(1).endswith("!") and len(m.group(1)) > 1]
+
+
+def read_context_files(paths: List[Path], cache: FileCache, cfg: dict,
+                       report: Optional[Callable[[str], None]] = None) -> Dict[Path, FileAttachment]:
+    """讀取 @檔案與 @資料夾內容（不含同意檢查，由呼叫端負責）。
+
+    report 接收 Rich markup 訊息（讀取失敗、資料夾展開摘要）；不存在的路徑會略過。
+    """
+    contents: Dict[Path, FileAttachment] = {}
+    for p in paths:
+        try:
+            if p.is_file():
+                key, text = cache.read(p)
+                contents[p] = FileAttachment(p, key, text)
+            elif p.is_dir():
+                stats = IngestStats()
+                for fp, key, text in ingest_dir(
+                    p, cache,
+                    max_file_bytes=int(cfg_number(cfg, "dir_max_file_kb", 128) * 1024),
+                    max_total_bytes=int(cfg_number(cfg, "dir_max_total_kb", 512) * 1024),
+                    stats=stats,
+                ):
+                    contents.setdefault(fp, FileAttachment(fp, key, text))
+                if report:
+                    report(f"[dim]@{p}：{stats.summary()}[/]")
+        except Exception as e:
+            if report:
+                report(f"[red]讀取失敗[/] {p}: {e}")
+    return contents
+
+
+def write_targets(mentions: List[Path], file_map: Dict[Path, FileAttachment]) -> List[Path]:
+    """寫檔白名單：@ 提及的路徑，加上 @資料夾展開、且實際位置仍在該資料夾內的檔案。
+
+    展開出的檔案先 resolve 再比對：指向資料夾外的符號連結不會因為 @資料夾 而變成可寫。
+    """
+    roots = [p.resolve() for p in mentions if p.is_dir()]
+    targets = list(mentions)
+    for path in file_map:
+        real = path.resolve()
+        if any(root in real.parents for root in roots):
+            targets.append(path)
+    return targets
+
+
+def build_chat_prompt(user_msg: str, file_map: Dict[Path, FileAttachment],
+                      cache: Optional[FileCache] = None, edits: bool = True, stable: bool = False) -> str:
+    """將 @檔案內容附加到使用者訊息後方，讓模型有完整上下文。
+
+    edits=False 時不附寫檔區塊的說明（呼叫端不會套用回覆中的區塊，例如管線模式）。
+    stable=True 時改為前綴快取友善的排列：附檔依路徑排序在前、使用者訊息在後，
+    寫檔說明不放在這裡，而是由 system_messages() 放在整串 messages 的最前面。
+    """
+    if stable:
+        return render_files_first(user_msg, file_map.values(), cache)
+    if not file_map:
+        return user_msg
+    parts = [user_msg, "\n\n[FILES CONTEXT]"]
+    for att in file_map.values():
+        parts.append(att.render(cache))
+    # 指導模型：若要寫檔，請輸出 WRITE / EDIT / PATCH 區塊
+    if edits:
+        parts.append(EDIT_INSTRUCTION)
+    return "\n".join(parts)
+
+
+def system_messages(edits: bool = True) -> List[Dict[str, str]]:
+    """stable 排列用的固定開頭：每輪、每個工作階段都逐字相同，永遠落在 DeepSeek 的前綴快取內。"""
+    return [{"role": "system", "content": EDIT_INSTRUCTION.strip()}] if edits else []
@@ -0,0 +1,299 @@
+from __future__ import annotations
+import json
+import os
+import re
+import shutil
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from .config import CACHE_DIR
+
+UNDO_DIR = CACHE_DIR / "undo"
+UNDO_KEEP = 20
+
+# <<<WRITE 路徑 / <<<EDIT 路徑 / <<<PATCH 路徑 ... >>>END；只以 regex 比對開頭那一行，
+# 結尾以 str.find 尋找，未結束的區塊不會造成回溯（數 MB 的回覆也是線性時間）
+EDIT_HEAD_RE = re.compile(r"<<<(WRITE|EDIT|PATCH)[ \t]+([^\n]+)\n")
+EDIT_END = ">>>END"
+SEARCH_REPLACE_RE = re.compile(
+    r"^<{7} SEARCH\n(.*?)^={7}\n(.*?)^>{7} REPLACE$", re.DOTALL | re.MULTILINE
+)
+HUNK_HEADER_RE = re.compile(r"^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@")
+
+EDIT_INSTRUCTION = (
+    "\n[INSTRUCTION]\n"
+    "若需要修改或建立檔案，請輸出以下任一格式（一次可多個）；小幅修改請優先使用 EDIT 或 PATCH：\n"
+    "1) 局部取代（SEARCH 必須與原檔逐字相符且只出現一次，可重複多段）：\n"
+    "<<<EDIT 路徑\n"
+    "<<<<<<< SEARCH\n"
+    "<原本的幾行>\n"
+    "=======\n"
+    "<取代後的幾行>\n"
+    ">>>>>>> REPLACE\n"
+    ">>>END\n"
+    "2) unified diff（@@ 區段需含足夠的上下文行）：\n"
+    "<<<PATCH 路徑\n"
+    "@@ -起始,行數 +起始,行數 @@\n"
+    " 上下文\n"
+    "-刪除的行\n"
+    "+新增的行\n"
+    ">>>END\n"
+    "3) 新檔或需要整檔重寫時：\n"
+    "<<<WRITE 路徑\n"
+    "<完整檔案內容>\n"
+    ">>>END\n"
+)
+
+
+class EditError(Exception):
+    """編輯區塊無法套用（SEARCH 找不到、diff 上下文不符等）。"""
+
+
+class EditOp:
+    __slots__ = ("kind", "raw_path", "body")
+
+    def __init__(self, kind: str, raw_path: str, body: str):
+        self.kind = kind
+        self.raw_path = raw_path.strip()
+        self.body = body
+
+    @property
+    def path(self) -> Path:
+        return Path(os.path.expanduser(self.raw_path)).resolve()
+
+
+def parse_edit_blocks(reply: str) -> List[EditOp]:
+    ops: List[EditOp] = []
+    pos = 0
+    while True:
+        m = EDIT_HEAD_RE.search(reply, pos)
+        if m is None:
+            return ops
+        end = reply.find(EDIT_END, m.end() - 1)
+        if end == -1:
+            return ops  # 之後的區塊也不可能有結尾
+        body = reply[m.end():end] if end >= m.end() else ""
+        if body.endswith("\n"):
+            body = body[:-1]
+        ops.append(EditOp(m.group(1), m.group(2), body))
+        pos = end + len(EDIT_END)
+
+
+# ───────────────────────────── 套用（純記憶體） ─────────────────────────────
+def _find_unique(text: str, needle: str) -> Tuple[int, int]:
+    """回傳 needle 在 text 中唯一出現的位置；逐字比對失敗時，退而忽略行尾空白再比一次。"""
+    if needle == "":
+        raise EditError("SEARCH 區段是空的")
+    count = text.count(needle)
+    if count == 1:
+        i = text.index(needle)
+        return i, i + len(needle)
+    if count > 1:
+        raise EditError(f"SEARCH 出現 {count} 次，請加入更多上下文：{needle.splitlines()[0][:60]!r}")
+    lines = text.splitlines(keepends=True)
+    want = [l.rstrip() for l in needle.splitlines()]
+    stripped = [l.rstrip() for l in lines]
+    hits = [i for i in range(len(lines) - len(want) + 1) if stripped[i:i + len(want)] == want]
+    if len(hits) != 1:
+        first = needle.splitlines()[0][:60]
+        raise EditError(f"SEARCH 找不到{'唯一的' if hits else ''}相符內容：{first!r}")
+    start = sum(len(l) for l in lines[:hits[0]])
+    end = start + sum(len(l) for l in lines[hits[0]:hits[0] + len(want)])
+    return start, end
+
+
+def _line_ending(text: str) -> str:
+    """以第一個換行判斷檔案的行尾（CRLF 或 LF）。"""
+    i = text.find("\n")
+    return "\r\n" if i > 0 and text[i - 1] == "\r" else "\n"
+
+
+def apply_search_replace(text: str, body: str) -> str:
+    """依序套用 SEARCH/REPLACE 段落；REPLACE 的行尾轉成原檔的行尾，CRLF 檔案不會混入 LF。"""
+    hunks = SEARCH_REPLACE_RE.findall(body + ("\n" if not body.endswith("\n") else ""))
+    if not hunks:
+        raise EditError("EDIT 區塊中沒有 SEARCH/REPLACE 段落")
+    eol = _line_ending(text)
+    for search, replace in hunks:
+        start, end = _find_unique(text, search)
+        if eol != "\n":
+            replace = replace.replace("\r\n", "\n").replace("\n", eol)
+        if text[start:end].endswith("\n") and replace and not replace.endswith("\n"):
+            replace += eol
+        text = text[:start] + replace + text[end:]
+    return text
+
+
+def apply_unified_diff(text: str, body: str) -> str:
+    """套用 unified diff。每個 @@ 區段先在宣告的行號比對，不符時在附近搜尋（容許行號偏移）。"""
+    lines = text.splitlines(keepends=True)
+    hunks: List[Tuple[int, int, List[str]]] = []
+    current: Optional[List[str]] = None
+    for raw in body.splitlines():
+        if raw.startswith(("--- ", "+++ ")) and current is None:
+            continue
+        m = HUNK_HEADER_RE.match(raw)
+        if m:
+            current = []
+            hunks.append((int(m.group(1)), int(m.group(2) or 1), current))
+        elif current is not None and (raw[:1] in (" ", "-", "+") or raw == ""):
+            current.append(raw if raw else " ")
+        elif current is not None and raw.startswith("\\"):
+            continue  # "\ No newline at end of file"
+    if not hunks:
+        raise EditError("PATCH 區塊中沒有 @@ 區段")
+
+    offset = 0
+    eol = _line_ending(text)
+    for start, count, hunk in hunks:
+        old = [l[1:] for l in hunk if l[0] in " -"]
+        new = [l[1:] for l in hunk if l[0] in " +"]
+        stripped = [l.rstrip("\r\n").rstrip() for l in lines]
+        want = [l.rstrip() for l in old]
+        # 舊行數為 0（純新增）時 start 是「插在第 start 行之後」，否則是第一個舊行的行號
+        guess = min(max(start + offset if count == 0 else start - 1 + offset, 0), len(lines))
+        pos = None
+        for delta in range(0, len(lines) + 1):
+            for cand in (guess - delta, guess + delta) if delta else (guess,):
+                if 0 <= cand <= len(lines) - len(want) and stripped[cand:cand + len(want)] == want:
+                    pos = cand
+                    break
+            if pos is not None:
+                break
+        if pos is None:
+            first = (old[0] if old else "").strip()[:60]
+            raise EditError(f"PATCH 區段（第 {start} 行附近）上下文不符：{first!r}")
+        replaced = [l + eol for l in new]
+        if pos + len(old) == len(lines) and lines and not lines[-1].endswith("\n") and replaced:
+            replaced[-1] = replaced[-1][:-len(eol)]
+            if not old:
+                lines[-1] += eol  # 接在沒有結尾換行的最後一行之後
+        lines[pos:pos + len(old)] = replaced
+        offset += len(new) - len(old)
+    return "".join(lines)
+
+
+def plan_edits(ops: List[EditOp]) -> Dict[Path, Tuple[Optional[str], str]]:
+    """在記憶體中依序套用所有區塊，回傳 {路徑: (原內容或 None, 新內容)}。
+
+    任何一個區塊失敗就拋出 EditError，不會寫入任何檔案。
+    """
+    plan: Dict[Path, Tuple[Optional[str], str]] = {}
+    for op in ops:
+        path = op.path
+        if path in plan:
+            original, current = plan[path]
+        else:
+            original = _read(path) if path.is_file() else None
+            current = original
+        if op.kind == "WRITE":
+            new = op.body
+        elif current is None:
+            raise EditError(f"{op.kind} 的目標不存在：{path}")
+        elif op.kind == "EDIT":
+            try:
+                new = apply_search_replace(current, op.body)
+            except EditError as e:
+                raise EditError(f"{path}: {e}") from None
+        else:
+            try:
+                new = apply_unified_diff(current, op.body)
+            except EditError as e:
+                raise EditError(f"{path}: {e}") from None
+        plan[path] = (original, new)
+    return plan
+
+
+# ───────────────────────────── 寫入（原子化、平行） ─────────────────────────────
+def _read(path: Path) -> str:
+    """以位元組讀取再解碼：保留 CRLF，非 UTF-8 位元組也能原樣寫回。"""
+    return path.read_bytes().decode("utf-8", errors="surrogateescape")
+
+
+def atomic_write(path: Path, text: str) -> None:
+    """寫入暫存檔、fsync 後 rename 取代目標；中途失敗不會留下半寫的檔案。"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    mode = path.stat().st_mode & 0o7777 if path.exists() else None
+    fd, tmp = tempfile.mkstemp(prefix=f".{path.name}.", suffix=".tmp", dir=str(path.parent))
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8", errors="surrogateescape", newline="") as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        if mode is not None:
+            os.chmod(tmp, mode)
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+    if os.name == "posix":
+        dir_fd = os.open(str(path.parent), os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+
+def _journal(plan: Dict[Path, Tuple[Optional[str], str]]) -> Path:
+    """把原內容存成一筆 undo 紀錄（只保留最近 UNDO_KEEP 筆）。"""
+    entry = UNDO_DIR / f"{time.time_ns():020d}"
+    entry.mkdir(parents=True)
+    manifest = []
+    for i, (path, (original, _)) in enumerate(plan.items()):
+        backup = None
+        if original is not None:
+            backup = f"{i}.orig"
+            (entry / backup).write_text(original, encoding="utf-8", errors="surrogateescape", newline="")
+        manifest.append({"path": str(path), "backup": backup})
+    (entry / "manifest.json").write_text(json.dumps(manifest, ensure_ascii=False), encoding="utf-8")
+    entries = sorted(UNDO_DIR.glob("*/manifest.json"))
+    for old in entries[:-UNDO_KEEP]:
+        shutil.rmtree(old.parent, ignore_errors=True)
+    return entry
+
+
+def commit_plan(plan: Dict[Path, Tuple[Optional[str], str]], journal: bool = True,
+                workers: int = 8) -> List[Tuple[Path, Optional[Exception]]]:
+    """平行原子寫入所有檔案（內容未變的略過），回傳每個檔案的 (路徑, 錯誤或 None)。"""
+    todo = [(p, new) for p, (old, new) in plan.items() if old != new]
+    if not todo:
+        return []
+    if journal:
+        _journal({p: plan[p] for p, _ in todo})
+
+    def write(item: Tuple[Path, str]) -> Tuple[Path, Optional[Exception]]:
+        try:
+            atomic_write(*item)
+            return item[0], None
+        except Exception as e:
+            return item[0], e
+
+    if len(todo) == 1:
+        return [write(todo[0])]
+    with ThreadPoolExecutor(max_workers=min(workers, len(todo)), thread_name_prefix="deepseek-write") as pool:
+        return list(pool.map(write, todo))
+
+
+def undo_last() -> List[Path]:
+    """還原最近一次寫入：有備份的檔案寫回原內容，當時新建的檔案刪除。回傳受影響的路徑。"""
+    entries = sorted(UNDO_DIR.glob("*/manifest.json"))
+    if not entries:
+        return []
+    entry = entries[-1].parent
+    restored = []
+    for item in json.loads(entries[-1].read_text(encoding="utf-8")):
+        path = Path(item["path"])
+        if item["backup"] is None:
+            if path.exists():
+                path.unlink()
+        else:
+            atomic_write(path, _read(entry / item["backup"]))
+        restored.append(path)
+    shutil.rmtree(entry, ignore_errors=True)
+    return restored
@@ -0,0 +1,148 @@
+from __future__ import annotations
+import difflib
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Iterable, Optional, Tuple
+
+FileKey = Tuple[str, int, int]  # (絕對路徑, 位元組大小, mtime_ns)
+
+DIFF_MAX_BYTES = 2 * 1024 * 1024  # 超過此大小不做 diff，直接重送
+
+
+class FileCache:
+    """以 (路徑, 大小, mtime_ns) 為鍵的行程內 LRU 檔案快取，總大小受 max_bytes 限制。
+
+    檔案內容不變時只需一次 stat 即可命中；任何修改都會改變 mtime/size，
+    舊鍵自然失效並隨 LRU 淘汰。
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[FileKey, str]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key_for(path: Path) -> FileKey:
+        st = os.stat(path)
+        return (str(Path(path).resolve()), st.st_size, st.st_mtime_ns)
+
+    def get(self, key: FileKey) -> Optional[str]:
+        with self._lock:
+            text = self._data.get(key)
+            if text is not None:
+                self._data.move_to_end(key)
+            return text
+
+    def put(self, key: FileKey, text: str) -> None:
+        size = key[1]
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                return
+            self._data[key] = text
+            self._bytes += size
+            while self._bytes > self.max_bytes and self._data:
+                old_key, _ = self._data.popitem(last=False)
+                self._bytes -= old_key[1]
+
+    def read(self, path: Path) -> Tuple[FileKey, str]:
+        """讀取檔案（命中快取則不碰磁碟內容），回傳 (鍵, 文字)。"""
+        key = self.key_for(path)
+        text = self.get(key)
+        if text is not None:
+            self.hits += 1
+            return key, text
+        self.misses += 1
+        text = Path(path).read_text(encoding="utf-8", errors="ignore")
+        self.put(key, text)
+        return key, text
+
+
+class FileAttachment:
+    """本輪附給模型的一個 @檔案。
+
+    mode 為 "full"（完整內容）、"diff"（相對第 since 輪的 unified diff）、
+    "same"（與第 since 輪相同，不重送）或 "excerpt"（只送與問題相關的段落，存於 delta）。存入對話歷史後 text 會被清掉，
+    之後重組 messages 時再依 key 從 FileCache 取回（by reference）。
+    """
+
+    __slots__ = ("path", "key", "text", "mode", "since", "delta")
+
+    def __init__(self, path: Path, key: FileKey, text: Optional[str]):
+        self.path = path
+        self.key = key
+        self.text = text
+        self.mode = "full"
+        self.since: Optional[int] = None
+        self.delta = ""
+
+    def reset(self) -> None:
+        self.mode, self.since, self.delta = "full", None, ""
+
+    def plan_delta(self, prev_key: FileKey, prev_turn: int, cache: FileCache,
+                   max_ratio: float = 0.5) -> bool:
+        """與模型先前看過的版本比較；可改送註記或 diff 時回傳 True。"""
+        if prev_key == self.key:
+            self.mode, self.since = "same", prev_turn
+            return True
+        if self.text is None or self.key[1] > DIFF_MAX_BYTES:
+            return False
+        old = cache.get(prev_key)
+        if old is None:
+            return False
+        delta = "".join(difflib.unified_diff(
+            old.splitlines(keepends=True), self.text.splitlines(keepends=True),
+            fromfile=f"{self.path} (第 {prev_turn} 輪)", tofile=f"{self.path} (目前)", n=2,
+        ))
+        if len(delta) >= len(self.text) * max_ratio:
+            return False
+        self.mode, self.since, self.delta = "diff", prev_turn, delta
+        return True
+
+    def content(self, cache: Optional[FileCache]) -> Optional[str]:
+        if self.text is not None:
+            return self.text
+        if cache is None:
+            return None
+        text = cache.get(self.key)
+        if text is None:
+            try:
+                if cache.key_for(self.path) == self.key:
+                    text = cache.read(self.path)[1]
+            except OSError:
+                pass
+        return text
+
+    def render(self, cache: Optional[FileCache]) -> str:
+        if self.mode == "same":
+            return f"\n### {self.path}\n（內容與第 {self.since} 輪相同，未重送）"
+        if self.mode == "excerpt":
+            if not self.delta:
+                return f"\n### {self.path}\n（檔案過大，沒有與本輪問題相關的段落；需要完整內容請以 @{self.path}! 標注）"
+            return (f"\n### {self.path}\n（檔案過大，只節錄與本輪問題相關的段落；請以 EDIT / PATCH 修改，勿用 WRITE 整檔覆寫）\n"
+                    f"```text\n{self.delta}\n```")
+        if self.mode == "diff":
+            return (f"\n### {self.path}\n（自第 {self.since} 輪後的變更，unified diff）\n"
+                    f"```diff\n{self.delta.rstrip()}\n```")
+        text = self.content(cache)
+        if text is None:
+            return f"\n### {self.path}\n（內容已不在快取中）"
+        return f"\n### {self.path}\n```text\n{text}\n```"
+
+
+def render_files_first(user: str, files: Iterable[FileAttachment], cache: Optional[FileCache]) -> str:
+    """前綴快取友善的排列：附檔依路徑排序放在前面，使用者訊息放最後。
+
+    歷史重送時以同一函式重組，上一輪送出的內容逐字不變，下一輪即可命中 DeepSeek 的前綴快取。
+    """
+    blocks = "".join(a.render(cache) for a in sorted(files, key=lambda a: str(a.path)))
+    if not blocks:
+        return user
+    return f"[FILES CONTEXT]{blocks}\n\n[USER]\n{user}"
@@ -0,0 +1,219 @@
+from __future__ import annotations
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, FrozenSet, List, Optional, Tuple
+
+from .filecache import FileAttachment, FileCache, FileKey, render_files_first
+
+def estimate_tokens(text: str) -> int:
+    """本地估算 token 數（依 DeepSeek 官方換算：英數約 0.3、中文約 0.6 token/字）。"""
+    if not text:
+        return 0
+    n_ascii = len(text.encode("ascii", "ignore"))
+    return int(n_ascii * 0.3 + (len(text) - n_ascii) * 0.6) + 1
+
+
+class Turn:
+    """一輪對話。@檔案以 FileAttachment 記錄（by reference），內容不複製進歷史，
+    組 messages 時才依快取鍵從 FileCache 取回。"""
+
+    __slots__ = ("no", "user", "reply", "files", "tokens")
+
+    def __init__(self, no: int, user: str, reply: str, files: List[FileAttachment],
+                 cache: Optional[FileCache] = None, tokens: Optional[int] = None):
+        self.no = no
+        self.user = user
+        self.reply = reply
+        self.files = files
+        # 從工作階段紀錄載回時沿用存下的 token 數，不必為了估算重讀附檔
+        self.tokens = tokens if tokens is not None else \
+            estimate_tokens(self.user_content(cache)) + estimate_tokens(reply)
+        for att in files:
+            att.text = None
+
+    def user_content(self, cache: Optional[FileCache] = None, stable: bool = False) -> str:
+        if not self.files:
+            return self.user
+        if cache is not None and stable:
+            return render_files_first(self.user, self.files, cache)
+        if cache is None:
+            names = ", ".join(str(a.path) for a in self.files)
+            return f"{self.user}\n[本輪附檔：{names}；內容未保留於歷史]"
+        blocks = "".join(a.render(cache) for a in self.files)
+        return f"{self.user}\n\n[FILES CONTEXT]{blocks}"
+
+    def as_messages(self, cache: Optional[FileCache] = None, stable: bool = False) -> List[Dict[str, str]]:
+        return [
+            {"role": "user", "content": self.user_content(cache, stable)},
+            {"role": "assistant", "content": self.reply},
+        ]
+
+
+class Conversation:
+    """多輪對話記憶，依 token 預算組出送給模型的 messages。
+
+    超出預算時，較舊的輪次會先被略過（evict）；若提供 summarize，
+    則於背景執行緒把它們壓縮成摘要，完成後取代原輪次，不拖慢下一次提問。
+    提供 cache 時，歷史中的 @檔案會依快取重組內容，否則只保留檔名。
+    設定 older 時（接續的工作階段），記憶體只保留放得進預算的最近輪次，
+    視窗仍有空間時再向 older 要更早的輪次。
+    """
+
+    def __init__(self, budget: int = 8000, keep_recent: int = 4,
+                 summarize: Optional[Callable[[str], str]] = None,
+                 cache: Optional[FileCache] = None, stable: bool = False):
+        self.budget = budget
+        self.cache = cache
+        self.stable = stable  # 附檔在前、訊息在後（與本輪提示相同的排列，見 render_files_first）
+        self.keep_recent = keep_recent
+        self.summarize = summarize
+        self.turns: List[Turn] = []
+        self.summary = ""
+        self.turn_no = 0
+        # older(oldest, before, room)：由新到舊回傳 [oldest, before) 之間、總量不超過 room 的輪次
+        self.older: Optional[Callable[[int, int, int], List[Turn]]] = None
+        self.oldest = 1  # 可載回的最早輪次；清除或壓縮後往後推
+        self._lock = threading.Lock()
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._pending: Optional[Future] = None
+        self._generation = 0  # clear() / restore() 時遞增；進行中的壓縮據此丟棄過期結果
+
+    # ---------------------- 寫入 ----------------------
+    def add(self, user: str, reply: str, files: Optional[List[FileAttachment]] = None) -> Turn:
+        self.turn_no += 1
+        turn = Turn(self.turn_no, user, reply, list(files or []), self.cache)
+        with self._lock:
+            self.turns.append(turn)
+        self._maybe_compact()
+        return turn
+
+    def clear(self) -> None:
+        with self._lock:
+            self.turns.clear()
+            self.summary = ""
+            self.oldest = self.turn_no + 1
+            self._generation += 1
+
+    def restore(self, turn_no: int, summary: str, oldest: int,
+                older: Callable[[int, int, int], List[Turn]]) -> int:
+        """接續既有對話：只載入放得進預算的最近輪次，回傳載入數。"""
+        with self._lock:
+            self.turns.clear()
+            self._generation += 1
+            self.turn_no = turn_no
+            self.summary = summary
+            self.oldest = oldest
+        self.older = older
+        return len(self._page_in(turn_no + 1, self.budget - estimate_tokens(summary)))
+
+    # ---------------------- 讀取 ----------------------
+    def total_tokens(self) -> int:
+        with self._lock:
+            return estimate_tokens(self.summary) + sum(t.tokens for t in self.turns)
+
+    def window(self, reserve: int = 0) -> List[Turn]:
+        """由新到舊挑出可放進預算的輪次；reserve 為本輪提示佔用的 token。"""
+        with self._lock:
+            summary = self.summary
+            turns = list(self.turns)
+        room = self.budget - reserve - estimate_tokens(summary)
+        picked: List[Turn] = []
+        for turn in reversed(turns):
+            if turn.tokens > room:
+                break
+            picked.append(turn)
+            room -= turn.tokens
+        else:
+            picked.extend(self._page_in(turns[0].no if turns else self.turn_no + 1, room))
+        picked.reverse()
+        return picked
+
+    def _page_in(self, before: int, room: int) -> List[Turn]:
+        """向 older 取回 before 之前、放得進 room 的輪次（由新到舊），並放回記憶體。"""
+        if self.older is None or before <= self.oldest or room <= 0:
+            return []
+        more = self.older(self.oldest, before, room)
+        with self._lock:
+            first = self.turns[0].no if self.turns else self.turn_no + 1
+            if first != before:
+                return []  # 期間有壓縮或清除，放棄這次載入
+            self.turns[:0] = reversed(more)
+        return more
+
+    def messages(self, reserve: int = 0, turns: Optional[List[Turn]] = None) -> List[Dict[str, str]]:
+        """回傳可放進預算的歷史 messages；可直接傳入 window() 的結果避免重算。"""
+        if turns is None:
+            turns = self.window(reserve)
+        picked: List[Dict[str, str]] = []
+        for turn in turns:
+            picked.extend(turn.as_messages(self.cache, self.stable))
+        with self._lock:
+            summary = self.summary
+        if summary:
+            picked.insert(0, {"role": "system", "content": f"先前對話摘要：\n{summary}"})
+        return picked
+
+    def seen_files(self) -> Dict[str, Tuple[int, FileKey, FrozenSet[int]]]:
+        """模型在歷史中看過的檔案：路徑 → (輪次, 快取鍵, 需保留在視窗內的輪次)。
+
+        "diff" 依賴它的基準輪次，因此相依集合會一路累積；"same" 不提供新內容，不更新。
+        """
+        with self._lock:
+            turns = list(self.turns)
+        seen: Dict[str, Tuple[int, FileKey, FrozenSet[int]]] = {}
+        for turn in turns:
+            for att in turn.files:
+                path = att.key[0]
+                if att.mode == "full":
+                    seen[path] = (turn.no, att.key, frozenset({turn.no}))
+                elif att.mode == "diff" and path in seen and seen[path][0] == att.since:
+                    seen[path] = (turn.no, att.key, seen[path][2] | {turn.no})
+        return seen
+
+    # ---------------------- 背景壓縮 ----------------------
+    def _maybe_compact(self) -> None:
+        if self.summarize is None:
+            return
+        if self._pending is not None and not self._pending.done():
+            return
+        with self._lock:
+            over = estimate_tokens(self.summary) + sum(t.tokens for t in self.turns) > self.budget
+            old = self.turns[:-self.keep_recent] if self.keep_recent else list(self.turns)
+            summary, generation = self.summary, self._generation
+        if not over or not old:
+            return
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="deepseek-compact")
+        self._pending = self._pool.submit(self._compact, old, summary, generation)
+
+    def _compact(self, old: List[Turn], summary: str, generation: int) -> None:
+        parts = []
+        if summary:
+            parts.append(f"[既有摘要]\n{summary}")
+        for t in old:
+            parts.append(f"[使用者 #{t.no}]\n{t.user_content()}\n[助理 #{t.no}]\n{t.reply}")
+        prompt = (
+            "請將以下對話濃縮成條列摘要，保留事實、決定、檔名與待辦，省略寒暄；"
+            "只輸出摘要本身。\n\n" + "\n\n".join(parts)
+        )
+        try:
+            text = (self.summarize(prompt) or "").strip()  # type: ignore[misc]
+        except Exception:
+            return
+        if not text or text.startswith("(呼叫失敗"):
+            return
+        done = {id(t) for t in old}
+        with self._lock:
+            if self._generation != generation:
+                return  # 壓縮期間已 :clear 或接續其他工作階段，摘要已過期
+            self.turns = [t for t in self.turns if id(t) not in done]
+            self.summary = text
+            self.oldest = max(self.oldest, old[-1].no + 1)
+
+    def wait(self, timeout: Optional[float] = None) -> None:
+        """等待進行中的壓縮完成（結束 REPL 或測試時使用）。"""
+        if self._pending is not None:
+            try:
+                self._pending.result(timeout=timeout)
+            except Exception:
+                pass
@@ -0,0 +1,240 @@
+from __future__ import annotations
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Iterator, List, Optional, Tuple
+
+from .filecache import FileCache, FileKey
+
+SNIFF_BYTES = 8192
+READ_WINDOW = 64  # 每批平行讀取的檔案數；超出預算後的浪費最多一批
+ALWAYS_SKIP = {".git", ".hg", ".svn"}
+
+
+# ───────────────────────────── .gitignore ─────────────────────────────
+def _glob_to_regex(glob: str) -> str:
+    out, i, n = [], 0, len(glob)
+    while i < n:
+        c = glob[i]
+        if glob.startswith("**/", i):
+            out.append("(?:.*/)?")
+            i += 3
+            continue
+        if glob.startswith("**", i):
+            out.append(".*")
+            i += 2
+            continue
+        if c == "*":
+            out.append("[^/]*")
+        elif c == "?":
+            out.append("[^/]")
+        elif c == "[":
+            j = glob.find("]", i + 1)
+            if j == -1:
+                out.append(re.escape(c))
+            else:
+                body = glob[i + 1:j].replace("\\", "\\\\")
+                if body.startswith("!"):
+                    body = "^" + body[1:]
+                out.append(f"[{body}]")
+                i = j
+        else:
+            out.append(re.escape(c))
+        i += 1
+    return "".join(out)
+
+
+class IgnoreRules:
+    """單一 .gitignore 的規則；base 為其所在目錄（絕對路徑）。"""
+
+    __slots__ = ("base", "patterns")
+
+    def __init__(self, base: str, lines: List[str]):
+        self.base = base
+        self.patterns: List[Tuple["re.Pattern[str]", bool, bool]] = []
+        for line in lines:
+            line = line.rstrip("\n").rstrip()
+            if not line or line.startswith("#"):
+                continue
+            negate = line.startswith("!")
+            if negate:
+                line = line[1:]
+            if line.startswith("\\"):
+                line = line[1:]
+            dir_only = line.endswith("/")
+            line = line.rstrip("/")
+            if not line:
+                continue
+            anchored = "/" in line
+            body = _glob_to_regex(line.lstrip("/"))
+            rx = re.compile(("^" if anchored else "^(?:.*/)?") + body + "$")
+            self.patterns.append((rx, negate, dir_only))
+
+    @classmethod
+    def load(cls, directory: str) -> Optional["IgnoreRules"]:
+        try:
+            with open(os.path.join(directory, ".gitignore"), encoding="utf-8", errors="ignore") as f:
+                rules = cls(directory, f.readlines())
+        except OSError:
+            return None
+        return rules if rules.patterns else None
+
+    def match(self, path: str, is_dir: bool) -> Optional[bool]:
+        """回傳 True（忽略）、False（以 ! 重新納入）或 None（無規則命中）。"""
+        rel = path[len(self.base) + 1:]
+        if os.sep != "/":
+            rel = rel.replace(os.sep, "/")
+        result = None
+        for rx, negate, dir_only in self.patterns:
+            if dir_only and not is_dir:
+                continue
+            if rx.match(rel):
+                result = not negate
+        return result
+
+
+def _is_ignored(chain: Tuple[IgnoreRules, ...], path: str, is_dir: bool) -> bool:
+    ignored = False
+    for rules in chain:
+        hit = rules.match(path, is_dir)
+        if hit is not None:
+            ignored = hit
+    return ignored
+
+
+def _ancestor_rules(root: str) -> Tuple[IgnoreRules, ...]:
+    """往上找到 git 專案根目錄，收集沿途的 .gitignore（@src 也會套用專案根的規則）。"""
+    chain: List[IgnoreRules] = []
+    cur = os.path.dirname(root)
+    while cur and cur != os.path.dirname(cur):
+        rules = IgnoreRules.load(cur)
+        if rules:
+            chain.append(rules)
+        if os.path.isdir(os.path.join(cur, ".git")):
+            break
+        cur = os.path.dirname(cur)
+    else:
+        chain.clear()  # 不在 git 專案內：上層規則不適用
+    return tuple(reversed(chain))
+
+
+# ───────────────────────────── 掃描 / 讀取 ─────────────────────────────
+class IngestStats:
+    __slots__ = ("included", "bytes", "ignored", "binary", "too_large", "over_budget", "errors")
+
+    def __init__(self):
+        for name in self.__slots__:
+            setattr(self, name, 0)
+
+    def summary(self) -> str:
+        parts = [f"納入 {self.included} 檔（{self.bytes // 1024} KB）"]
+        for name, label in (("ignored", "忽略"), ("binary", "二進位"),
+                            ("too_large", "過大"), ("over_budget", "超出總量"), ("errors", "讀取失敗")):
+            n = getattr(self, name)
+            if n:
+                parts.append(f"{label} {n}")
+        return "，".join(parts)
+
+
+def _scan_dir(directory: str, chain: Tuple[IgnoreRules, ...]):
+    """掃描單一目錄（於工作執行緒執行），回傳 (檔案, 子目錄, 忽略數, 錯誤數)。"""
+    own = IgnoreRules.load(directory)
+    if own:
+        chain = chain + (own,)
+    files: List[Tuple[str, FileKey]] = []
+    subdirs: List[Tuple[str, Tuple[IgnoreRules, ...]]] = []
+    ignored = errors = 0
+    try:
+        with os.scandir(directory) as it:
+            for entry in it:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        if entry.name in ALWAYS_SKIP or _is_ignored(chain, entry.path, True):
+                            ignored += 1
+                        else:
+                            subdirs.append((entry.path, chain))
+                    elif entry.is_file():
+                        if _is_ignored(chain, entry.path, False):
+                            ignored += 1
+                        else:
+                            st = entry.stat()
+                            real = os.path.realpath(entry.path) if entry.is_symlink() else entry.path
+                            files.append((entry.path, (real, st.st_size, st.st_mtime_ns)))
+                except OSError:
+                    errors += 1
+    except OSError:
+        errors += 1
+    return files, subdirs, ignored, errors
+
+
+def _read_sniffed(path: str, max_bytes: int) -> Optional[str]:
+    """讀取檔案；前 SNIFF_BYTES 含 NUL 視為二進位並回傳 None。最多讀 max_bytes。"""
+    with open(path, "rb") as f:
+        head = f.read(min(SNIFF_BYTES, max_bytes))
+        if b"\0" in head:
+            return None
+        rest = f.read(max_bytes - len(head)) if len(head) < max_bytes else b""
+    return (head + rest).decode("utf-8", errors="ignore")
+
+
+def ingest_dir(root: Path, cache: Optional[FileCache] = None,
+               max_file_bytes: int = 128 * 1024, max_total_bytes: int = 512 * 1024,
+               workers: int = 8, stats: Optional[IngestStats] = None,
+               ) -> Iterator[Tuple[Path, FileKey, str]]:
+    """展開 @資料夾：平行 scandir 走訪，依相對路徑排序後逐一產出 (路徑, 快取鍵, 文字)。
+
+    遵守 .gitignore（含專案根到此目錄的上層規則），以檔頭判斷並略過二進位檔；
+    單檔與總量上限都先以 stat 大小判斷，過大的檔案不會被開啟。
+    """
+    stats = stats if stats is not None else IngestStats()
+    top = os.path.realpath(os.path.expanduser(str(root)))
+    display_root = Path(root)
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="deepseek-ingest") as pool:
+        # 1) 逐層平行掃描目錄
+        found: List[Tuple[str, FileKey]] = []
+        level = [(top, _ancestor_rules(top))]
+        while level:
+            nxt: List[Tuple[str, Tuple[IgnoreRules, ...]]] = []
+            for files, subdirs, ignored, errors in pool.map(lambda d: _scan_dir(*d), level):
+                found.extend(files)
+                nxt.extend(subdirs)
+                stats.ignored += ignored
+                stats.errors += errors
+            level = nxt
+        found.sort(key=lambda f: f[0][len(top):].split(os.sep))
+
+        # 2) 依固定順序分批平行讀取，於主執行緒依序套用預算並產出
+        remaining = max_total_bytes
+        for start in range(0, len(found), READ_WINDOW):
+            batch = []
+            for path, key in found[start:start + READ_WINDOW]:
+                if key[1] > max_file_bytes:
+                    stats.too_large += 1
+                elif key[1] > remaining:
+                    stats.over_budget += 1
+                else:
+                    batch.append((path, key, cache.get(key) if cache else None))
+            if not batch:
+                continue
+            futures = [None if text is not None else pool.submit(_read_sniffed, path, max_file_bytes)
+                       for path, key, text in batch]
+            for (path, key, text), fut in zip(batch, futures):
+                if fut is not None:
+                    try:
+                        text = fut.result()
+                    except OSError:
+                        stats.errors += 1
+                        continue
+                    if text is None:
+                        stats.binary += 1
+                        continue
+                if key[1] > remaining:
+                    stats.over_budget += 1
+                    continue
+                if cache is not None and fut is not None:
+                    cache.put(key, text)
+                remaining -= key[1]
+                stats.included += 1
+                stats.bytes += key[1]
+                yield display_root / os.path.relpath(path, top), key, text
@@ -0,0 +1,179 @@
+"""`deepseek map`：同一個提示逐檔送出（每個請求只附一個檔案），並套用回覆中的編輯區塊。
+
+    deepseek map "加上型別註記" "src/**/*.py" -c 16
+    deepseek map "改用新版 API" "app/**/*.py" --resume   # 中斷後略過記錄檔中已完成的檔案
+
+固定的寫檔說明放在 system 訊息、提示在前、檔案在後：所有請求共用同一段前綴，
+落在 DeepSeek 的前綴快取內。
+"""
+from __future__ import annotations
+import asyncio
+import glob
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Set, TextIO, Tuple
+
+from .batch import BatchRunner, checkpoint_offset
+from .context import build_chat_prompt, system_messages
+from .edits import EditError, commit_plan, parse_edit_blocks, plan_edits
+from .filecache import FileAttachment, FileCache
+
+# 記錄檔中代表「已完成、續跑時略過」的狀態；error 與 planned（--dry-run）會重跑
+DONE_STATUSES = {"written", "unchanged", "skipped"}
+
+
+def expand_globs(patterns: Iterable[str], exclude: Iterable[Path] = ()) -> List[Path]:
+    """展開 glob（** 可跨資料夾），只保留檔案，去除重複後依路徑排序；沒有萬用字元的參數視為一般路徑。"""
+    skip = {Path(p).resolve() for p in exclude}
+    seen: Dict[Path, Path] = {}
+    for pattern in patterns:
+        pattern = os.path.expanduser(pattern)
+        names = glob.iglob(pattern, recursive=True) if glob.has_magic(pattern) else [pattern]
+        for name in names:
+            path = Path(name)
+            if path.is_file():
+                real = path.resolve()
+                if real not in skip:
+                    seen.setdefault(real, path)
+    return sorted(seen.values())
+
+
+def finished_paths(log: Path) -> Set[str]:
+    """續跑用：記錄檔中已完成的絕對路徑（見 DONE_STATUSES）；先截掉中斷時殘留的半行。"""
+    if checkpoint_offset(log) == 0:
+        return set()
+    done: Set[str] = set()
+    with open(log, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if record.get("status") in DONE_STATUSES:
+                done.add(record["path"])
+            else:
+                done.discard(record.get("path"))
+    return done
+
+
+class Skip(Exception):
+    """檔案不送出（過大、二進位）。"""
+
+
+class MapRunner(BatchRunner):
+    """以 concurrency 個 worker 逐檔處理：讀檔 → 呼叫模型（沿用 BatchRunner 的限速、重試與回覆快取）→ 套用編輯。
+
+    - 每個檔案只接受以它為目標的 WRITE / EDIT / PATCH 區塊；先在記憶體中驗證，全部套得上才原子寫入
+    - 結果依完成順序逐行寫入 out（JSONL），每行 flush，中斷後可據此續跑
+    - 讀檔與寫入在執行緒中執行，不阻塞進行中的請求；同時在記憶體中的檔案最多 concurrency 個
+    - dry_run 時只驗證區塊，不寫入（狀態為 planned）
+    """
+
+    def __init__(self, client, model: str, prompt: str, out: TextIO, *, concurrency: int = 8,
+                 rps: float = 0.0, retries: int = 4, cache=None, files: Optional[FileCache] = None,
+                 max_file_bytes: int = 128 * 1024, dry_run: bool = False,
+                 on_record: Optional[Callable[[dict], None]] = None):
+        super().__init__(client, model, out, concurrency=concurrency, rps=rps, retries=retries,
+                         on_record=on_record, cache=cache)
+        self.prompt = prompt
+        self.files = files or FileCache()
+        self.max_file_bytes = max_file_bytes
+        self.dry_run = dry_run
+        self.system = system_messages()
+        self.counts: Dict[str, int] = {}
+        self._log_lock = threading.Lock()
+
+    # ---------------------- 單一檔案 ----------------------
+    def _messages(self, path: Path) -> List[dict]:
+        size = path.stat().st_size
+        if size > self.max_file_bytes:
+            raise Skip(f"檔案 {size // 1024} KB 超過上限 {self.max_file_bytes // 1024} KB")
+        key, text = self.files.read(path)
+        if "\0" in text:
+            raise Skip("二進位檔案")
+        prompt = build_chat_prompt(self.prompt, {path: FileAttachment(path, key, text)}, self.files, edits=False)
+        return self.system + [{"role": "user", "content": prompt}]
+
+    def _apply(self, path: Path, reply: str) -> Tuple[str, dict]:
+        """回傳 (狀態, 附加欄位)；區塊套不上時拋出 EditError，檔案不變。"""
+        target = path.resolve()
+        ops = parse_edit_blocks(reply)
+        kept = [op for op in ops if op.path == target]
+        extra = {"blocks": len(kept)}
+        if len(ops) > len(kept):
+            extra["ignored"] = len(ops) - len(kept)  # 指向其他檔案的區塊
+        if not kept:
+            return "unchanged", extra
+        plan = plan_edits(kept)
+        original, new = plan[target]
+        if original == new:
+            return "unchanged", extra
+        if self.dry_run:
+            return "planned", extra
+        # map 一次可能改數百個檔案，不寫 :undo 紀錄（只保留最近幾次，會擠掉 REPL 的紀錄）
+        for _, err in commit_plan(plan, journal=False):
+            if err is not None:
+                raise err
+        return "written", extra
+
+    def _finish(self, path: Path, reply: str, record: dict, start: float) -> None:
+        """套用編輯並寫入記錄（在執行緒中執行）。
+
+        兩者在同一個執行緒內完成：Ctrl-C 取消 worker 時，已開始的寫入仍會連同記錄一起完成
+        （asyncio.run 結束前會等預設 executor 的執行緒），--resume 不會把同一份編輯再套用一次。
+        """
+        try:
+            status, extra = self._apply(path, reply)
+            record.update(status=status, **extra)
+        except (EditError, OSError) as e:
+            record.update(status="error", error=f"編輯未套用：{e}")
+        record["elapsed"] = round(time.perf_counter() - start, 3)
+        self._log(record)
+
+    async def _one(self, path: Path) -> None:
+        start = time.perf_counter()
+        # 記錄絕對路徑：從其他目錄 --resume 也能比對
+        record: dict = {"path": str(path.resolve())}
+        try:
+            messages = await asyncio.to_thread(self._messages, path)
+        except Skip as e:
+            record.update(status="skipped", reason=str(e))
+        except OSError as e:
+            record.update(status="error", error=f"讀取失敗：{e}")
+        else:
+            result = await self._call({"index": 0, "id": str(path), "messages": messages})
+            record.update({k: result[k] for k in ("attempts", "usage", "cached") if result.get(k) is not None})
+            if "error" not in result:
+                await asyncio.to_thread(self._finish, path, result["reply"], record, start)
+                return
+            record.update(status="error", error=result["error"])
+        record["elapsed"] = round(time.perf_counter() - start, 3)
+        self._log(record)
+
+    def _log(self, record: dict) -> None:
+        """寫入一行記錄並更新計數；事件迴圈與套用編輯的執行緒都會呼叫。"""
+        with self._log_lock:
+            self.out.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self.out.flush()
+            status = record["status"]
+            self.counts[status] = self.counts.get(status, 0) + 1
+            if status == "error":
+                self.failed += 1
+            else:
+                self.ok += 1
+            if self.on_record:
+                self.on_record(record)
+
+    # ---------------------- 執行 ----------------------
+    async def run(self, paths: Iterable[Path]) -> None:  # type: ignore[override]
+        """concurrency 個 worker 共用同一個迭代器：吞吐量取決於並行度，與檔案數無關。"""
+        it = iter(paths)
+
+        async def worker() -> None:
+            for path in it:
+                await self._one(path)
+
+        await asyncio.gather(*(worker() for _ in range(self.concurrency)))
@@ -0,0 +1,213 @@
+from __future__ import annotations
+import json
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
+
+from .config import CACHE_DIR
+
+PROFILE_PATH = CACHE_DIR / "profile.pstats"
+
+# :stats 顯示順序（其餘階段依名稱排在後面）
+STAGES = ["read", "prompt", "ttft", "network", "tools", "render", "write"]
+STAGE_LABELS = {
+    "read": "讀取 @檔案",
+    "prompt": "組裝提示",
+    "ttft": "首個 token",
+    "network": "模型回覆",
+    "tools": "工具呼叫",
+    "render": "畫面輸出",
+    "write": "寫回檔案",
+}
+USAGE_FIELDS = ("prompt_tokens", "completion_tokens", "prompt_cache_hit_tokens", "prompt_cache_miss_tokens")
+
+
+def usage_dict(usage: Any) -> Dict[str, int]:
+    """從 resp.usage（或串流最後一個 chunk 的 usage）取出 token 計數；DeepSeek 另有 prompt_cache_* 欄位。"""
+    if usage is None:
+        return {}
+    out = {}
+    for name in USAGE_FIELDS:
+        value = usage.get(name) if isinstance(usage, dict) else getattr(usage, name, None)
+        if isinstance(value, int):
+            out[name] = value
+    return out
+
+
+def cache_hit_text(usage: Dict[str, int]) -> str:
+    """單輪的 DeepSeek 前綴快取命中（prompt_cache_hit / miss tokens）；回應沒有這兩個欄位時回傳空字串。"""
+    hit = usage.get("prompt_cache_hit_tokens")
+    miss = usage.get("prompt_cache_miss_tokens")
+    if hit is None or miss is None or hit + miss == 0:
+        return ""
+    return f"前綴快取 {hit}/{hit + miss} tokens（{hit / (hit + miss):.0%}）"
+
+
+def percentile(samples: List[float], q: float) -> float:
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0
+    pos = q * (len(ordered) - 1)
+    lo = int(pos)
+    hi = min(lo + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (pos - lo)
+
+
+class Tracer:
+    """記錄每輪各階段耗時與 token 用量；可選擇把每輪寫成一行 JSONL（--trace）。
+
+    用法：with tracer.turn(): ... with tracer.span("read"): ...
+    計時只用 perf_counter，平常的額外成本可忽略。
+    """
+
+    def __init__(self, trace_path: Optional[Path] = None):
+        self.turns: List[Dict[str, Any]] = []
+        self._current: Optional[Dict[str, Any]] = None
+        self._trace = open(trace_path, "a", encoding="utf-8") if trace_path else None
+
+    @contextmanager
+    def turn(self, **meta: Any) -> Iterator[Dict[str, Any]]:
+        record: Dict[str, Any] = {"turn": len(self.turns) + 1, "ts": round(time.time(), 3),
+                                  "spans": {}, "usage": {}, **meta}
+        self._current = record
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record["spans"]["total"] = time.perf_counter() - start
+            self._current = None
+            self.turns.append(record)
+            if self._trace is not None:
+                spans = {k: round(v, 6) for k, v in record["spans"].items()}
+                self._trace.write(json.dumps({**record, "spans": spans}, ensure_ascii=False) + "\n")
+                self._trace.flush()
+
+    @contextmanager
+    def span(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def add(self, name: str, seconds: Optional[float]) -> None:
+        """把一段耗時累加到目前這一輪（不在任何一輪中時忽略）。"""
+        if self._current is not None and seconds is not None:
+            spans = self._current["spans"]
+            spans[name] = spans.get(name, 0.0) + seconds
+
+    def usage(self, usage: Dict[str, int]) -> None:
+        """累加到目前這一輪（使用工具時一輪會有多次請求）。"""
+        if self._current is not None and usage:
+            totals = self._current["usage"]
+            for name, value in usage.items():
+                totals[name] = totals.get(name, 0) + value
+
+    # ---------------------- 彙總 ----------------------
+    def summary(self) -> List[Dict[str, Any]]:
+        """每個階段的 n / p50 / p95 / 合計（秒）。"""
+        samples: Dict[str, List[float]] = {}
+        for record in self.turns:
+            for name, seconds in record["spans"].items():
+                samples.setdefault(name, []).append(seconds)
+        order = [s for s in STAGES if s in samples] + sorted(s for s in samples if s not in STAGES and s != "total")
+        if "total" in samples:
+            order.append("total")
+        return [{"stage": name, "n": len(samples[name]), "p50": percentile(samples[name], 0.5),
+                 "p95": percentile(samples[name], 0.95), "sum": sum(samples[name])} for name in order]
+
+    def token_totals(self) -> Dict[str, int]:
+        totals: Dict[str, int] = {}
+        for record in self.turns:
+            for name, value in record["usage"].items():
+                totals[name] = totals.get(name, 0) + value
+        return totals
+
+    def render(self, console) -> None:
+        from rich.table import Table  # 只有 :stats 會用到
+        if not self.turns:
+            console.print("[dim]尚無統計資料[/]")
+            return
+        table = Table(title=f"效能統計（{len(self.turns)} 輪）", title_style="bold", border_style="blue")
+        table.add_column("階段")
+        table.add_column("次數", justify="right")
+        table.add_column("p50", justify="right")
+        table.add_column("p95", justify="right")
+        table.add_column("合計", justify="right")
+        for row in self.summary():
+            label = STAGE_LABELS.get(row["stage"], "整輪" if row["stage"] == "total" else row["stage"])
+            table.add_row(label, str(row["n"]), _ms(row["p50"]), _ms(row["p95"]), _ms(row["sum"]))
+        console.print(table)
+        totals = self.token_totals()
+        if totals:
+            parts = [f"提示 {totals.get('prompt_tokens', 0)}", f"回覆 {totals.get('completion_tokens', 0)}"]
+            hit = totals.get("prompt_cache_hit_tokens")
+            if hit is not None:
+                miss = totals.get("prompt_cache_miss_tokens", 0)
+                ratio = hit / (hit + miss) if hit + miss else 0.0
+                parts.append(f"前綴快取命中 {hit}（{ratio:.0%}）")
+            console.print(f"[dim]tokens：{' · '.join(parts)}[/]")
+
+    def close(self) -> None:
+        if self._trace is not None:
+            self._trace.close()
+            self._trace = None
+
+
+def _ms(seconds: float) -> str:
+    return f"{seconds * 1000:.0f} ms" if seconds < 10 else f"{seconds:.1f} s"
+
+
+class _Snapshot:
+    """其他執行緒的 profile 快照：pstats 載入 Profile 時會呼叫 create_stats()（其中的 disable() 只作用於
+    目前執行緒，會停掉主執行緒的 profiler），改以 snapshot_stats() 取值、不停用。"""
+
+    def __init__(self, profiler):
+        profiler.snapshot_stats()
+        self.stats = profiler.stats
+
+    def create_stats(self) -> None:
+        pass
+
+
+@contextmanager
+def profiled(console, path: Path = PROFILE_PATH, top: int = 25) -> Iterator[None]:
+    """以 cProfile 包住整個工作階段；結束時印出累積耗時最高的函式並存檔供 snakeviz 等工具檢視。
+
+    cProfile 只記錄啟用它的執行緒：期間新開的執行緒（串流回覆、工具呼叫等）各自啟用一個 profiler，
+    結束時合併。Python 3.12 起 cProfile 改用 sys.monitoring，本身即涵蓋所有執行緒。
+    """
+    import cProfile
+    import io
+    import pstats
+    import sys
+    import threading
+    profiler = cProfile.Profile()
+    threads: List[cProfile.Profile] = []
+
+    def start_thread(*_) -> None:
+        # 由 threading.setprofile 在新執行緒的第一個事件呼叫；enable() 隨即取代這個函式
+        p = cProfile.Profile()
+        threads.append(p)
+        p.enable()
+
+    per_thread = sys.version_info < (3, 12)
+    if per_thread:
+        threading.setprofile(start_thread)
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        if per_thread:
+            threading.setprofile(None)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        out = io.StringIO()
+        stats = pstats.Stats(profiler, stream=out)
+        for p in list(threads):
+            stats.add(_Snapshot(p))
+        stats.dump_stats(str(path))
+        stats.sort_stats("cumulative").print_stats(top)
+        console.print(out.getvalue(), markup=False, highlight=False, soft_wrap=True)
+        console.print(f"[dim]完整 profile 已存至 {path}[/]")
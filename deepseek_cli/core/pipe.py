@@ -0,0 +1,181 @@
+"""`deepseek -p`：非互動的管線模式。
+
+    git diff | deepseek -p "review this"
+    deepseek -p "解釋 @deepseek_cli/main.py" > notes.md
+
+只用標準函式庫與 core 模組，不載入 typer / rich / readline；回覆以純文字串流到 stdout，
+訊息與錯誤一律寫到 stderr。結束碼：0 成功、1 模型呼叫失敗、2 用法或設定錯誤、
+130 被 Ctrl-C 中斷、141 下游管線提早關閉（如 | head）。
+"""
+from __future__ import annotations
+import argparse
+import sys
+from typing import BinaryIO, List, Optional, TextIO, Tuple
+
+from .config import cfg_flag, cfg_number, load_config, normalize_with_defaults
+
+EXIT_OK = 0
+EXIT_API = 1
+EXIT_USAGE = 2
+EXIT_INTERRUPTED = 130
+EXIT_BROKEN_PIPE = 141
+
+STDIN_CHUNK = 64 * 1024
+LINE_SNAP = 4096  # 截斷點附近這麼多 bytes 內有換行時，改在換行處切開
+
+
+def read_stdin(stream: BinaryIO, max_bytes: int) -> Tuple[str, int, int]:
+    """逐塊讀取 stdin，記憶體只保留開頭與結尾各 max_bytes / 2。
+
+    回傳 (文字, 總 bytes, 省略的 bytes)；超過上限時在中間插入省略註記。
+    """
+    half = max(max_bytes // 2, 1)
+    head = bytearray()
+    tail = bytearray()
+    total = 0
+    while True:
+        chunk = stream.read(STDIN_CHUNK)
+        if not chunk:
+            break
+        total += len(chunk)
+        if len(head) < half:
+            take = half - len(head)
+            head += chunk[:take]
+            chunk = chunk[take:]
+        if chunk:
+            tail += chunk
+            if len(tail) > 2 * max(half, STDIN_CHUNK):
+                del tail[:len(tail) - half]  # 攤銷後每個 byte 只搬移常數次
+    if total <= max_bytes:
+        return (bytes(head) + bytes(tail)).decode("utf-8", "replace"), total, 0
+
+    tail = tail[-half:]
+    cut = head.rfind(b"\n", max(len(head) - LINE_SNAP, 0))
+    if cut > 0:
+        head = head[:cut + 1]
+    cut = tail.find(b"\n", 0, LINE_SNAP)
+    if cut >= 0:
+        tail = tail[cut + 1:]
+    omitted = total - len(head) - len(tail)
+    text = (head.decode("utf-8", "replace")
+            + f"\n…（stdin 共 {total} bytes，中間省略 {omitted} bytes）…\n"
+            + tail.decode("utf-8", "replace"))
+    return text, total, omitted
+
+
+def build_pipe_prompt(prompt: str, stdin_text: Optional[str]) -> str:
+    if stdin_text is None:
+        return prompt
+    if not prompt:
+        return stdin_text
+    return f"{prompt}\n\n[STDIN]\n```text\n{stdin_text}\n```"
+
+
+def run_pipe(prompt: str, cfg: dict, *, model: Optional[str] = None, allow_read: bool = False,
+             no_cache: bool = False, max_kb: Optional[float] = None,
+             stdin: Optional[BinaryIO] = None, out: Optional[TextIO] = None,
+             err: Optional[TextIO] = None) -> int:
+    """執行一次提問並把回覆串流到 out，回傳結束碼。"""
+    stdin = stdin if stdin is not None else sys.stdin.buffer
+    out = out or sys.stdout
+    err = err or sys.stderr
+
+    def warn(msg: str) -> None:
+        err.write(f"deepseek: {msg}\n")
+
+    stdin_text = None
+    if not (hasattr(stdin, "isatty") and stdin.isatty()):
+        limit = int((max_kb if max_kb is not None else cfg_number(cfg, "pipe_max_kb", 256)) * 1024)
+        stdin_text, total, omitted = read_stdin(stdin, limit)
+        if omitted:
+            warn(f"stdin 共 {total} bytes，超過上限 {limit} bytes，只保留開頭與結尾")
+        if not total:
+            stdin_text = None
+    prompt = prompt.strip()
+    if not prompt and stdin_text is None:
+        warn("沒有提示：請用 -p \"提示\" 或由 stdin 傳入內容")
+        return EXIT_USAGE
+
+    from .client import ChatClient
+    client = ChatClient.from_config(cfg)
+    if client is None:
+        warn("需要 api_key：請先執行 deepseek config edit")
+        return EXIT_USAGE
+
+    # @檔案：與 REPL 相同的展開方式；非互動無法詢問，需事先同意（allow_fs_read 或 --allow-read）
+    from .context import build_chat_prompt, expand_at_mentions, read_context_files
+    paths = expand_at_mentions(prompt)
+    text = build_pipe_prompt(prompt, stdin_text)
+    if paths:
+        if not (allow_read or cfg_flag(cfg, "allow_fs_read")):
+            warn("提示中有 @檔案，但尚未允許讀取：加上 --allow-read 或 config set allow_fs_read true")
+            return EXIT_USAGE
+        from .filecache import FileCache
+        files = FileCache(max_bytes=int(cfg_number(cfg, "file_cache_mb", 64) * 1024 * 1024))
+        file_map = read_context_files(paths, files, cfg)
+        missing = [str(p) for p in paths if not p.exists()]
+        if missing:
+            warn(f"找不到：{', '.join(missing)}")
+        text = build_chat_prompt(text, file_map, files, edits=False,
+                                 stable=cfg_flag(cfg, "prompt_cache_layout", True))
+
+    cache = None
+    if not no_cache and cfg_flag(cfg, "response_cache", False):
+        from .respcache import open_response_cache
+        cache = open_response_cache(cfg)
+
+    from .chat import iter_model_stream
+    last = ""
+    chunks = iter_model_stream(client, model or cfg["model"], text, cache=cache, raise_errors=True)
+    try:
+        for kind, piece in chunks:
+            if kind != "content" or not piece:
+                continue  # 思考過程不輸出，stdout 只有正文
+            out.write(piece)
+            out.flush()
+            last = piece
+        if last and not last.endswith("\n"):
+            out.write("\n")
+        out.flush()
+    except KeyboardInterrupt:
+        return EXIT_INTERRUPTED
+    except BrokenPipeError:
+        _silence_stdout()
+        return EXIT_BROKEN_PIPE
+    except Exception as e:
+        if last:
+            out.write("\n")
+            out.flush()
+        warn(f"呼叫失敗：{e}")
+        return EXIT_API
+    finally:
+        chunks.close()  # 中斷或下游關閉時，連帶關閉 HTTP 串流
+    return EXIT_OK
+
+
+def _silence_stdout() -> None:
+    """下游已關閉：把 stdout 導向 /dev/null，避免直譯器結束時 flush 再報一次 BrokenPipeError。"""
+    import os
+    try:
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, sys.stdout.fileno())
+    except (OSError, ValueError):
+        pass
+
+
+def main(argv: List[str]) -> int:
+    """`deepseek -p …` 的快速路徑（由 deepseek_cli.__main__ 分派，不經過 typer）。"""
+    ap = argparse.ArgumentParser(prog="deepseek -p", description="非互動模式：回覆以純文字輸出到 stdout")
+    ap.add_argument("-p", "--print", dest="prompt", nargs="?", const="", default="", metavar="PROMPT",
+                    help="提示文字；可省略並只由 stdin 傳入")
+    ap.add_argument("-m", "--model", help="覆寫設定中的模型")
+    ap.add_argument("--allow-read", action="store_true", help="允許展開提示中的 @檔案/資料夾")
+    ap.add_argument("--no-cache", action="store_true", help="略過回覆快取")
+    ap.add_argument("--max-kb", type=float, help="stdin 上限（KB，預設 config 的 pipe_max_kb 或 256）")
+    try:
+        args = ap.parse_args(argv)
+    except SystemExit as e:
+        return EXIT_OK if e.code == 0 else EXIT_USAGE
+    cfg = normalize_with_defaults(load_config() or {})
+    return run_pipe(args.prompt or "", cfg, model=args.model, allow_read=args.allow_read,
+                    no_cache=args.no_cache, max_kb=args.max_kb)
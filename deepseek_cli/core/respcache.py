@@ -0,0 +1,117 @@
+from __future__ import annotations
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from .config import CACHE_DIR, cfg_flag, cfg_number
+
+RESPONSE_CACHE_PATH = CACHE_DIR / "responses.sqlite3"
+
+
+def make_key(model: str, base_url: str, messages: List[Dict[str, Any]],
+             params: Optional[Dict[str, Any]] = None) -> str:
+    """以 (model, base_url, messages, 取樣參數) 的 SHA-256 作為快取鍵。"""
+    payload = json.dumps(
+        {"model": model, "base_url": base_url.rstrip("/"), "messages": messages, "params": params or {}},
+        sort_keys=True, ensure_ascii=False, separators=(",", ":"),
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """SQLite 回覆快取：逾時（ttl 秒）即失效，總大小超過 max_bytes 時依最後存取時間淘汰。"""
+
+    def __init__(self, path: Path = RESPONSE_CACHE_PATH, ttl: float = 7 * 86400,
+                 max_bytes: int = 100 * 1024 * 1024):
+        self.path = Path(path)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(str(self.path), check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL,"
+            " created REAL NOT NULL, accessed REAL NOT NULL, hits INTEGER NOT NULL DEFAULT 0)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses(accessed)")
+
+    key_for = staticmethod(make_key)
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            row = self._db.execute("SELECT value, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None or (self.ttl > 0 and now - row[1] > self.ttl):
+                if row is not None:
+                    self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self.misses += 1
+                return None
+            self._db.execute("UPDATE responses SET accessed = ?, hits = hits + 1 WHERE key = ?", (now, key))
+            self.hits += 1
+            return row[0]
+
+    def put(self, key: str, value: str) -> None:
+        size = len(value.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses(key, value, size, created, accessed) VALUES (?, ?, ?, ?, ?)",
+                (key, value, size, now, now),
+            )
+            self._evict(now)
+
+    def _evict(self, now: float) -> None:
+        if self.ttl > 0:
+            self._db.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl,))
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        freed = 0
+        victims = []
+        for key, size in self._db.execute("SELECT key, size FROM responses ORDER BY accessed"):
+            victims.append((key,))
+            freed += size
+            if total - freed <= self.max_bytes:
+                break
+        self._db.executemany("DELETE FROM responses WHERE key = ?", victims)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            entries, total, hits, oldest = self._db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(hits), 0), MIN(created) FROM responses"
+            ).fetchone()
+        return {"path": str(self.path), "entries": entries, "bytes": total,
+                "hits": hits, "oldest": oldest, "ttl": self.ttl, "max_bytes": self.max_bytes}
+
+    def clear(self) -> int:
+        with self._lock:
+            n = self._db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            self._db.execute("DELETE FROM responses")
+            self._db.execute("VACUUM")
+        return n
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+def open_response_cache(cfg: dict, bypass: bool = False, force: bool = False) -> Optional[ResponseCache]:
+    """依設定開啟回覆快取；未啟用（config set response_cache true）或 bypass（--no-cache）時回傳 None。
+    force 供 `deepseek cache` 管理指令使用，不論是否啟用都開啟。"""
+    if not force and (bypass or not cfg_flag(cfg, "response_cache", False)):
+        return None
+    return ResponseCache(
+        ttl=cfg_number(cfg, "cache_ttl", 7 * 86400),
+        max_bytes=int(cfg_number(cfg, "cache_max_mb", 100) * 1024 * 1024),
+    )
@@ -0,0 +1,255 @@
+from __future__ import annotations
+import math
+import re
+import sqlite3
+import threading
+from collections import Counter
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from .config import CACHE_DIR
+from .filecache import FileAttachment, FileCache, FileKey
+from .history import estimate_tokens
+
+CHUNK_INDEX_PATH = CACHE_DIR / "chunks.sqlite3"
+
+CHUNK_LINES = 40       # 每段目標行數
+CHUNK_MIN_LINES = 20   # 達到此行數後遇到空行就提早切段
+CHUNK_MAX_CHARS = 4000
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+_WORD_RE = re.compile(r"[A-Za-z0-9_]+|[\u3040-\u30ff\u3400-\u9fff\uac00-\ud7af]+")
+_CAMEL_RE = re.compile(r"[A-Z]+(?![a-z])|[A-Z]?[a-z]+|\d+")
+_CJK_RE = re.compile(r"[\u3040-\u30ff\u3400-\u9fff\uac00-\ud7af]")
+
+
+def tokenize(text: str) -> List[str]:
+    """英數以識別字為單位（另拆出 snake_case / camelCase 子詞），中日韓文字以雙字組切分。"""
+    terms: List[str] = []
+    for word in _WORD_RE.findall(text):
+        if _CJK_RE.match(word):
+            terms.extend(word[i:i + 2] for i in range(max(len(word) - 1, 1)))
+            continue
+        lower = word.lower()
+        terms.append(lower)
+        parts = [p.lower() for piece in word.split("_") for p in _CAMEL_RE.findall(piece)]
+        if len(parts) > 1:
+            terms.extend(p for p in parts if len(p) > 1)
+    return terms
+
+
+def chunk_lines(text: str) -> List[Tuple[int, int]]:
+    """依行切段，回傳 [(起始行, 結束行)]（0 起算、含頭不含尾）；盡量在空行處切開。"""
+    lines = text.splitlines()
+    spans: List[Tuple[int, int]] = []
+    start = 0
+    chars = 0
+    for i, line in enumerate(lines):
+        chars += len(line) + 1
+        n = i - start + 1
+        if n >= CHUNK_LINES or chars >= CHUNK_MAX_CHARS or (n >= CHUNK_MIN_LINES and not line.strip()):
+            spans.append((start, i + 1))
+            start, chars = i + 1, 0
+    if start < len(lines):
+        spans.append((start, len(lines)))
+    return spans
+
+
+class ChunkIndex:
+    """持久化的 BM25 倒排索引（SQLite），以 (路徑, 大小, mtime_ns) 判斷是否需重建單一檔案。
+
+    只存行號範圍與詞頻，不存內容；片段文字由呼叫端依行號從 FileCache 取出。
+    IDF 與平均段長只以本次查詢涉及的檔案計算，結果不受其他專案的檔案影響。
+    """
+
+    def __init__(self, path: Path = CHUNK_INDEX_PATH):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(str(self.path), check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(
+            "CREATE TABLE IF NOT EXISTS files ("
+            " path TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL);"
+            "CREATE TABLE IF NOT EXISTS chunks ("
+            " id INTEGER PRIMARY KEY, path TEXT NOT NULL, start INTEGER NOT NULL, end INTEGER NOT NULL,"
+            " length INTEGER NOT NULL);"
+            "CREATE INDEX IF NOT EXISTS chunks_path ON chunks(path);"
+            "CREATE TABLE IF NOT EXISTS postings ("
+            " term TEXT NOT NULL, chunk INTEGER NOT NULL, tf INTEGER NOT NULL,"
+            " PRIMARY KEY (term, chunk)) WITHOUT ROWID;"
+            "CREATE INDEX IF NOT EXISTS postings_chunk ON postings(chunk);"
+        )
+
+    # ---------------------- 建立 / 更新 ----------------------
+    def ensure(self, key: FileKey, text: str) -> bool:
+        """檔案未索引或已變更時重建它的段落與詞頻；有更新時回傳 True。"""
+        path, size, mtime_ns = key
+        with self._lock:
+            row = self._db.execute("SELECT size, mtime_ns FROM files WHERE path = ?", (path,)).fetchone()
+            if row == (size, mtime_ns):
+                return False
+        spans = chunk_lines(text)
+        lines = text.splitlines()
+        rows = []
+        for start, end in spans:
+            rows.append((start, end, Counter(tokenize("\n".join(lines[start:end])))))
+        with self._lock:
+            self._db.execute("BEGIN")
+            try:
+                self._drop(path)
+                for start, end, tf in rows:
+                    cur = self._db.execute(
+                        "INSERT INTO chunks(path, start, end, length) VALUES (?, ?, ?, ?)",
+                        (path, start, end, sum(tf.values())),
+                    )
+                    self._db.executemany(
+                        "INSERT INTO postings(term, chunk, tf) VALUES (?, ?, ?)",
+                        ((term, cur.lastrowid, n) for term, n in tf.items()),
+                    )
+                self._db.execute(
+                    "INSERT OR REPLACE INTO files(path, size, mtime_ns) VALUES (?, ?, ?)", (path, size, mtime_ns)
+                )
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+        return True
+
+    def _drop(self, path: str) -> None:
+        self._db.execute("DELETE FROM postings WHERE chunk IN (SELECT id FROM chunks WHERE path = ?)", (path,))
+        self._db.execute("DELETE FROM chunks WHERE path = ?", (path,))
+        self._db.execute("DELETE FROM files WHERE path = ?", (path,))
+
+    def prune(self) -> int:
+        """移除已不存在的檔案，回傳移除數。"""
+        with self._lock:
+            paths = [r[0] for r in self._db.execute("SELECT path FROM files")]
+            gone = [p for p in paths if not Path(p).exists()]
+            for p in gone:
+                self._drop(p)
+        return len(gone)
+
+    # ---------------------- 查詢 ----------------------
+    def search(self, query: str, paths: Iterable[str]) -> List[Tuple[float, str, int, int]]:
+        """以 BM25 為 paths 中的段落評分，回傳 [(分數, 路徑, 起始行, 結束行)]，分數高者在前。"""
+        terms = set(tokenize(query))
+        paths = list(paths)
+        if not terms or not paths:
+            return []
+        marks = ",".join("?" * len(paths))
+        with self._lock:
+            n, avgdl = self._db.execute(
+                f"SELECT COUNT(*), AVG(length) FROM chunks WHERE path IN ({marks})", paths
+            ).fetchone()
+            if not n:
+                return []
+            rows = self._db.execute(
+                f"SELECT p.term, p.tf, c.id, c.path, c.start, c.end, c.length"
+                f" FROM postings p JOIN chunks c ON c.id = p.chunk"
+                f" WHERE p.term IN ({','.join('?' * len(terms))}) AND c.path IN ({marks})",
+                [*terms, *paths],
+            ).fetchall()
+        df = Counter(r[0] for r in rows)
+        scores: Dict[int, float] = {}
+        meta: Dict[int, Tuple[str, int, int]] = {}
+        for term, tf, cid, path, start, end, length in rows:
+            idf = math.log(1 + (n - df[term] + 0.5) / (df[term] + 0.5))
+            norm = tf + BM25_K1 * (1 - BM25_B + BM25_B * length / (avgdl or 1))
+            scores[cid] = scores.get(cid, 0.0) + idf * tf * (BM25_K1 + 1) / norm
+            meta[cid] = (path, start, end)
+        ranked = sorted(scores.items(), key=lambda kv: -kv[1])
+        return [(score, *meta[cid]) for cid, score in ranked]
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+# ───────────────────────────── 提示組裝 ─────────────────────────────
+def render_excerpt(lines: List[str], spans: List[Tuple[int, int]]) -> str:
+    """依行號輸出選中的段落（相鄰段落合併），每段前標示行號範圍。"""
+    merged: List[List[int]] = []
+    for start, end in sorted(spans):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    parts = [f"# 全檔共 {len(lines)} 行，以下為節錄"]
+    for start, end in merged:
+        parts.append(f"# 第 {start + 1}-{end} 行")
+        parts.append("\n".join(lines[start:end]))
+    return "\n".join(parts)
+
+
+def select_chunks(index: ChunkIndex, query: str, file_map: Dict[Path, FileAttachment],
+                  cache: FileCache, budget: int, top_k: int = 12,
+                  whole: Iterable[Path] = ()) -> int:
+    """附檔總量超過 budget 時改送相關段落，回傳改為節錄的檔案數。
+
+    whole 中的檔案（@路徑!）與只有一段的小檔一律完整送出；其餘檔案由小到大保留完整內容直到用掉一半預算，
+    剩下的大檔切段後以 BM25 挑出最相關的 top_k 段，總量不超過剩餘預算。
+    """
+    whole = {Path(p).resolve() for p in whole}
+    candidates = []
+    used = 0
+    for att in file_map.values():
+        if att.mode != "full":
+            continue
+        text = att.content(cache)
+        if text is None:
+            continue
+        tokens = estimate_tokens(text)
+        if att.path.resolve() in whole or len(chunk_lines(text)) <= 1:
+            used += tokens  # 指定完整或本來就只有一段的檔案不做節錄
+        else:
+            candidates.append((tokens, att, text))
+    if used + sum(t for t, _, _ in candidates) <= budget:
+        return 0
+
+    candidates.sort(key=lambda item: item[0])
+    large = []
+    for tokens, att, text in candidates:
+        if not large and used + tokens <= budget // 2:
+            used += tokens  # 小檔直接完整送出
+        else:
+            large.append((att, text))
+    if not large:
+        return 0
+
+    by_path = {att.key[0]: (att, text.splitlines()) for att, text in large}
+    for att, text in large:
+        index.ensure(att.key, text)
+    remaining = max(budget - used, 0)
+    picked: Dict[str, List[Tuple[int, int]]] = {p: [] for p in by_path}
+    n = 0
+    for _, path, start, end in index.search(query, by_path):
+        if top_k and n >= top_k:
+            break
+        cost = estimate_tokens("\n".join(by_path[path][1][start:end]))
+        if cost > remaining:
+            continue
+        picked[path].append((start, end))
+        remaining -= cost
+        n += 1
+
+    for path, (att, lines) in by_path.items():
+        att.mode = "excerpt"
+        att.delta = render_excerpt(lines, picked[path]) if picked[path] else ""
+    return len(by_path)
+
+
+_index: Optional[ChunkIndex] = None
+
+
+def open_chunk_index() -> Optional[ChunkIndex]:
+    """開啟（並共用）預設路徑的段落索引；SQLite 無法使用時回傳 None。"""
+    global _index
+    if _index is None:
+        try:
+            _index = ChunkIndex()
+        except sqlite3.Error:
+            return None
+    return _index
@@ -0,0 +1,35 @@
+from __future__ import annotations
+import random
+from typing import Optional
+
+RETRYABLE_STATUS = {408, 409, 429}
+
+
+def is_retryable(exc: BaseException) -> bool:
+    """判斷例外是否值得重試：逾時、連線錯誤、429 與 5xx。
+
+    以屬性與類別名稱判斷，不需匯入 openai 的例外類別。
+    """
+    status = getattr(exc, "status_code", None)
+    if isinstance(status, int):
+        return status in RETRYABLE_STATUS or status >= 500
+    if type(exc).__name__ in {"APIConnectionError", "APITimeoutError"}:
+        return True
+    return isinstance(exc, (TimeoutError, ConnectionError))
+
+
+def backoff_delay(attempt: int, base: float = 0.5, cap: float = 20.0) -> float:
+    """指數退避加 full jitter：第 attempt 次（由 0 起算）失敗後應等待的秒數。"""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+def retry_after(exc: BaseException) -> Optional[float]:
+    """讀取伺服器回應的 Retry-After（秒）；沒有則回傳 None。"""
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    try:
+        return max(float(headers.get("retry-after")), 0.0)
+    except (TypeError, ValueError):
+        return None
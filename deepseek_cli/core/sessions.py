@@ -0,0 +1,152 @@
+from __future__ import annotations
+import json
+import secrets
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from .config import DATA_DIR
+from .filecache import FileAttachment
+from .history import Turn
+
+SESSIONS_PATH = DATA_DIR / "sessions.sqlite3"
+TITLE_CHARS = 60
+
+
+def _dump_files(files: List[FileAttachment]) -> str:
+    """附檔只存參照（路徑、快取鍵、送出方式）；diff / 節錄的內容本身就是送出的文字，一併保存。"""
+    return json.dumps([[str(a.path), list(a.key), a.mode, a.since, a.delta] for a in files], ensure_ascii=False)
+
+
+def _load_files(raw: str) -> List[FileAttachment]:
+    files = []
+    for path, key, mode, since, delta in json.loads(raw or "[]"):
+        att = FileAttachment(Path(path), tuple(key), None)
+        att.mode, att.since, att.delta = mode, since, delta
+        files.append(att)
+    return files
+
+
+class SessionStore:
+    """對話紀錄（SQLite，WAL）：每輪結束即附加一列，輪次寫入後不再修改。
+
+    sessions 表存每個工作階段的中繼資料與最新摘要；turns 表依 (session, no) 建索引，
+    接續時由最新一輪往回讀，預算用完即停止，不需把整段對話載入記憶體。
+    """
+
+    def __init__(self, path: Path = SESSIONS_PATH):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(str(self.path), check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            " id TEXT PRIMARY KEY, created REAL NOT NULL, updated REAL NOT NULL,"
+            " cwd TEXT NOT NULL, model TEXT NOT NULL, title TEXT NOT NULL DEFAULT '',"
+            " turns INTEGER NOT NULL DEFAULT 0, last_no INTEGER NOT NULL DEFAULT 0,"
+            " summary TEXT NOT NULL DEFAULT '', oldest INTEGER NOT NULL DEFAULT 1);"
+            "CREATE INDEX IF NOT EXISTS sessions_updated ON sessions(updated);"
+            "CREATE TABLE IF NOT EXISTS turns ("
+            " session TEXT NOT NULL, no INTEGER NOT NULL, ts REAL NOT NULL,"
+            " user TEXT NOT NULL, reply TEXT NOT NULL, files TEXT NOT NULL, tokens INTEGER NOT NULL);"
+            "CREATE UNIQUE INDEX IF NOT EXISTS turns_session_no ON turns(session, no);"
+        )
+
+    # ---------------------- 寫入 ----------------------
+    def create(self, model: str, cwd: str) -> str:
+        now = time.time()
+        with self._lock:
+            while True:
+                sid = secrets.token_hex(4)
+                try:
+                    self._db.execute(
+                        "INSERT INTO sessions(id, created, updated, cwd, model) VALUES (?, ?, ?, ?, ?)",
+                        (sid, now, now, cwd, model),
+                    )
+                    return sid
+                except sqlite3.IntegrityError:
+                    continue
+
+    def append(self, sid: str, turn: Turn) -> None:
+        now = time.time()
+        with self._lock:
+            self._db.execute("BEGIN")
+            try:
+                self._db.execute(
+                    "INSERT INTO turns(session, no, ts, user, reply, files, tokens) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (sid, turn.no, now, turn.user, turn.reply, _dump_files(turn.files), turn.tokens),
+                )
+                self._db.execute(
+                    "UPDATE sessions SET updated = ?, turns = turns + 1, last_no = ?,"
+                    " title = CASE WHEN title = '' THEN ? ELSE title END WHERE id = ?",
+                    (now, turn.no, " ".join(turn.user.split())[:TITLE_CHARS], sid),
+                )
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def set_summary(self, sid: str, summary: str, oldest: int) -> None:
+        """記錄目前的摘要；oldest 之前的輪次已併入摘要（或被 :clear 清除），接續時不再載回。"""
+        with self._lock:
+            self._db.execute("UPDATE sessions SET summary = ?, oldest = ? WHERE id = ?", (summary, oldest, sid))
+
+    # ---------------------- 讀取 ----------------------
+    def resolve(self, ref: str) -> Optional[str]:
+        """接受完整 ID、唯一的 ID 前綴，或 "last"（最近使用的工作階段）。"""
+        with self._lock:
+            if ref == "last":
+                row = self._db.execute("SELECT id FROM sessions ORDER BY updated DESC LIMIT 1").fetchone()
+                return row[0] if row else None
+            rows = self._db.execute(
+                "SELECT id FROM sessions WHERE substr(id, 1, ?) = ? LIMIT 2", (len(ref), ref)
+            ).fetchall()
+        return rows[0][0] if len(rows) == 1 else None
+
+    def info(self, sid: str) -> Optional[Dict]:
+        with self._lock:
+            cur = self._db.execute("SELECT * FROM sessions WHERE id = ?", (sid,))
+            row = cur.fetchone()
+            return dict(zip([d[0] for d in cur.description], row)) if row else None
+
+    def list(self, limit: int = 20) -> List[Dict]:
+        with self._lock:
+            cur = self._db.execute(
+                "SELECT id, updated, cwd, model, title, turns FROM sessions WHERE turns > 0"
+                " ORDER BY updated DESC LIMIT ?", (limit,),
+            )
+            names = [d[0] for d in cur.description]
+            return [dict(zip(names, row)) for row in cur.fetchall()]
+
+    def older(self, sid: str, oldest: int, before: int, room: int) -> List[Turn]:
+        """由新到舊讀取 [oldest, before) 之間的輪次，總 token 數不超過 room 即停止。"""
+        picked: List[Turn] = []
+        with self._lock:
+            cur = self._db.execute(
+                "SELECT no, user, reply, files, tokens FROM turns"
+                " WHERE session = ? AND no >= ? AND no < ? ORDER BY no DESC",
+                (sid, oldest, before),
+            )
+            for no, user, reply, files, tokens in cur:
+                if tokens > room:
+                    break
+                picked.append(Turn(no, user, reply, _load_files(files), tokens=tokens))
+                room -= tokens
+            cur.close()
+        return picked
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+def open_session_store() -> Optional[SessionStore]:
+    """開啟預設路徑的對話紀錄；SQLite 無法使用時回傳 None（不影響聊天）。"""
+    try:
+        return SessionStore()
+    except (sqlite3.Error, OSError):
+        return None
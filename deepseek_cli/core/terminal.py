@@ -0,0 +1,218 @@
+from __future__ import annotations
+import codecs
+import os
+import signal
+import sys
+from contextlib import contextmanager
+from typing import Callable, Iterator, List, Optional
+
+
+class TypeAhead:
+    """等待回覆時接收鍵盤輸入：終端機切到 cbreak（不回顯、逐字讀取），由 asyncio 的 add_reader 監聽。
+
+    Enter 送出的行交給 on_line；尚未送出的文字留在 buffer，回到一般提示時可預先填入。
+    Ctrl-C 仍會產生 SIGINT（由呼叫端決定取消什麼）。只支援 POSIX 終端機，其他情況 enabled 為 False。
+    """
+
+    def __init__(self, loop, on_line: Callable[[str], None], stream=None):
+        self.loop = loop
+        self.on_line = on_line
+        self.stream = stream or sys.stdin
+        self.buffer = ""
+        self.enabled = False
+        self._fd: Optional[int] = None
+        self._saved = None
+        self._esc = ""  # 進行中的跳脫序列（方向鍵等），整段略過
+        self._decoder = codecs.getincrementaldecoder("utf-8")("replace")
+
+    def start(self) -> "TypeAhead":
+        try:
+            import termios
+            import tty
+            fd = self.stream.fileno()
+            if not os.isatty(fd):
+                return self
+            self._saved = termios.tcgetattr(fd)
+            tty.setcbreak(fd, termios.TCSANOW)
+            self.loop.add_reader(fd, self._on_readable)
+        except (ImportError, AttributeError, OSError, ValueError, NotImplementedError):
+            self._restore()
+            return self
+        self._fd = fd
+        self.enabled = True
+        return self
+
+    def stop(self) -> None:
+        if self._fd is not None:
+            try:
+                self.loop.remove_reader(self._fd)
+            except Exception:
+                pass
+        self._restore()
+        self._fd = None
+        self.enabled = False
+
+    def _restore(self) -> None:
+        if self._saved is not None:
+            import termios
+            try:
+                termios.tcsetattr(self.stream.fileno(), termios.TCSADRAIN, self._saved)
+            except (OSError, ValueError):
+                pass
+            self._saved = None
+
+    @contextmanager
+    def paused(self) -> Iterator[None]:
+        """暫時還原終端機（例如執行 !指令或詢問同意時），結束後繼續接收。"""
+        was = self.enabled
+        self.stop()
+        try:
+            yield
+        finally:
+            if was:
+                self.start()
+
+    def __enter__(self) -> "TypeAhead":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+    def _on_readable(self) -> None:
+        try:
+            data = os.read(self._fd, 1024)
+        except OSError:
+            data = b""
+        if not data:
+            self.stop()  # stdin 已關閉
+            return
+        self.feed(self._decoder.decode(data))
+
+    def feed(self, text: str) -> None:
+        lines: List[str] = []
+        for ch in text:
+            if self._esc:
+                self._esc += ch
+                # CSI（ESC [ … 終止字元 @~）或 SS3（ESC O x）結束時整段丟棄
+                if (len(self._esc) == 2 and ch not in "[O") or \
+                        (len(self._esc) > 2 and (self._esc[1] == "O" or "@" <= ch <= "~")):
+                    self._esc = ""
+                continue
+            if ch == "\x1b":
+                self._esc = ch
+            elif ch in "\r\n":
+                lines.append(self.buffer)
+                self.buffer = ""
+            elif ch in "\x7f\b":
+                self.buffer = self.buffer[:-1]
+            elif ch == "\x15":  # Ctrl-U：清除整行
+                self.buffer = ""
+            elif ch == "\x17":  # Ctrl-W：刪除前一個字
+                head = self.buffer.rstrip()
+                self.buffer = head[:head.rfind(" ") + 1]
+            elif ch == "\t":
+                self.buffer += " "
+            elif ch >= " ":
+                self.buffer += ch
+        for line in lines:
+            self.on_line(line)
+
+
+class SigintHandler:
+    """在 asyncio 迴圈中把 Ctrl-C 轉成 callback（而非 KeyboardInterrupt）。
+
+    suspended() 期間恢復預設行為，讓同步執行的程式碼（!指令、同意詢問）照舊以 KeyboardInterrupt 中止。
+    """
+
+    def __init__(self, loop, callback: Callable[[], None]):
+        self.loop = loop
+        self.callback = callback
+        self._remove: Optional[Callable[[], None]] = None
+
+    def install(self) -> None:
+        if self._remove is not None:
+            return
+        try:
+            self.loop.add_signal_handler(signal.SIGINT, self.callback)
+            self._remove = lambda: self.loop.remove_signal_handler(signal.SIGINT)
+            return
+        except (NotImplementedError, RuntimeError, ValueError):
+            pass  # Windows 或非主執行緒
+        try:
+            previous = signal.signal(signal.SIGINT, lambda *_: self.loop.call_soon_threadsafe(self.callback))
+            self._remove = lambda: signal.signal(signal.SIGINT, previous)
+        except ValueError:
+            self._remove = lambda: None
+
+    def remove(self) -> None:
+        if self._remove is not None:
+            self._remove()
+            self._remove = None
+            if signal.getsignal(signal.SIGINT) in (signal.SIG_DFL, None):
+                signal.signal(signal.SIGINT, signal.default_int_handler)
+
+    @contextmanager
+    def suspended(self) -> Iterator[None]:
+        self.remove()
+        try:
+            yield
+        finally:
+            self.install()
+
+    def __enter__(self) -> "SigintHandler":
+        self.install()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.remove()
+
+
+KEY_SEQUENCES = {
+    "\x1b[A": "up", "\x1b[B": "down", "\x1bOA": "up", "\x1bOB": "down",
+    "\x1b[5~": "pgup", "\x1b[6~": "pgdn",
+    "\x1b[H": "home", "\x1b[1~": "home", "\x1bOH": "home",
+    "\x1b[F": "end", "\x1b[4~": "end", "\x1bOF": "end",
+    "\x1b": "esc", "\r": "enter", "\n": "enter",
+}
+
+
+def read_key(stream=None) -> Optional[str]:
+    """讀取一個按鍵（cbreak、不回顯）；方向鍵等跳脫序列轉成 "up" / "pgdn" / "end" 等名稱。
+
+    不是終端機（或非 POSIX）時回傳 None；Ctrl-C 照常產生 KeyboardInterrupt。
+    """
+    stream = stream or sys.stdin
+    try:
+        import termios
+        import tty
+        fd = stream.fileno()
+        if not os.isatty(fd):
+            return None
+        saved = termios.tcgetattr(fd)
+    except (ImportError, AttributeError, OSError, ValueError):
+        return None
+    try:
+        tty.setcbreak(fd, termios.TCSANOW)
+        data = os.read(fd, 32)  # 一個按鍵的跳脫序列通常一次讀完
+    finally:
+        termios.tcsetattr(fd, termios.TCSADRAIN, saved)
+    key = data.decode("utf-8", "replace")
+    if key in KEY_SEQUENCES:
+        return KEY_SEQUENCES[key]
+    return "esc" if key.startswith("\x1b") else key[:1]  # 其他跳脫序列一律視為 Esc
+
+
+def prefill_input(text: str) -> None:
+    """下一次 input() 預先填入 text（等待回覆時打到一半的訊息）；沒有 readline 時略過。"""
+    if not text:
+        return
+    try:
+        import readline
+    except ImportError:
+        return
+
+    def hook() -> None:
+        readline.insert_text(text)
+        readline.set_startup_hook(None)
+
+    readline.set_startup_hook(hook)
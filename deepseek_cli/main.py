@@ -3,12 +3,16 @@ from __future__ import annotations
 import os
 import re
 import shlex
+import signal
+import time
+from collections import deque
 from pathlib import Path
-from typing import Optional, List, Tuple, Dict
+from typing import Deque, Optional, List, Dict
 
 import click
 import typer
 from rich.console import Console
+from rich.live import Live
 from rich.panel import Panel
 from rich.prompt import Prompt, Confirm
 from rich.text import Text
@@ -21,22 +25,40 @@ from .core.config import (
     DEFAULT_BASEURL,
     DEFAULT_MODEL,
     SUPPORTED_MODELS,
+    cfg_flag,
+    cfg_number,
 )
 from .core.consent import ConsentManager
 from .core.completer import enable_tab_completion
-from .core.chat import chat_loop, model_say  # 仍沿用你的 chat.py；此處只用 model_say
+from .core.filecache import FileAttachment, FileCache
+from .core.history import Conversation, estimate_tokens
+from .core.context import (
+    AT_MENTION_RE,
+    build_chat_prompt,
+    expand_at_mentions,
+    read_context_files,
+    system_messages,
+    whole_file_mentions,
+    write_targets,
+)
+from .core.edits import EditError, commit_plan, parse_edit_blocks, plan_edits, undo_last
+from .core.chat import ReplyError, ReplyStream, StreamPrinter, iter_model_stream, model_say  # 仍沿用你的 chat.py
+from .core.perf import Tracer, cache_hit_text, profiled
+from .core.terminal import SigintHandler, TypeAhead, prefill_input
+from .tool.jobs import JOB_MENTION_RE, JobTable
 from .tool.shell import ShellRunner
-# FileManager 仍保留，但本檔案直接以 Path 開檔，避免打印到畫面
 from .tool.fs import FileManager
-
-from openai import OpenAI
-OpenAI = None  # type: ignore
+from .tool.toolbox import TOOL_SPECS, ToolBox
 
 
 console = Console()
 app = typer.Typer(add_completion=False, add_help_option=False, no_args_is_help=False)
 config_app = typer.Typer(add_completion=False, add_help_option=False, no_args_is_help=True)
 app.add_typer(config_app, name="config")
+cache_app = typer.Typer(add_completion=False, add_help_option=False, no_args_is_help=True)
+app.add_typer(cache_app, name="cache")
+sessions_app = typer.Typer(add_completion=False, add_help_option=False, no_args_is_help=True)
+app.add_typer(sessions_app, name="sessions")
 
 ANSI_BLUE_BOLD = "\033[1;34m"
 ANSI_RESET = "\033[0m"
@@ -129,159 +151,495 @@ class ConfigManager:
 
 
 # ───────────────────────────── 聊天 / REPL（含 @檔案 與 !shell） ─────────────────────────────
-WRITE_BLOCK_RE = re.compile(r"<<<WRITE\s+(.+?)\n(.*?)\n>>>END", re.DOTALL)
-AT_MENTION_RE = re.compile(r"@([^\s]+)")  # 連續非空白視為路徑（支援相對/含副檔名）
+
+FS_COMMANDS = {  # 指令 → (需要的權限, FileManager 方法)
+    ":open": ("fs_read", "read_file"),
+    ":ls": ("fs_read", "list_dir"),
+    ":edit": ("fs_write", "edit_file"),
+    ":rm": ("fs_write", "remove_file"),
+}
+
 
 class ChatManager:
-    def __init__(self, cfg: dict):
+    def __init__(self, cfg: dict, no_cache: bool = False, trace: Optional[Path] = None):
         self.cfg = cfg
+        self.perf = Tracer(trace)
         self.client = self._get_client(cfg)
+        self.responses = None
+        if not no_cache and cfg_flag(cfg, "response_cache", False):
+            from .core.respcache import open_response_cache
+            self.responses = open_response_cache(cfg)
         self.consent = ConsentManager(console, self.cfg)
-        self.shell = ShellRunner(console)
-        # self.fs = FileManager(console)  # 不用它的打印，直接以 Path 處理
+        self.shell = ShellRunner(console, timeout=cfg_number(cfg, "shell_timeout", 0))
+        self.jobs = JobTable(console, self.shell)
+        self.fs = FileManager(console)
+        self.tools = ToolBox(console, self.fs, self.shell, self.consent,
+                             max_bytes=int(cfg_number(cfg, "tool_max_kb", 32) * 1024))
+        self.files = FileCache(max_bytes=int(cfg_number(cfg, "file_cache_mb", 64) * 1024 * 1024))
+        # 前綴快取友善排列：固定的 system 說明在最前、附檔依路徑排序、使用者訊息最後
+        self.stable = cfg_flag(cfg, "prompt_cache_layout", True)
+        self.system = system_messages() if self.stable else []
+        self.history = Conversation(
+            budget=int(cfg_number(cfg, "history_budget", 32000)),
+            summarize=self._summarize if cfg_flag(cfg, "history_compact", True) and self.client else None,
+            cache=self.files,
+            stable=self.stable,
+        )
+        # 對話紀錄在第一輪結束時才建立，沒有對話的工作階段不留下紀錄
+        self.sessions = None
+        self.session_id: Optional[str] = None
+        self._pending: Deque[str] = deque()  # 等待回覆時先輸入、排隊中的訊息
+        self._typed = ""  # 等待回覆時打到一半、尚未送出的文字
 
     def _get_client(self, cfg: dict):
-        if OpenAI is None or not cfg.get("api_key"):
-            return None
-        base_url = (cfg.get("base_url") or DEFAULT_BASEURL).rstrip("/")
-        return OpenAI(api_key=cfg["api_key"], base_url=base_url + "/v1")
+        """建立帶重試、逾時與 hedge 的 ChatClient；沒有 api_key 時為離線模式（None）。"""
+        from .core.client import ChatClient
+        return ChatClient.from_config(cfg)
 
     # ---------------------- 解析/處理 @標注 ----------------------
     def _expand_at_mentions(self, s: str) -> List[Path]:
         """抓出訊息中所有 @路徑，轉為 Path（不檢查存在）。"""
-        paths: List[Path] = []
-        for m in AT_MENTION_RE.finditer(s):
-            raw = m.group(1)
-            p = Path(os.path.expanduser(raw))
-            paths.append(p)
-        return paths
+        return expand_at_mentions(s)
 
-    def _read_files_for_context(self, paths: List[Path]) -> Dict[Path, str]:
-        """讀取檔案內容供模型參考（需讀取同意）。不存在的檔案會略過。"""
-        contents: Dict[Path, str] = {}
+    def _read_files_for_context(self, paths: List[Path]) -> Dict[Path, FileAttachment]:
+        """讀取檔案內容供模型參考（需讀取同意）。不存在的檔案會略過；未變更的檔案直接取自快取。
+        @資料夾會依 .gitignore 展開，並受單檔與總量上限限制。"""
         if not paths:
-            return contents
+            return {}
         if not self.consent.ensure("fs_read"):
             console.print("[yellow]已取消：需要讀取權限[/]")
-            return contents
-        for p in paths:
-            try:
-                if p.is_file():
-                    text = p.read_text(encoding="utf-8", errors="ignore")
-                    contents[p] = text
-            except Exception as e:
-                console.print(f"[red]讀取失敗[/] {p}: {e}")
-        return contents
-
-    def _build_chat_prompt(self, user_msg: str, file_map: Dict[Path, str]) -> str:
-        """將 @檔案內容附加到使用者訊息後方，讓模型有完整上下文。"""
-        if not file_map:
-            return user_msg
-        parts = [user_msg, "\n\n[FILES CONTEXT]"]
-        for p, txt in file_map.items():
-            parts.append(f"\n### {p}\n```text\n{txt}\n```")
-        # 指導模型：若要寫檔，請輸出 WRITE 區塊
-        parts.append(
-            "\n[INSTRUCTION]\n"
-            "若需要修改或建立檔案，請輸出以下格式（一次可多個）：\n"
-            "<<<WRITE 路徑\n"
-            "<完整檔案內容>\n"
-            ">>>END\n"
+            return {}
+        return read_context_files(paths, self.files, self.cfg, report=console.print)
+
+    def _build_chat_prompt(self, user_msg: str, file_map: Dict[Path, FileAttachment], extra: str = "") -> str:
+        """將 @檔案內容（與 @job:N 的輸出尾端 extra）附加到使用者訊息後方，讓模型有完整上下文。"""
+        return build_chat_prompt(user_msg, file_map, self.files, stable=self.stable) + extra
+
+    def _select_chunks(self, user_msg: str, file_map: Dict[Path, FileAttachment]) -> int:
+        """附檔超過 retrieval_budget 時，大檔只送 BM25 挑出的相關段落（@路徑! 強制完整）。"""
+        if not file_map or not cfg_flag(self.cfg, "retrieval", True):
+            return 0
+        from .core.retrieval import open_chunk_index, select_chunks
+        index = open_chunk_index()
+        if index is None:
+            return 0
+        return select_chunks(
+            index, AT_MENTION_RE.sub(" ", user_msg), file_map, self.files,
+            budget=int(cfg_number(self.cfg, "retrieval_budget", 8000)),
+            top_k=int(cfg_number(self.cfg, "retrieval_top_k", 12)),
+            whole=whole_file_mentions(user_msg),
         )
-        return "\n".join(parts)
 
-    # ---------------------- 解析/套用 <<<WRITE ... >>>END ----------------------
-    def _apply_write_blocks(self, reply: str, allowed_targets: List[Path]) -> None:
-        """從模型回覆中擷取寫檔區塊並在同意下寫入；僅允許寫入使用者這次有 @ 標注的目標。"""
-        blocks = WRITE_BLOCK_RE.findall(reply)
-        if not blocks:
+    # ---------------------- 對話紀錄 ----------------------
+    def resume(self, ref: str) -> bool:
+        """接續先前的工作階段：只載入放得進 history_budget 的最近輪次，更早的視需要再從磁碟讀回。"""
+        from .core.sessions import open_session_store
+        store = open_session_store()
+        sid = store.resolve(ref) if store else None
+        info = store.info(sid) if sid else None
+        if info is None:
+            console.print(f"[red]找不到工作階段[/] {ref}（deepseek sessions list 可列出；前綴需唯一）")
+            return False
+        self.sessions, self.session_id = store, sid
+        loaded = self.history.restore(
+            info["last_no"], info["summary"], info["oldest"],
+            older=lambda oldest, before, room: store.older(sid, oldest, before, room),
+        )
+        extra = "與先前摘要" if info["summary"] else ""
+        console.print(f"[green]✓ 已接續工作階段[/] {sid}（共 {info['turns']} 輪，載入最近 {loaded} 輪{extra}）")
+        return True
+
+    def _record_turn(self, turn) -> None:
+        """把剛完成的一輪附加到對話紀錄（config set session_save false 可關閉）。"""
+        if self.sessions is None:
+            if self.session_id is not None or not cfg_flag(self.cfg, "session_save", True):
+                return
+            from .core.sessions import open_session_store
+            self.sessions = open_session_store()
+            if self.sessions is None:
+                return
+        try:
+            if self.session_id is None:
+                self.session_id = self.sessions.create(self.cfg["model"], os.getcwd())
+            self.sessions.append(self.session_id, turn)
+        except Exception as e:
+            console.print(f"[yellow]對話紀錄寫入失敗[/] {e}")
+
+    def _save_summary(self) -> None:
+        if self.sessions is not None and self.session_id is not None:
+            try:
+                self.sessions.set_summary(self.session_id, self.history.summary, self.history.oldest)
+            except Exception:
+                pass
+
+    # ---------------------- 呼叫模型 ----------------------
+    def _prepare_turn(self, user_msg: str, file_map: Dict[Path, FileAttachment], extra: str = ""):
+        """組出本輪提示與歷史 messages；extra 只附在本輪提示，不存入對話記憶。
+
+        模型在仍留在視窗內的輪次看過的檔案，只送「未變更」註記或 unified diff；
+        若它依賴的輪次因預算被擠出視窗，改回送完整內容。其餘附檔總量過大時改送相關段落。
+        """
+        if not cfg_flag(self.cfg, "history", True):
+            self._report_excerpts(self._select_chunks(user_msg, file_map))
+            return self._build_chat_prompt(user_msg, file_map, extra), self.system or None
+        deps = {}
+        if cfg_flag(self.cfg, "file_delta", True):
+            seen = self.history.seen_files()
+            for att in file_map.values():
+                prev = seen.get(att.key[0])
+                if prev and att.plan_delta(prev[1], prev[0], self.files):
+                    deps[id(att)] = (att, prev[2])
+        excerpted = 0
+        while True:
+            excerpted += self._select_chunks(user_msg, file_map)
+            prompt = self._build_chat_prompt(user_msg, file_map, extra)
+            window = self.history.window(reserve=estimate_tokens(prompt) + self._system_tokens)
+            in_window = {t.no for t in window}
+            broken = [k for k, (_, need) in deps.items() if not need <= in_window]
+            if not broken:
+                self._report_excerpts(excerpted)
+                return prompt, self.system + self.history.messages(turns=window)
+            for k in broken:
+                deps.pop(k)[0].reset()
+
+    @property
+    def _system_tokens(self) -> int:
+        return sum(estimate_tokens(m["content"]) for m in self.system)
+
+    @staticmethod
+    def _report_excerpts(n: int) -> None:
+        if n:
+            console.print(f"[dim]{n} 個大型檔案只附上與問題相關的段落（@路徑! 可改送完整內容）[/]")
+
+    async def _say(self, prompt: str, history=None) -> Optional[str]:
+        """送出提示並顯示回覆；模型要求工具呼叫時執行後把結果送回，直到得到最終回覆。
+
+        同一個回覆中的多個工具呼叫以執行緒池並行執行，結果在一次後續請求中全部送回；
+        最多 tool_max_rounds 輪，最後一輪不再提供工具。工具往返只存在本輪，對話記憶只保留最終回覆。
+        Ctrl-C（回覆或工具執行中）中止整輪並回傳 None；任一次請求失敗時拋出 ReplyError。
+        """
+        use_tools = cfg_flag(self.cfg, "tools", True) and self.client is not None \
+            and "reasoner" not in self.cfg["model"]  # deepseek-reasoner 不支援 function calling
+        rounds = int(cfg_number(self.cfg, "tool_max_rounds", 6)) if use_tools else 0
+        followup: List[dict] = []
+        for n in range(rounds + 1):
+            calls: Optional[List[Dict[str, str]]] = [] if n < rounds else None
+            reply = await self._request(prompt, history, followup, calls)
+            if reply is None or not calls:
+                return reply
+            followup.append({"role": "assistant", "content": reply or None, "tool_calls": [
+                {"id": c["id"], "type": "function", "function": {"name": c["name"], "arguments": c["arguments"]}}
+                for c in calls]})
+            with self.perf.span("tools"):
+                results = self.tools.run(calls)
+            if results is None:
+                return None
+            followup.extend(results)
+
+    async def _request(self, prompt: str, history, followup: List[dict],
+                       calls: Optional[List[Dict[str, str]]]) -> Optional[str]:
+        """送出一次請求並顯示回覆；預設串流（config set stream false 可關閉）。calls 為 list 時提供工具並填入呼叫。
+
+        回覆在背景執行緒接收，等待期間可先輸入下一則訊息（排入佇列）或執行 !指令；
+        Ctrl-C 只中止這次請求並關閉 HTTP 串流，回傳 None，工作階段照常繼續；呼叫失敗時拋出 ReplyError。
+        """
+        import asyncio
+        usage: dict = {}
+        stream = cfg_flag(self.cfg, "stream", True)
+        tools = TOOL_SPECS if calls is not None else None
+        printer = StreamPrinter(console, fps=cfg_number(self.cfg, "stream_fps", 12.0),
+                                show_reasoning=cfg_flag(self.cfg, "show_reasoning", False))
+        if stream:
+            def chunks(on_open):
+                return iter_model_stream(self.client, self.cfg["model"], prompt, history,
+                                         cache=self.responses, usage=usage, on_open=on_open,
+                                         tools=tools, followup=followup, calls=calls, raise_errors=True)
+        else:
+            def chunks(on_open):
+                yield "content", model_say(self.client, self.cfg["model"], prompt, history,
+                                           cache=self.responses, usage=usage,
+                                           tools=tools, followup=followup, calls=calls, raise_errors=True)
+        rs = ReplyStream(chunks)
+        done = rs.start(asyncio.get_running_loop())
+        await self._watch(done, rs, printer)
+        if done.cancelled():
+            console.print(f"[yellow]已中止回覆[/] [dim]（已收到 {len(rs.reply)} 字，未存入對話記憶）[/]")
+            return None
+        try:
+            reply = done.result()
+        except Exception as e:
+            # 串流中途失敗時已收到的部分回覆不完整，不顯示為正文，也不交給呼叫端
+            console.print(f"[red](呼叫失敗：{e})[/] [dim]（已收到 {len(rs.reply)} 字，未存入對話記憶）[/]")
+            raise ReplyError(str(e)) from e
+        if stream:
+            printer.finish(reply, rs.reasoning, rs.ttft, rs.elapsed, usage)
+            self.perf.add("ttft", rs.ttft)
+            self.perf.add("render", printer.render_time)
+        else:
+            with self.perf.span("render"):
+                if reply:
+                    console.print(Text(reply, style="bold cyan"))
+                hit = cache_hit_text(usage)
+                if hit:
+                    console.print(Text(hit, style="dim"))
+        self.perf.add("network", rs.elapsed)
+        self.perf.usage(usage)
+        return reply
+
+    async def _watch(self, done, rs, printer: StreamPrinter) -> None:
+        """等待回覆完成：Live 顯示目前內容，底部是尚未送出的輸入；Ctrl-C 取消 done。"""
+        import asyncio
+        loop = asyncio.get_running_loop()
+        submitted: List[str] = []
+        keys = TypeAhead(loop, on_line=submitted.append)
+        sigint = SigintHandler(loop, done.cancel)
+
+        def frame():
+            return printer.update(rs.reply, rs.reasoning, footer=self._footer(keys))
+
+        with sigint, Live(frame(), console=console, auto_refresh=False, transient=True) as live, keys:
+            while not done.done():
+                await asyncio.wait([done], timeout=printer.min_interval)
+                while submitted:
+                    line = submitted.pop(0).strip()
+                    if line.startswith("!"):
+                        # 指令在前景執行（回覆繼續於背景接收）；期間 Ctrl-C 照舊只中止指令
+                        live.stop()
+                        with keys.paused(), sigint.suspended():
+                            console.print(f"[bold blue]›[/] {line}")
+                            self._run_shell(line[1:])
+                        live.start()
+                    elif line:
+                        self._pending.append(line)
+                start = time.perf_counter()
+                live.update(frame(), refresh=True)
+                printer.render_time += time.perf_counter() - start
+            self._typed = keys.buffer
+
+    def _footer(self, keys: TypeAhead):
+        hint = "Ctrl-C 中止回覆"
+        if self._pending:
+            hint += f" · 已排入 {len(self._pending)} 則"
+        if not keys.enabled:
+            return Text(hint, style="dim")
+        return Text.assemble(("› ", "bold blue"), keys.buffer, ("▌", "blink"), "\n",
+                             (f"{hint} · Enter 排入下一則 · !指令 立即執行", "dim"))
+
+    def _summarize(self, text: str) -> str:
+        """供背景壓縮使用：以同一模型摘要較舊的對話（不帶歷史、不顯示）。"""
+        return model_say(self.client, self.cfg["model"], text)
+
+    # ---------------------- 解析/套用 <<<WRITE|EDIT|PATCH ... >>>END ----------------------
+    def _apply_write_blocks(self, reply: str, allowed_targets: List[Path],
+                            excerpted: Optional[List[Path]] = None) -> None:
+        """從模型回覆中擷取寫檔區塊並在同意下寫入；僅允許寫入使用者這次有 @ 標注的目標。
+
+        所有 EDIT / PATCH 區塊先在記憶體中驗證，任何一段套不上就整批不寫；
+        通過後平行原子寫入，並留下 undo 紀錄（:undo 還原）。
+        本輪只送出節錄的檔案不接受 WRITE 整檔覆寫，以免模型沒看到的部分被清掉。
+        """
+        ops = parse_edit_blocks(reply)
+        if not ops:
             return
 
         # 目標白名單：使用者訊息中有 @ 的檔案（安全考量）
         allow_set = {p.resolve() for p in allowed_targets}
 
-        to_write: List[Tuple[Path, str]] = []
-        for raw_path, content in blocks:
-            target = Path(os.path.expanduser(raw_path)).resolve()
-            if target not in allow_set:
-                console.print(f"[yellow]略過寫入[/] {target}（未在訊息中 @ 提及）")
+        partial = {p.resolve() for p in excerpted or []}
+
+        kept = []
+        for op in ops:
+            if op.path not in allow_set:
+                console.print(f"[yellow]略過寫入[/] {op.path}（未在訊息中 @ 提及）")
+                continue
+            if op.kind == "WRITE" and op.path in partial and op.path.exists():
+                console.print(f"[yellow]略過寫入[/] {op.path}（本輪只送出節錄，WRITE 會覆寫未送出的部分）")
                 continue
-            to_write.append((target, content))
+            kept.append(op)
 
-        if not to_write:
+        if not kept:
+            return
+
+        try:
+            plan = plan_edits(kept)
+        except EditError as e:
+            console.print(f"[red]編輯未套用[/] {e}（所有檔案均未變更）")
             return
 
         if not self.consent.ensure("fs_write"):
             console.print("[yellow]已取消：需要寫入權限[/]")
             return
 
-        for path, new_text in to_write:
-            try:
-                path.parent.mkdir(parents=True, exist_ok=True)
-                path.write_text(new_text, encoding="utf-8")
+        for path, err in commit_plan(plan):
+            if err is None:
                 console.print(f"[green]✓ 已寫入[/] {path}")
-            except Exception as e:
-                console.print(f"[red]寫入失敗[/] {path}: {e}")
+            else:
+                console.print(f"[red]寫入失敗[/] {path}: {err}")
 
     # ---------------------- Shell（支援 @ 展開） ----------------------
     def _expand_at_in_shell(self, cmd: str) -> str:
-        """把 ! 命令中的 @路徑展開為 shell 安全字串（加引號）。"""
+        """把 ! 命令中的 @路徑展開為 shell 安全字串（加引號）；@job:N 展開為該工作的輸出檔。"""
         def repl(m: re.Match) -> str:
             raw = m.group(1)
+            job = JOB_MENTION_RE.fullmatch(m.group(0))
+            if job and int(job.group(1)) in self.jobs.jobs:
+                return shlex.quote(str(self.jobs.jobs[int(job.group(1))].spool))
             p = Path(os.path.expanduser(raw)).resolve()
             # 用 shlex.quote 確保安全
             return shlex.quote(str(p))
         return AT_MENTION_RE.sub(lambda m: repl(m), cmd)
 
+    def _run_shell(self, cmd: str) -> None:
+        """執行 ! 之後的指令；以 & 開頭（!&指令）時改為背景工作。"""
+        if not self.consent.ensure("shell"):
+            console.print("[yellow]已取消：需要系統指令權限[/]")
+            return
+        if cmd.startswith("&"):
+            self.jobs.start(self._expand_at_in_shell(cmd[1:].strip()))
+            return
+        self.shell.run(self._expand_at_in_shell(cmd))
+
+    # ---------------------- :open / :ls / :edit / :rm ----------------------
+    def _file_command(self, name: str, arg: str) -> None:
+        kind, action = FS_COMMANDS[name]
+        if not arg and name != ":ls":
+            console.print(f"[yellow]用法：[/]{name} <路徑>")
+            return
+        if not self.consent.ensure(kind):
+            console.print(f"[yellow]已取消：需要{'讀取' if kind == 'fs_read' else '寫入'}權限[/]")
+            return
+        getattr(self.fs, action)(Path(os.path.expanduser(arg.lstrip("@") or ".")))
+
     # ---------------------- REPL 主流程 ----------------------
     def repl(self):
+        if self.client is not None:
+            self.client.warm_up()  # 使用者還在看 banner / 輸入時，先把連線建好
         BannerManager.print_banner()
         enable_tab_completion()
         self._show_hints(self.cfg["model"], self.cfg["base_url"])
 
+        import asyncio
+        asyncio.run(self._repl_loop())
+
+        # REPL 結束：若有新的權限旗標，儲存
+        self.jobs.close()
+        self.perf.close()
+        save_config(self.consent.cfg)
+        if self.session_id is not None:
+            self.history.wait(timeout=10)  # 讓進行中的摘要寫進紀錄
+            self._save_summary()
+            console.print(f"[dim]對話已保存：deepseek --resume {self.session_id}[/]")
+
+    def _read_line(self) -> str:
+        """閒置時以 readline 讀取（Tab 補全照常、Ctrl-C / Ctrl-D 離開）；等待回覆時打到一半的文字會預先填入。"""
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+        prefill_input(self._typed)
+        self._typed = ""
+        return Prompt.ask("[bold blue]›[/]")
+
+    async def _repl_loop(self) -> None:
         while True:
-            try:
-                s = Prompt.ask("[bold blue]›[/]").strip()
-            except (EOFError, KeyboardInterrupt):
-                console.print()
-                break
+            if self._pending:
+                s = self._pending.popleft()
+                console.print(f"[bold blue]›[/] {s}")
+            else:
+                for job in self.jobs.reap():
+                    console.print(f"[dim][{job.no}] {job.status()} · {job.cmd} · {job.elapsed:.1f}s[/]")
+                try:
+                    s = self._read_line().strip()
+                except (EOFError, KeyboardInterrupt):
+                    console.print()
+                    break
             if not s:
                 continue
             if s.lower() in {"exit", "quit", "q"}:
                 break
+            try:
+                await self._handle(s)
+            except KeyboardInterrupt:
+                console.print("[yellow]已取消[/]")
+
+    async def _handle(self, s: str) -> None:
+        if s == ":clear":
+            self.history.clear()
+            self._save_summary()
+            console.print("[green]✓ 已清除對話記憶[/]")
+            return
+        if s == ":stats":
+            self.perf.render(console)
+            return
+        if s == ":jobs":
+            self.jobs.render_table()
+            return
+        name, _, ref = s.partition(" ")
+        if name in FS_COMMANDS:
+            self._file_command(name, ref.strip())
+            return
+        if name == ":fg":
+            self.jobs.follow(ref)
+            return
+        if name == ":kill":
+            self.jobs.kill(ref)
+            return
+        if s == ":undo":
+            restored = undo_last()
+            for path in restored:
+                console.print(f"[green]✓ 已還原[/] {path}")
+            if not restored:
+                console.print("[yellow]沒有可還原的寫入[/]")
+            return
 
-            # 1) Shell：! 開頭 → 展開 @ 然後執行
-            if s.startswith("!"):
-                if not self.consent.ensure("shell"):
-                    console.print("[yellow]已取消：需要系統指令權限[/]")
-                    continue
-                expanded = self._expand_at_in_shell(s[1:])
-                self.shell.run(expanded)
-                continue
+        # 1) Shell：! 開頭 → 展開 @ 然後執行
+        if s.startswith("!"):
+            self._run_shell(s[1:])
+            return
 
+        with self.perf.turn() as record:
             # 2) 聊天：擷取 @ 檔案，帶入上下文
-            at_paths = self._expand_at_mentions(s)
-            file_map = self._read_files_for_context(at_paths)
-            prompt = self._build_chat_prompt(s, file_map)
-            reply = model_say(self.client, self.cfg["model"], prompt)
-            console.print(Text(reply, style="bold cyan"))
-
-            # 3) 依回覆中的 <<<WRITE ...>>>END 寫入（僅允許本次有 @ 的目標）
-            self._apply_write_blocks(reply, allowed_targets=at_paths)
-
-        # REPL 結束：若有新的權限旗標，儲存
-        save_config(self.consent.cfg)
+            at_paths = self._expand_at_mentions(JOB_MENTION_RE.sub(" ", s))
+            with self.perf.span("read"):
+                file_map = self._read_files_for_context(at_paths)
+                job_output = self.jobs.render_context(
+                    self.jobs.mentions(s), int(cfg_number(self.cfg, "job_tail_kb", 16) * 1024))
+            with self.perf.span("prompt"):
+                prompt, history = self._prepare_turn(s, file_map, job_output)
+            record["files"] = len(file_map)
+            try:
+                reply = await self._say(prompt, history)
+            except ReplyError:
+                record["error"] = True  # 失敗的回覆不存入對話記憶，也不套用其中的寫檔區塊
+                return
+            if reply is None:
+                record["cancelled"] = True
+                return
+            # 歷史只存原始訊息與檔案參照，內容由 FileCache 提供，不重複保存
+            self._record_turn(self.history.add(s, reply, list(file_map.values())))
+
+            # 3) 依回覆中的 <<<WRITE ...>>>END 寫入（僅允許本次有 @ 的目標，含 @資料夾展開的檔案）
+            with self.perf.span("write"):
+                self._apply_write_blocks(
+                    reply, allowed_targets=write_targets(at_paths, file_map),
+                    excerpted=[p for p, att in file_map.items() if att.mode == "excerpt"],
+                )
 
     def _show_hints(self, model: str, base_url: str) -> None:
         console.print(
             Panel.fit(
                 "輸入訊息或指令；支援：\n"
                 "  • [bold]@<檔案|資料夾>[/] 於聊天中標注檔案，模型可閱讀其內容\n"
+                "    大檔只送與問題相關的段落；[bold]@檔案![/] 強制送完整內容\n"
                 "  • [bold]!<shell>[/] 執行命令；支援 @ 展開（例：!cat @README.md）\n"
+                "  • [bold]!&<shell>[/] 背景執行；[bold]:jobs[/] 列出、[bold]:fg N[/] 查看輸出、[bold]:kill N[/] 終止，"
+                "[bold]@job:N[/] 把輸出尾端附給模型\n"
+                "  • 模型可自行呼叫 read_file / list_dir / grep / run_shell 查看專案（同樣需要你的同意）\n"
                 "  • 若要請模型幫你改檔，可在訊息中描述「遵照 @A 指示去修改 @B」\n"
                 "    模型回覆若附：\n"
-                "      <<<WRITE 路徑\\n...內容...\\n>>>END\n"
+                "      <<<WRITE 路徑\\n...內容...\\n>>>END（或局部修改的 <<<EDIT / <<<PATCH）\n"
                 "    我會在你同意的前提下自動寫入（僅限本輪 @ 過的檔案目標）\n"
+                "  • 回覆中可先輸入下一則（排入佇列）或執行 !指令；[bold]Ctrl-C[/] 只中止這次回覆\n"
+                "  • [bold]:open[/] 分頁檢視檔案　[bold]:ls[/] 列出資料夾　[bold]:edit[/] / [bold]:rm[/] 編輯或刪除檔案\n"
+                "  • [bold]:undo[/] 還原上一次寫入　[bold]:clear[/] 清除對話記憶　[bold]:stats[/] 各階段耗時\n"
+                "  • 對話會自動保存；[bold]deepseek sessions list[/] 列出、[bold]deepseek --resume ID[/] 接續\n"
                 "離開：exit / quit / q",
                 title=f"Model • {model}   Base • {base_url}",
                 border_style="blue",
@@ -293,6 +651,13 @@ class ChatManager:
 @app.callback(invoke_without_command=True)
 def main(
     ctx: typer.Context,
+    no_cache: bool = typer.Option(False, "--no-cache", help="略過回覆快取"),
+    trace: Optional[Path] = typer.Option(None, "--trace", help="把每輪的階段耗時與 token 用量寫入 JSONL"),
+    profile: bool = typer.Option(False, "--profile", help="以 cProfile 記錄整個工作階段"),
+    resume: Optional[str] = typer.Option(None, "--resume", "-r", metavar="ID",
+                                         help="接續先前的工作階段（ID、唯一前綴或 last）"),
+    print_: Optional[str] = typer.Option(None, "--print", "-p", metavar="PROMPT",
+                                         help="非互動模式：讀取 stdin，回覆以純文字輸出到 stdout"),
     help_: bool = typer.Option(False, "--help", "-h", is_flag=True, is_eager=True),
 ):
     if help_:
@@ -300,7 +665,264 @@ def main(
     if ctx.invoked_subcommand is not None:
         return
     cfg = normalize_with_defaults(load_config() or {})
-    ChatManager(cfg).repl()
+    if print_ is not None:
+        # 一般由 deepseek_cli.__main__ 直接分派（不載入 typer / rich）；經由 typer 進來時結果相同
+        from .core.pipe import run_pipe
+        raise typer.Exit(run_pipe(print_, cfg, no_cache=no_cache))
+    chat = ChatManager(cfg, no_cache=no_cache, trace=trace)
+    if resume and not chat.resume(resume):
+        raise typer.Exit(1)
+    if profile:
+        with profiled(console):
+            chat.repl()
+    else:
+        chat.repl()
+
+
+@app.command("batch", add_help_option=False)
+def batch(
+    input_path: str = typer.Argument("-", metavar="INPUT", help="JSONL 輸入檔；'-' 代表 stdin"),
+    output: Optional[str] = typer.Option(None, "--output", "-o", help="結果 JSONL（預設 stdout）"),
+    concurrency: int = typer.Option(8, "--concurrency", "-c", help="同時進行的請求數"),
+    rps: float = typer.Option(0.0, "--rps", help="每秒請求上限（0 = 不限）"),
+    retries: int = typer.Option(4, "--retries", help="可重試錯誤的重試次數"),
+    resume: bool = typer.Option(False, "--resume", help="從輸出檔已完成的筆數續跑"),
+    model: Optional[str] = typer.Option(None, "--model", "-m", help="覆寫設定中的模型"),
+    allow_read: bool = typer.Option(False, "--allow-read", help="允許展開提示中的 @檔案/資料夾"),
+    no_cache: bool = typer.Option(False, "--no-cache", help="略過回覆快取"),
+    help_: bool = typer.Option(False, "--help", "-h", is_flag=True, is_eager=True),
+):
+    """以 JSONL 批次送出提示（並行、限速、可續跑），結果依輸入順序輸出。"""
+    if help_:
+        BannerManager.print_help_top_and_exit()
+    import asyncio
+    import sys
+    import time
+    from rich.progress import Progress, SpinnerColumn, TextColumn, TimeElapsedColumn
+    from .core.batch import BatchRunner, checkpoint_offset, make_async_client, open_input
+    from .core.respcache import open_response_cache
+
+    err = Console(stderr=True)
+    cfg = normalize_with_defaults(load_config() or {})
+    client = make_async_client(cfg)
+    if client is None:
+        err.print("[red]batch 需要 api_key：請先執行 deepseek config edit[/]")
+        raise typer.Exit(2)
+    if resume and not output:
+        err.print("[red]--resume 需要搭配 --output[/]")
+        raise typer.Exit(2)
+
+    skip = checkpoint_offset(Path(output)) if resume and output else 0
+    prepare = None
+    if allow_read or cfg_flag(cfg, "allow_fs_read"):
+        files = FileCache(max_bytes=int(cfg_number(cfg, "file_cache_mb", 64) * 1024 * 1024))
+
+        def _with_files(text: str) -> str:
+            file_map = read_context_files(expand_at_mentions(text), files, cfg)
+            # batch 不套用寫檔區塊，不附寫檔說明
+            return build_chat_prompt(text, file_map, files, edits=False)
+
+        prepare = _with_files
+
+    out = open(output, "a" if resume else "w", encoding="utf-8") if output else sys.stdout
+    start = time.perf_counter()
+    with Progress(SpinnerColumn(), TextColumn("{task.description}"), TimeElapsedColumn(),
+                  console=err, transient=True) as progress:
+        task = progress.add_task(f"batch（已略過 {skip} 筆）" if skip else "batch", total=None)
+
+        def on_record(record: dict) -> None:
+            progress.update(task, advance=1,
+                            description=f"完成 {runner.ok} · 失敗 {runner.failed}")
+
+        runner = BatchRunner(
+            client, model or cfg["model"], out,
+            concurrency=concurrency, rps=rps, retries=retries,
+            prepare=prepare, on_record=on_record,
+            cache=open_response_cache(cfg, bypass=no_cache),
+        )
+        source = open_input(input_path)
+        try:
+            asyncio.run(runner.run(source, skip=skip))
+        finally:
+            if source is not sys.stdin:
+                source.close()
+            if out is not sys.stdout:
+                out.close()
+    elapsed = time.perf_counter() - start
+    total = runner.ok + runner.failed
+    err.print(f"[green]✓ 完成 {runner.ok}[/] · [red]失敗 {runner.failed}[/] · "
+              f"{elapsed:.1f}s · {total / elapsed if elapsed else 0:.2f} 筆/秒")
+    if runner.failed:
+        raise typer.Exit(1)
+
+
+@app.command("map", add_help_option=False)
+def map_files(
+    prompt: str = typer.Argument(..., metavar="PROMPT", help="對每個檔案送出的提示"),
+    patterns: List[str] = typer.Argument(..., metavar="GLOB...", help="檔案 glob，** 可跨資料夾（請加引號，避免 shell 先展開）"),
+    log: str = typer.Option("deepseek-map.jsonl", "--log", "-o", help="逐檔結果 JSONL"),
+    concurrency: int = typer.Option(8, "--concurrency", "-c", help="同時進行的請求數"),
+    rps: float = typer.Option(0.0, "--rps", help="每秒請求上限（0 = 不限）"),
+    retries: int = typer.Option(4, "--retries", help="可重試錯誤的重試次數"),
+    resume: bool = typer.Option(False, "--resume", help="略過記錄檔中已完成的檔案"),
+    model: Optional[str] = typer.Option(None, "--model", "-m", help="覆寫設定中的模型"),
+    dry_run: bool = typer.Option(False, "--dry-run", help="只驗證編輯區塊，不寫入檔案"),
+    yes: bool = typer.Option(False, "--yes", "-y", help="不詢問，直接允許寫入"),
+    no_cache: bool = typer.Option(False, "--no-cache", help="略過回覆快取"),
+    help_: bool = typer.Option(False, "--help", "-h", is_flag=True, is_eager=True),
+):
+    """對符合 glob 的每個檔案各送一次提示（並行、限速、可續跑），並原子套用回覆中的編輯區塊。"""
+    if help_:
+        BannerManager.print_help_top_and_exit()
+    import asyncio
+    import time
+    from rich.progress import BarColumn, MofNCompleteColumn, Progress, TextColumn, TimeElapsedColumn, TimeRemainingColumn
+    from .core.batch import make_async_client
+    from .core.mapper import MapRunner, expand_globs, finished_paths
+    from .core.respcache import open_response_cache
+
+    err = Console(stderr=True)
+    cfg = normalize_with_defaults(load_config() or {})
+    client = make_async_client(cfg)
+    if client is None:
+        err.print("[red]map 需要 api_key：請先執行 deepseek config edit[/]")
+        raise typer.Exit(2)
+
+    log_path = Path(log)
+    paths = expand_globs(patterns, exclude=[log_path])
+    done = finished_paths(log_path) if resume else set()
+    todo = [p for p in paths if str(p.resolve()) not in done]
+    if not paths:
+        err.print(f"[yellow]沒有符合的檔案[/] {' '.join(patterns)}")
+        raise typer.Exit(2)
+    if done:
+        err.print(f"[dim]已完成 {len(paths) - len(todo)} 個檔案，略過（{log_path}）[/]")
+    if not todo:
+        err.print("[green]✓ 全部檔案都已完成[/]")
+        return
+    if not dry_run and not yes and not ConsentManager(err, cfg).ensure("fs_write"):
+        err.print("[yellow]已取消：需要寫入權限（--dry-run 可只檢視結果）[/]")
+        raise typer.Exit(2)
+
+    out = open(log_path, "a" if resume else "w", encoding="utf-8")
+    start = time.perf_counter()
+    interrupted = False
+    with Progress(TextColumn("{task.description}"), BarColumn(), MofNCompleteColumn(),
+                  TimeElapsedColumn(), TimeRemainingColumn(), console=err, transient=True) as progress:
+        task = progress.add_task("map", total=len(todo))
+
+        def on_record(record: dict) -> None:
+            if record["status"] == "written":
+                progress.console.print(f"[green]✓ 已寫入[/] {record['path']}")
+            elif record["status"] == "error":
+                progress.console.print(f"[red]✗[/] {record['path']}: {record['error']}")
+            counts = runner.counts
+            progress.update(task, advance=1, description=(
+                f"寫入 {counts.get('written', 0) + counts.get('planned', 0)} · "
+                f"未變更 {counts.get('unchanged', 0)} · 失敗 {runner.failed}"))
+
+        runner = MapRunner(
+            client, model or cfg["model"], prompt, out,
+            concurrency=concurrency, rps=rps, retries=retries,
+            cache=open_response_cache(cfg, bypass=no_cache),
+            files=FileCache(max_bytes=int(cfg_number(cfg, "file_cache_mb", 64) * 1024 * 1024)),
+            max_file_bytes=int(cfg_number(cfg, "dir_max_file_kb", 128) * 1024),
+            dry_run=dry_run, on_record=on_record,
+        )
+        try:
+            asyncio.run(runner.run(todo))
+        except KeyboardInterrupt:
+            interrupted = True
+        finally:
+            out.close()
+    elapsed = time.perf_counter() - start
+    counts = runner.counts
+    written = f"預計寫入 {counts.get('planned', 0)}" if dry_run else f"寫入 {counts.get('written', 0)}"
+    err.print(f"[green]✓ {written}[/] · 未變更 {counts.get('unchanged', 0)} · 略過 {counts.get('skipped', 0)} · "
+              f"[red]失敗 {runner.failed}[/] · {elapsed:.1f}s · "
+              f"{(runner.ok + runner.failed) / elapsed if elapsed else 0:.2f} 檔/秒 · 記錄於 {log_path}")
+    if interrupted:
+        err.print("[yellow]已中斷[/]（已完成的檔案都已寫入；加上 --resume 續跑）")
+        raise typer.Exit(130)
+    if runner.failed:
+        raise typer.Exit(1)
+
+
+# Cache 子指令
+@cache_app.command("stats", add_help_option=False)
+def cache_stats(
+    help_: bool = typer.Option(False, "--help", "-h", is_flag=True, is_eager=True),
+):
+    if help_:
+        BannerManager.print_help_top_and_exit()
+    import time
+    from .core.respcache import open_response_cache
+    BannerManager.print_banner()
+    cfg = normalize_with_defaults(load_config() or {})
+    cache = open_response_cache(cfg, force=True)
+    st = cache.stats()
+    cache.close()
+    oldest = time.strftime("%Y-%m-%d %H:%M", time.localtime(st["oldest"])) if st["oldest"] else "—"
+    console.print(
+        Panel.fit(
+            Text.from_markup(
+                f"[bold]enabled:[/]\t{cfg_flag(cfg, 'response_cache', False)}\n"
+                f"[bold]path:[/]\t{st['path']}\n"
+                f"[bold]entries:[/]\t{st['entries']}\n"
+                f"[bold]size:[/]\t{st['bytes'] / 1024 / 1024:.2f} / {st['max_bytes'] / 1024 / 1024:.0f} MB\n"
+                f"[bold]hits:[/]\t{st['hits']}\n"
+                f"[bold]oldest:[/]\t{oldest}（TTL {st['ttl'] / 3600:.0f} 小時）"
+            ),
+            title="cache",
+            border_style="blue",
+        )
+    )
+
+
+@cache_app.command("clear", add_help_option=False)
+def cache_clear(
+    help_: bool = typer.Option(False, "--help", "-h", is_flag=True, is_eager=True),
+):
+    if help_:
+        BannerManager.print_help_top_and_exit()
+    from .core.respcache import open_response_cache
+    BannerManager.print_banner()
+    cache = open_response_cache(normalize_with_defaults(load_config() or {}), force=True)
+    n = cache.clear()
+    cache.close()
+    console.print(f"[green]✓ 已清除[/] {n} 筆快取回覆")
+
+
+# Sessions 子指令
+@sessions_app.command("list", add_help_option=False)
+def sessions_list(
+    limit: int = typer.Option(20, "--limit", "-n", help="最多列出幾筆"),
+    help_: bool = typer.Option(False, "--help", "-h", is_flag=True, is_eager=True),
+):
+    """列出最近的工作階段（以 deepseek --resume ID 接續）。"""
+    if help_:
+        BannerManager.print_help_top_and_exit()
+    import time
+    from rich.table import Table
+    from .core.sessions import open_session_store
+    store = open_session_store()
+    rows = store.list(limit) if store else []
+    if not rows:
+        console.print("[dim]尚無保存的對話[/]")
+        return
+    table = Table(border_style="blue")
+    table.add_column("ID", style="bold cyan", min_width=8, no_wrap=True)
+    table.add_column("最後使用", min_width=16, no_wrap=True)
+    table.add_column("輪數", justify="right", min_width=4, no_wrap=True)
+    table.add_column("目錄", overflow="fold")
+    table.add_column("開頭", overflow="ellipsis", no_wrap=True, max_width=24)
+    home = str(Path.home())
+    for r in rows:
+        cwd = "~" + r["cwd"][len(home):] if r["cwd"].startswith(home) else r["cwd"]
+        table.add_row(r["id"], time.strftime("%Y-%m-%d %H:%M", time.localtime(r["updated"])),
+                      str(r["turns"]), cwd, r["title"])
+    console.print(table)
+    store.close()
 
 
 # Config 子指令
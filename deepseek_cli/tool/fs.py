@@ -1,28 +1,283 @@
+import mmap, os, re
+from itertools import chain, islice
 from pathlib import Path
-from typing import List
-from rich.console import Console
+from typing import Iterable, List, Optional, Tuple
+from rich.console import Console, Group
 from rich.panel import Panel
-from rich.syntax import Syntax
+from rich.text import Text
+
+from ..core.terminal import read_key
+
+MAX_LINE_BYTES = 4096  # 單行超過此長度（或沒有換行的二進位檔）時切段顯示
+SORT_LIMIT = 1000      # 項目不超過此數時排序後一次列出；更多時依目錄順序分頁串流
+GREP_LINE_CHARS = 300  # grep 結果每行最多字數
+
+
+def human_size(n: int) -> str:
+    if n < 1024:
+        return f"{n} B"
+    if n < 1024 * 1024:
+        return f"{n / 1024:.1f} KB"
+    return f"{n / 1024 / 1024:.1f} MB"
+
+
+class FilePager:
+    """以 mmap 檢視檔案：只找出目前畫面需要的行邊界，只對可見的那一頁做語法上色。
+
+    不建立全檔行索引；往前翻頁、跳到結尾與搜尋都直接在 mmap 上 find / rfind，
+    因此開啟數百 MB 的檔案也不需讀入記憶體。行號在從開頭逐頁移動時才已知。
+    """
+
+    def __init__(self, console: Console, path: Path, mm: mmap.mmap):
+        from rich.syntax import Syntax  # pygments 載入成本高，延到第一次開檔
+        self.console = console
+        self.path = path
+        self.mm = mm
+        self.size = len(mm)
+        self.top = 0
+        self.lineno: Optional[int] = 1
+        self.query = b""
+        self.lexer = Syntax.guess_lexer(str(path))
+
+    @property
+    def height(self) -> int:
+        return max(self.console.size.height - 1, 3)
+
+    # ---------------------- 行邊界 ----------------------
+    def _next(self, pos: int) -> Tuple[int, bool]:
+        """回傳 pos 所在行的下一行起點，以及該行是否以換行結束。"""
+        nl = self.mm.find(b"\n", pos, pos + MAX_LINE_BYTES)
+        if nl < 0:
+            return min(pos + MAX_LINE_BYTES, self.size), False
+        return nl + 1, True
+
+    def _prev(self, pos: int) -> int:
+        """pos 為行首時，回傳上一行的行首。"""
+        if pos <= 0:
+            return 0
+        lo = max(pos - 1 - MAX_LINE_BYTES, 0)
+        nl = self.mm.rfind(b"\n", lo, pos - 1)
+        if nl >= 0:
+            return nl + 1
+        return lo if lo == 0 else pos - MAX_LINE_BYTES
+
+    def _line_start(self, pos: int) -> int:
+        lo = max(pos - MAX_LINE_BYTES, 0)
+        nl = self.mm.rfind(b"\n", lo, pos)
+        return nl + 1 if nl >= 0 else lo
+
+    def _page(self) -> Tuple[List[bytes], int]:
+        lines, pos = [], self.top
+        while len(lines) < self.height - 1 and pos < self.size:
+            end, _ = self._next(pos)
+            lines.append(self.mm[pos:end].rstrip(b"\r\n"))
+            pos = end
+        return lines, pos
+
+    # ---------------------- 移動 ----------------------
+    def down(self, n: int) -> None:
+        for _ in range(n):
+            end, newline = self._next(self.top)
+            if end >= self.size:
+                break
+            self.top = end
+            if self.lineno is not None and newline:
+                self.lineno += 1
+
+    def up(self, n: int) -> None:
+        for _ in range(n):
+            if self.top == 0:
+                break
+            self.top = self._prev(self.top)
+            if self.lineno is not None:
+                self.lineno = max(self.lineno - 1, 1)
+        if self.top == 0:
+            self.lineno = 1
+
+    def home(self) -> None:
+        self.top, self.lineno = 0, 1
+
+    def end(self) -> None:
+        self.top, self.lineno = self.size, None
+        self.up(self.height - 1)
+
+    def search(self, query: bytes) -> bool:
+        self.query = query
+        end, _ = self._next(self.top)
+        hit = self.mm.find(query, end)
+        if hit < 0:
+            hit = self.mm.find(query, 0, end)  # 到結尾後從頭繞回
+        if hit < 0:
+            return False
+        self.top = self._line_start(hit)
+        self.lineno = 1 if self.top == 0 else None
+        return True
+
+    # ---------------------- 顯示 ----------------------
+    def render(self, message: str = ""):
+        from rich.syntax import Syntax
+        lines, end = self._page()
+        code = "\n".join(l.decode("utf-8", "replace") for l in lines)
+        syntax = Syntax(code, self.lexer, theme="ansi_dark", word_wrap=False, tab_size=4)
+        if self.query:
+            needle = self.query.decode("utf-8", "replace")
+            for i, line in enumerate(code.split("\n"), 1):
+                start = line.find(needle)
+                while start >= 0:
+                    syntax.stylize_range("reverse", (i, start), (i, start + len(needle)))
+                    start = line.find(needle, start + len(needle))
+        pct = 100 if end >= self.size else end * 100 // max(self.size, 1)
+        where = f"第 {self.lineno} 行 · " if self.lineno is not None else ""
+        status = message or "q 離開 · 空白/b 翻頁 · j/k 捲動 · g/G 開頭/結尾 · / 搜尋 · n 下一個"
+        bar = Text(f"{self.path} · {human_size(self.size)} · {where}{pct}% · {status}",
+                   style="reverse", no_wrap=True, overflow="ellipsis")
+        return Group(syntax, bar)
+
+    def run(self) -> None:
+        actions = {
+            " ": lambda: self.down(self.height - 1), "f": lambda: self.down(self.height - 1),
+            "pgdn": lambda: self.down(self.height - 1),
+            "b": lambda: self.up(self.height - 1), "pgup": lambda: self.up(self.height - 1),
+            "j": lambda: self.down(1), "down": lambda: self.down(1), "enter": lambda: self.down(1),
+            "k": lambda: self.up(1), "up": lambda: self.up(1),
+            "g": self.home, "home": self.home, "G": self.end, "end": self.end,
+        }
+        message = ""
+        with self.console.screen() as screen:
+            while True:
+                screen.update(self.render(message))
+                message = ""
+                try:
+                    key = read_key()
+                except KeyboardInterrupt:
+                    break
+                if key in (None, "q", "esc"):
+                    break
+                if key in actions:
+                    actions[key]()
+                elif key == "/" or (key == "n" and self.query):
+                    query = self.query
+                    if key == "/":
+                        screen.update(Group(self.render(), Text("/", end="")))
+                        try:
+                            query = self.console.input("").encode("utf-8")
+                        except (EOFError, KeyboardInterrupt):
+                            query = b""
+                    if query and not self.search(query):
+                        message = f"找不到：{query.decode('utf-8', 'replace')}"
+
 
 class FileManager:
     def __init__(self, console: Console): self.console = console
 
     def list_dir(self, path: Path):
+        """以 os.scandir 列出資料夾（DirEntry 快取檔案類型與 stat，不逐項重新查詢）。
+
+        項目不多時排序後以單一面板顯示；超過 SORT_LIMIT 項時依目錄順序串流，每頁一個畫面高。
+        """
         try:
-            items = sorted(path.iterdir(), key=lambda p: (p.is_file(), p.name.lower()))
-            lines = [("📄 " if p.is_file() else "📁 ")+p.name for p in items]
-            self.console.print(Panel.fit("\n".join(lines) or "(空)", title=str(path), border_style="blue"))
+            with os.scandir(path) as it:
+                first = list(islice(it, SORT_LIMIT + 1))
+                if len(first) <= SORT_LIMIT:
+                    first.sort(key=lambda e: (not _is_dir(e), e.name.lower()))
+                    lines = [_entry_line(e) for e in first]
+                    self.console.print(Panel.fit(Text("\n".join(lines) or "(空)"), title=str(path), border_style="blue"))
+                    return
+                self.console.print(f"[blue]{path}[/] [dim]（超過 {SORT_LIMIT} 項，依目錄順序分頁列出）[/]")
+                self._stream(chain(first, it))
+        except KeyboardInterrupt:
+            self.console.print("[yellow]已停止列出[/]")
         except Exception as e:
             self.console.print(f"[red]無法列出：[/]{e}")
 
+    def _stream(self, entries: Iterable[os.DirEntry]) -> None:
+        total = 0
+        interactive = True
+        it = iter(entries)
+        while True:
+            page = [_entry_line(e) for e in islice(it, max(self.console.size.height - 2, 1))]
+            if not page:
+                break
+            total += len(page)
+            self.console.print(Text("\n".join(page)), soft_wrap=True)
+            if interactive:
+                self.console.print(Text(f"-- 已列出 {total} 項 · 任意鍵下一頁、q 結束 --", style="dim"), end="\r")
+                key = read_key()
+                self.console.print(" " * 40, end="\r")
+                if key is None:
+                    interactive = False  # 非終端機：直接串流到結尾
+                elif key in ("q", "esc"):
+                    break
+        self.console.print(f"[dim]共列出 {total} 項[/]")
+
     def read_file(self, path: Path):
+        """以 FilePager 分頁檢視；非互動終端只印出第一頁。"""
         try:
-            text = path.read_text(encoding="utf-8")
-            lexer = path.suffix.lstrip(".") or "text"
-            self.console.print(Syntax(text, lexer, theme="ansi_dark", word_wrap=True))
+            with open(path, "rb") as f:
+                if os.fstat(f.fileno()).st_size == 0:
+                    self.console.print(f"[dim]{path}（空檔案）[/]")
+                    return
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    pager = FilePager(self.console, path, mm)
+                    if self.console.is_terminal:
+                        pager.run()
+                    else:
+                        self.console.print(pager.render())
         except Exception as e:
             self.console.print(f"[red]無法讀取：[/]{e}")
 
+    # ---------------------- 供模型的工具呼叫使用（回傳文字，不輸出畫面） ----------------------
+    def read_lines(self, path: Path, start: int = 1, limit: int = 400, max_bytes: int = 64 * 1024) -> str:
+        """回傳第 start 行起最多 limit 行（逐行串流讀取，不載入整檔）；還有內容時附上續讀提示。"""
+        with open(path, "rb") as f:
+            if b"\0" in f.read(8192):
+                raise ValueError("二進位檔案，無法以文字讀取")
+            f.seek(0)
+            out: List[str] = []
+            size = 0
+            for lineno, raw in enumerate(islice(f, max(start, 1) - 1, None), max(start, 1)):
+                if len(out) >= limit or size + len(raw) > max_bytes:
+                    out.append(f"…（尚有更多內容；以 start_line={lineno} 續讀）")
+                    break
+                out.append(raw.decode("utf-8", "replace").rstrip("\r\n"))
+                size += len(raw)
+        return "\n".join(out) if out else f"（第 {start} 行已超出檔案結尾）"
+
+    def entries(self, path: Path, limit: int = 500) -> List[str]:
+        """以 os.scandir 取得項目（格式同 :ls）；不超過 limit 項時排序，否則只回傳依目錄順序的前 limit 項。"""
+        with os.scandir(path) as it:
+            first = list(islice(it, limit + 1))
+        if len(first) <= limit:
+            first.sort(key=lambda e: (not _is_dir(e), e.name.lower()))
+            return [_entry_line(e) for e in first] or ["(空)"]
+        return [_entry_line(e) for e in first[:limit]] + [f"…（超過 {limit} 項，其餘未列出）"]
+
+    def grep(self, pattern: str, path: Path, limit: int = 200, max_file_bytes: int = 1024 * 1024) -> List[str]:
+        """以正規表示式搜尋檔案或資料夾（依 .gitignore 走訪、略過二進位與過大檔案），回傳「路徑:行號: 內容」。"""
+        from ..core.ingest import _read_sniffed, ingest_dir
+        regex = re.compile(pattern)
+        if path.is_file():
+            # 與資料夾走訪相同：先以 stat 判斷大小（過大的不開啟），再以檔頭判斷二進位
+            size = path.stat().st_size
+            if size > max_file_bytes:
+                return [f"（{path} 共 {human_size(size)}，超過單檔上限 {human_size(max_file_bytes)}，略過）"]
+            text = _read_sniffed(str(path), max_file_bytes)
+            if text is None:
+                return [f"（{path} 是二進位檔案，略過）"]
+            sources = [(path, text)]
+        else:
+            sources = ((p, text) for p, _, text in ingest_dir(path, max_file_bytes=max_file_bytes,
+                                                              max_total_bytes=1 << 40))
+        hits: List[str] = []
+        for file, text in sources:
+            for lineno, line in enumerate(text.splitlines(), 1):
+                if regex.search(line):
+                    if len(hits) >= limit:
+                        hits.append(f"…（超過 {limit} 筆，請縮小範圍）")
+                        return hits
+                    hits.append(f"{file}:{lineno}: {line.strip()[:GREP_LINE_CHARS]}")
+        return hits or ["（沒有符合的結果）"]
+
     def edit_file(self, path: Path):
         self.console.print(f"[blue]編輯：{path}[/]（輸入內容；wq 儲存）")
         lines: List[str] = []
@@ -47,3 +302,20 @@ class FileManager:
                 self.console.print("[red]:rm 只支援檔案[/]")
         except Exception as e:
             self.console.print(f"[red]刪除失敗：[/]{e}")
+
+
+def _is_dir(entry: os.DirEntry) -> bool:
+    try:
+        return entry.is_dir()
+    except OSError:
+        return False
+
+
+def _entry_line(entry: os.DirEntry) -> str:
+    if _is_dir(entry):
+        return f"📁 {entry.name}/"
+    try:
+        size = human_size(entry.stat().st_size)
+    except OSError:
+        size = "?"
+    return f"📄 {entry.name}  {size}"
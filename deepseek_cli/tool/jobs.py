@@ -0,0 +1,232 @@
+import codecs, os, re, shutil, subprocess, tempfile, time
+from collections import deque
+from pathlib import Path
+from typing import Deque, Dict, List, Optional, Tuple
+from rich.console import Console
+from rich.live import Live
+from rich.table import Table
+
+from .fs import human_size
+from .shell import ShellRunner
+
+JOB_MENTION_RE = re.compile(r"@job:(\d+)(?![^\s])")  # @job:N（後面須為空白或字串結尾）
+FOLLOW_INTERVAL = 0.1
+
+
+class Job:
+    """一個背景指令：stdout 與 stderr 合併後直接寫入暫存檔，不經過記憶體。"""
+
+    def __init__(self, no: int, cmd: str, proc: subprocess.Popen, spool: Path):
+        self.no = no
+        self.cmd = cmd
+        self.proc = proc
+        self.spool = spool
+        self.started = time.monotonic()
+        self.ended: Optional[float] = None
+        self.killed = False
+        self.reported = False  # 結束後是否已在提示前通知過
+
+    @property
+    def code(self) -> Optional[int]:
+        code = self.proc.poll()
+        if code is not None and self.ended is None:
+            self.ended = time.monotonic()
+        return code
+
+    @property
+    def running(self) -> bool:
+        return self.code is None
+
+    @property
+    def elapsed(self) -> float:
+        self.code  # 順便更新 ended
+        return (self.ended or time.monotonic()) - self.started
+
+    @property
+    def size(self) -> int:
+        try:
+            return self.spool.stat().st_size
+        except OSError:
+            return 0
+
+    def status(self) -> str:
+        code = self.code
+        if code is None:
+            return "執行中"
+        if self.killed:
+            return "已終止"
+        return f"結束碼 {code}"
+
+    def tail(self, max_bytes: int) -> Tuple[str, int]:
+        """讀取輸出最後 max_bytes（從檔尾 seek，不讀整個檔案）；截斷時由下一行開頭起算。回傳 (文字, 總 bytes)。"""
+        try:
+            with open(self.spool, "rb") as f:
+                size = f.seek(0, os.SEEK_END)
+                start = max(size - max_bytes, 0)
+                f.seek(start)
+                data = f.read(size - start)
+        except OSError:
+            return "", 0
+        if start:
+            cut = data.find(b"\n")
+            if 0 <= cut < len(data) - 1:
+                data = data[cut + 1:]
+        return data.decode("utf-8", errors="replace"), size
+
+
+class JobTable:
+    """REPL 的背景工作表：`!&指令` 啟動、:jobs 列出、:fg N 跟隨輸出、:kill N 終止。
+
+    輸出寫在工作階段專屬的暫存資料夾，離開 REPL 時終止仍在執行的工作並刪除。
+    """
+
+    def __init__(self, console: Console, runner: ShellRunner):
+        self.console = console
+        self.runner = runner
+        self.jobs: Dict[int, Job] = {}
+        self._next = 1
+        self._dir: Optional[Path] = None
+
+    # ---------------------- 管理 ----------------------
+    def start(self, cmd: str) -> Optional[Job]:
+        if self._dir is None:
+            self._dir = Path(tempfile.mkdtemp(prefix="deepseek-jobs-"))
+        no = self._next
+        spool = self._dir / f"{no}.log"
+        try:
+            with open(spool, "wb") as out:
+                proc = self.runner._spawn(cmd, stdout=out, stderr=subprocess.STDOUT)
+        except Exception as e:
+            spool.unlink(missing_ok=True)
+            self.console.print(f"[red]系統指令錯誤：[/]{e}")
+            return None
+        self._next += 1
+        job = self.jobs[no] = Job(no, cmd, proc, spool)
+        self.console.print(f"[green][{no}][/] 背景執行 {cmd} [dim]（pid {proc.pid}；:fg {no} 查看輸出、@job:{no} 附給模型）[/]")
+        return job
+
+    def get(self, ref: str) -> Optional[Job]:
+        ref = ref.strip().lstrip("%")
+        job = self.jobs.get(int(ref)) if ref.isdigit() else None
+        if job is None:
+            self.console.print(f"[red]找不到背景工作[/] {ref or '（請指定編號，:jobs 可列出）'}")
+        return job
+
+    def kill(self, ref: str) -> None:
+        job = self.get(ref)
+        if job is None:
+            return
+        if not job.running:
+            self.console.print(f"[yellow][{job.no}] 已結束[/]（{job.status()}）")
+            return
+        job.killed = True
+        self.runner._kill(job.proc)
+        job.reported = True
+        self.console.print(f"[yellow][{job.no}] 已終止[/] [dim]{job.cmd} · {job.elapsed:.1f}s[/]")
+
+    def reap(self) -> List[Job]:
+        """回傳上次呼叫後才結束的工作（供提示前通知）。"""
+        done = [j for j in self.jobs.values() if not j.reported and not j.running]
+        for job in done:
+            job.reported = True
+        return done
+
+    def close(self) -> None:
+        running = [j for j in self.jobs.values() if j.running]
+        if running:
+            self.console.print(f"[dim]終止 {len(running)} 個仍在執行的背景工作[/]")
+        for job in running:
+            job.killed = True
+            self.runner._kill(job.proc)
+        if self._dir is not None:
+            shutil.rmtree(self._dir, ignore_errors=True)
+            self._dir = None
+
+    # ---------------------- 顯示 ----------------------
+    def render_table(self) -> None:
+        if not self.jobs:
+            self.console.print("[dim]沒有背景工作（!&指令 可啟動）[/]")
+            return
+        table = Table(box=None, header_style="bold")
+        table.add_column("#", justify="right")
+        table.add_column("狀態")
+        table.add_column("時間", justify="right")
+        table.add_column("輸出", justify="right")
+        table.add_column("指令", overflow="fold")
+        for job in self.jobs.values():
+            style = "green" if job.running else ("red" if job.killed or job.code else "dim")
+            table.add_row(str(job.no), f"[{style}]{job.status()}[/]", f"{job.elapsed:.1f}s",
+                          human_size(job.size), job.cmd)
+        self.console.print(table)
+
+    def follow(self, ref: str) -> None:
+        """跟隨工作輸出直到結束：只保留畫面高度的尾端行；Ctrl-C 回到提示，工作繼續在背景執行。"""
+        job = self.get(ref)
+        if job is None:
+            return
+        height = max(self.console.size.height - 3, 3)
+        lines: Deque[Tuple[str, str]] = deque(maxlen=height)
+        decoder = codecs.getincrementaldecoder("utf-8")("replace")
+        pending = ""
+
+        def feed(data: bytes) -> None:
+            nonlocal pending
+            parts = (pending + decoder.decode(data)).split("\n")
+            pending = parts.pop()
+            lines.extend(("out", l.rstrip("\r")) for l in parts)
+
+        text, offset = job.tail(height * 256)
+        feed(text.encode("utf-8"))
+        detached = False
+        try:
+            with open(job.spool, "rb") as f, \
+                    Live(console=self.console, auto_refresh=False, transient=True) as live:
+                f.seek(offset)
+                while True:
+                    alive = job.running  # 先取狀態再讀：結束前寫入的內容一定讀得到
+                    data = f.read()
+                    if data:
+                        feed(data)
+                    if not alive:
+                        break
+                    status = f"[{job.no}] 執行中 {job.elapsed:.1f}s · {human_size(job.size)} · Ctrl-C 回到提示（工作繼續執行）"
+                    live.update(self.runner._window(lines or deque([("out", pending)]), status), refresh=True)
+                    time.sleep(FOLLOW_INTERVAL)
+        except KeyboardInterrupt:
+            detached = True
+        except OSError as e:
+            self.console.print(f"[red]無法讀取輸出：[/]{e}")
+            return
+        if pending:
+            lines.append(("out", pending))
+        self.runner._print_final([], lines, len(lines))
+        if detached:
+            self.console.print(f"[dim][{job.no}] 繼續在背景執行 · {job.cmd}[/]")
+        else:
+            job.reported = True
+            self.console.print(f"[dim][{job.no}] {job.status()} · {job.cmd} · {job.elapsed:.1f}s[/]")
+
+    # ---------------------- @job:N ----------------------
+    def mentions(self, s: str) -> List[Job]:
+        seen: List[Job] = []
+        for m in JOB_MENTION_RE.finditer(s):
+            job = self.jobs.get(int(m.group(1)))
+            if job is None:
+                self.console.print(f"[yellow]找不到背景工作[/] @job:{m.group(1)}")
+            elif job not in seen:
+                seen.append(job)
+        return seen
+
+    def render_context(self, jobs: List[Job], max_bytes: int) -> str:
+        """把工作輸出的尾端整理成附在提示後方的區塊（只在本輪送出，不存入對話記憶）。"""
+        if not jobs:
+            return ""
+        parts = ["\n\n[JOB OUTPUT]"]
+        for job in jobs:
+            text, size = job.tail(max_bytes)
+            shown = len(text.encode("utf-8"))
+            note = f"，只附最後 {human_size(shown)}" if shown < size else ""
+            parts.append(f"### job {job.no}: `{job.cmd}`（{job.status()}，{job.elapsed:.1f}s，輸出共 {human_size(size)}{note}）\n"
+                         f"```text\n{text.rstrip()}\n```")
+        return "\n".join(parts)
+
@@ -1,12 +1,229 @@
-import shlex, subprocess
-from rich.syntax import Syntax
-from rich.console import Console
+import os, queue, shlex, signal, subprocess, threading, time
+from collections import deque
+from itertools import groupby
+from typing import Deque, List, Optional, Tuple
+from rich.console import Console, Group
+from rich.live import Live
+from rich.text import Text
+
+MAX_LINE = 64 * 1024  # 單行上限；超長行（或沒有換行的二進位輸出）會被切段
 
 class ShellRunner:
-    def __init__(self, console: Console): self.console = console
-    def run(self, cmd: str):
+    """以 Popen 串流執行指令。
+
+    輸出邊產生邊顯示：執行中以 Live 只渲染（並上色）畫面可見的尾端；
+    記憶體只保留前 head 行與後 tail 行（ring buffer），結束後印出這兩段。
+    支援逾時（timeout 秒，0 為不限）與 Ctrl-C：兩者都會終止整個 process group，REPL 不受影響。
+    """
+
+    def __init__(self, console: Console, head: int = 200, tail: int = 500, timeout: float = 0.0):
+        self.console = console
+        self.head_lines = head
+        self.tail_lines = tail
+        self.timeout = timeout
+
+    # ---------------------- 子行程 ----------------------
+    @staticmethod
+    def _spawn(cmd: str, stdout=subprocess.PIPE, stderr=subprocess.PIPE, cwd=None) -> subprocess.Popen:
+        kwargs = {}
+        if os.name == "posix":
+            kwargs["start_new_session"] = True  # 獨立 process group，方便整組終止
+        else:
+            kwargs["creationflags"] = subprocess.CREATE_NEW_PROCESS_GROUP  # type: ignore[attr-defined]
+        return subprocess.Popen(shlex.split(cmd), stdin=subprocess.DEVNULL,
+                                stdout=stdout, stderr=stderr, cwd=cwd, **kwargs)
+
+    @staticmethod
+    def _kill(proc: subprocess.Popen, grace: float = 2.0) -> None:
+        """先送 SIGTERM 給整個 process group，grace 秒後仍未結束再 SIGKILL。"""
+        if proc.poll() is not None:
+            return
         try:
-            p = subprocess.run(shlex.split(cmd), capture_output=True, text=True)
-            if p.stdout: self.console.print(Syntax(p.stdout,"bash",theme="ansi_dark", word_wrap=True))
-            if p.stderr: self.console.print(Syntax(p.stderr,"bash",theme="ansi_dark", word_wrap=True))
-        except Exception as e: self.console.print(f"[red]系統指令錯誤：[/]{e}")
+            if os.name == "posix":
+                os.killpg(proc.pid, signal.SIGTERM)
+            else:
+                proc.terminate()
+            proc.wait(grace)
+        except subprocess.TimeoutExpired:
+            if os.name == "posix":
+                os.killpg(proc.pid, signal.SIGKILL)
+            else:
+                proc.kill()
+            proc.wait()
+        except ProcessLookupError:
+            pass
+
+    @staticmethod
+    def _pump(stream, tag: str, q: "queue.Queue") -> None:
+        """讀取管線並以「一批行」為單位放進佇列（每次 read 一批，避免逐行的佇列成本）。"""
+        fd = stream.fileno()
+        pending = b""
+        try:
+            while True:
+                chunk = os.read(fd, 65536)
+                if not chunk:
+                    break
+                pending += chunk
+                lines = pending.split(b"\n")
+                pending = lines.pop()
+                if len(pending) > MAX_LINE:
+                    lines.append(pending)
+                    pending = b""
+                if lines:
+                    q.put((tag, [l.decode("utf-8", errors="replace").rstrip("\r") for l in lines]))
+            if pending:
+                q.put((tag, [pending.decode("utf-8", errors="replace").rstrip("\r")]))
+        except OSError:
+            pass
+        finally:
+            stream.close()
+            q.put((tag, None))
+
+    def _keep(self, head: List[Tuple[str, str]], tail: Deque[Tuple[str, str]],
+              tag: str, lines: List[str]) -> int:
+        """把一批行放進 head（未滿時）或 tail ring buffer，回傳行數。"""
+        n = len(lines)
+        room = self.head_lines - len(head)
+        if room > 0:
+            head.extend((tag, l) for l in lines[:room])
+            lines = lines[room:]
+        tail.extend((tag, l) for l in lines[-self.tail_lines:])
+        return n
+
+    # ---------------------- 顯示 ----------------------
+    def _window(self, tail: Deque[Tuple[str, str]], status: str):
+        from rich.syntax import Syntax  # pygments 載入成本高，延到第一次執行指令
+        height = max(self.console.size.height - 3, 3)
+        visible = list(tail)[-height:]
+        body = Syntax("\n".join(line for _, line in visible), "bash", theme="ansi_dark", word_wrap=True)
+        return Group(body, Text(status, style="dim"))
+
+    def _print_final(self, head: List[Tuple[str, str]], tail: Deque[Tuple[str, str]], total: int) -> None:
+        from rich.syntax import Syntax
+        omitted = total - len(head) - len(tail)
+        sections = [head, list(tail)] if omitted > 0 else [head + list(tail)]
+        for i, section in enumerate(sections):
+            if i and omitted > 0:
+                self.console.print(Text(f"… 省略 {omitted} 行 …", style="dim"))
+            # 依記錄順序印出；連續同來源的行合併成一段（stdout 上色，stderr 以紅色標示）
+            for tag, run in groupby(section, key=lambda item: item[0]):
+                text = "\n".join(line for _, line in run)
+                if tag == "err":
+                    self.console.print(Text(text, style="red"))
+                else:
+                    self.console.print(Syntax(text, "bash", theme="ansi_dark", word_wrap=True))
+
+    def _drain(self, q: "queue.Queue", open_streams: int, head: List[Tuple[str, str]],
+               tail: Deque[Tuple[str, str]]) -> int:
+        """中止後排空佇列，讓讀取執行緒能收尾（管線已關閉，很快就會結束）；回傳新增的行數。"""
+        total = 0
+        deadline = time.monotonic() + 1.0
+        while open_streams and time.monotonic() < deadline:
+            try:
+                tag, lines = q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if lines is None:
+                open_streams -= 1
+            else:
+                total += self._keep(head, tail, tag, lines)
+        return total
+
+    def _start(self, cmd: str, cwd=None) -> Tuple[subprocess.Popen, "queue.Queue"]:
+        proc = self._spawn(cmd, cwd=cwd)
+        q: "queue.Queue" = queue.Queue(maxsize=256)
+        for stream, tag in ((proc.stdout, "out"), (proc.stderr, "err")):
+            threading.Thread(target=self._pump, args=(stream, tag, q), daemon=True).start()
+        return proc, q
+
+    # ---------------------- 執行 ----------------------
+    def capture(self, cmd: str, timeout: float = 0.0,
+                cancel: Optional[threading.Event] = None, cwd=None) -> Tuple[Optional[int], str]:
+        """不顯示畫面、收集輸出（供模型的 run_shell 工具，可在工作執行緒中呼叫）。
+
+        同樣只保留前 head 行與後 tail 行；逾時或 cancel 被設定時終止整個 process group，結束碼為 None。
+        """
+        proc, q = self._start(cmd, cwd)
+        head: List[Tuple[str, str]] = []
+        tail: Deque[Tuple[str, str]] = deque(maxlen=self.tail_lines)
+        total = 0
+        open_streams = 2
+        started = time.monotonic()
+        reason = ""
+        while open_streams:
+            try:
+                tag, lines = q.get(timeout=0.1)
+                if lines is None:
+                    open_streams -= 1
+                else:
+                    total += self._keep(head, tail, tag, lines)
+            except queue.Empty:
+                pass
+            if timeout and time.monotonic() - started > timeout:
+                reason = f"逾時（{timeout:g}s）"
+            elif cancel is not None and cancel.is_set():
+                reason = "已中止"
+            if reason:
+                self._kill(proc)
+                break
+        code = proc.wait()
+        total += self._drain(q, open_streams, head, tail)
+        omitted = total - len(head) - len(tail)
+        lines = [line for _, line in head]
+        if omitted > 0:
+            lines.append(f"… 省略 {omitted} 行 …")
+        lines.extend(line for _, line in tail)
+        if reason:
+            lines.append(f"[{reason}]")
+        return (None if reason else code), "\n".join(lines)
+
+    def run(self, cmd: str, timeout: Optional[float] = None) -> Optional[int]:
+        """執行指令並回傳結束碼；啟動失敗、逾時或被中止時回傳 None。"""
+        timeout = self.timeout if timeout is None else timeout
+        try:
+            proc, q = self._start(cmd)
+        except Exception as e:
+            self.console.print(f"[red]系統指令錯誤：[/]{e}")
+            return None
+
+        head: List[Tuple[str, str]] = []
+        tail: Deque[Tuple[str, str]] = deque(maxlen=self.tail_lines)
+        total = 0
+        open_streams = 2
+        started = time.monotonic()
+        reason = ""
+        try:
+            with Live(console=self.console, auto_refresh=False, transient=True) as live:
+                last_draw = 0.0
+                while open_streams:
+                    try:
+                        tag, lines = q.get(timeout=0.1)
+                        if lines is None:
+                            open_streams -= 1
+                        else:
+                            total += self._keep(head, tail, tag, lines)
+                    except queue.Empty:
+                        pass
+                    now = time.monotonic()
+                    if timeout and now - started > timeout:
+                        reason = f"逾時（{timeout:g}s）"
+                        self._kill(proc)
+                        break
+                    if now - last_draw >= 0.1 and (tail or head):
+                        status = f"執行中 {now - started:.1f}s · {total} 行 · Ctrl-C 中止"
+                        live.update(self._window(tail or deque(head), status), refresh=True)
+                        last_draw = now
+        except KeyboardInterrupt:
+            reason = "已中止"
+            self._kill(proc)
+        code = proc.wait()
+        total += self._drain(q, open_streams, head, tail)
+
+        self._print_final(head, tail, total)
+        elapsed = time.monotonic() - started
+        if reason:
+            self.console.print(f"[yellow]{reason}[/] [dim]{cmd} · {elapsed:.1f}s[/]")
+            return None
+        if code:
+            self.console.print(f"[dim]結束碼 {code} · {elapsed:.1f}s[/]")
+        return code
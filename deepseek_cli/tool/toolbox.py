@@ -0,0 +1,182 @@
+import json, os, re, threading, time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+from rich.console import Console
+
+from ..core.consent import ConsentManager
+from .fs import FileManager, human_size
+from .shell import ShellRunner
+
+MAX_WORKERS = 8
+
+# OpenAI function calling 的工具定義（description 會送給模型，維持英文）
+TOOL_SPECS: List[Dict[str, Any]] = [
+    {"type": "function", "function": {
+        "name": "read_file",
+        "description": "Read a text file in the current project. Returns up to max_lines lines starting at "
+                       "start_line (1-based); a trailing note tells you where to continue.",
+        "parameters": {"type": "object", "properties": {
+            "path": {"type": "string", "description": "File path, relative to the project root"},
+            "start_line": {"type": "integer", "description": "First line to return (default 1)"},
+            "max_lines": {"type": "integer", "description": "Maximum number of lines (default 400)"},
+        }, "required": ["path"]},
+    }},
+    {"type": "function", "function": {
+        "name": "list_dir",
+        "description": "List the entries of a directory in the current project (folders first, with file sizes).",
+        "parameters": {"type": "object", "properties": {
+            "path": {"type": "string", "description": "Directory path, relative to the project root (default '.')"},
+        }},
+    }},
+    {"type": "function", "function": {
+        "name": "grep",
+        "description": "Search files for a Python regular expression. Walks directories recursively, honours "
+                       ".gitignore and skips binary files. Returns 'path:line: text' matches.",
+        "parameters": {"type": "object", "properties": {
+            "pattern": {"type": "string", "description": "Python regular expression"},
+            "path": {"type": "string", "description": "File or directory to search (default '.')"},
+        }, "required": ["pattern"]},
+    }},
+    {"type": "function", "function": {
+        "name": "run_shell",
+        "description": "Run a command in the project root and return its exit code and output (stdout and stderr "
+                       "interleaved; long output keeps the head and tail). The command is split like a POSIX "
+                       "shell but NOT run by one: pipes, redirects, globs and && are not available.",
+        "parameters": {"type": "object", "properties": {
+            "command": {"type": "string", "description": "Command line, e.g. 'pytest -x tests/test_api.py'"},
+        }, "required": ["command"]},
+    }},
+]
+
+# 每個工具需要的同意種類
+TOOL_CONSENT = {"read_file": "fs_read", "list_dir": "fs_read", "grep": "fs_read", "run_shell": "shell"}
+CONSENT_LABELS = {"fs_read": "讀取", "shell": "系統指令"}
+
+
+class ToolError(Exception):
+    pass
+
+
+class ToolBox:
+    """執行模型要求的工具呼叫（read_file / list_dir / grep / run_shell）。
+
+    同一個回覆中的多個呼叫先在主執行緒依種類詢問同意，再交給執行緒池並行執行，
+    結果依呼叫順序整理成 role=tool 的訊息，由呼叫端一次送回模型。
+    路徑限制在 root（目前工作目錄）之內；每個結果最多 max_bytes，超過時截斷。
+    """
+
+    def __init__(self, console: Console, fs: FileManager, shell: ShellRunner, consent: ConsentManager,
+                 root: Optional[Path] = None, max_bytes: int = 32 * 1024):
+        self.console = console
+        self.fs = fs
+        self.shell = shell
+        self.consent = consent
+        self.root = (root or Path.cwd()).resolve()
+        self.max_bytes = max_bytes
+        self._handlers: Dict[str, Callable[..., str]] = {
+            "read_file": self._read_file, "list_dir": self._list_dir,
+            "grep": self._grep, "run_shell": self._run_shell,
+        }
+
+    # ---------------------- 執行 ----------------------
+    def run(self, calls: List[Dict[str, str]]) -> Optional[List[Dict[str, str]]]:
+        """執行一批工具呼叫，回傳依序排列的 tool 訊息；Ctrl-C 時終止進行中的指令並回傳 None。"""
+        results: Dict[int, str] = {}
+        todo = []
+        for i, call in enumerate(calls):
+            self.console.print(f"[magenta]⚙ {call['name']}[/] [dim]{_brief(call['arguments'])}[/]")
+            if call["name"] not in self._handlers:
+                results[i] = f"錯誤：沒有名為 {call['name']} 的工具"
+            else:
+                todo.append(i)
+        for kind in dict.fromkeys(TOOL_CONSENT[calls[i]["name"]] for i in todo):
+            if not self.consent.ensure(kind):
+                self.console.print(f"[yellow]已拒絕模型的{CONSENT_LABELS[kind]}要求[/]")
+                for i in [i for i in todo if TOOL_CONSENT[calls[i]["name"]] == kind]:
+                    results[i] = "使用者拒絕了這個工具呼叫"
+                    todo.remove(i)
+
+        cancel = threading.Event()
+        pool = ThreadPoolExecutor(max_workers=min(max(len(todo), 1), MAX_WORKERS), thread_name_prefix="deepseek-tool")
+        try:
+            futures = {pool.submit(self._call, calls[i], cancel): i for i in todo}
+            for future in as_completed(futures):
+                i = futures[future]
+                results[i], elapsed = future.result()
+                self.console.print(f"[dim]  ✓ {calls[i]['name']} · {elapsed:.2f}s · "
+                                   f"{human_size(len(results[i].encode('utf-8')))}[/]")
+        except KeyboardInterrupt:
+            cancel.set()  # 讓 run_shell 終止 process group
+            self.console.print("[yellow]已中止工具呼叫[/]")
+            return None
+        finally:
+            pool.shutdown(wait=not cancel.is_set(), cancel_futures=True)
+        return [{"role": "tool", "tool_call_id": call["id"], "content": results[i]}
+                for i, call in enumerate(calls)]
+
+    def _call(self, call: Dict[str, str], cancel: threading.Event):
+        start = time.perf_counter()
+        try:
+            args = json.loads(call["arguments"] or "{}")
+            if not isinstance(args, dict):
+                raise ToolError("參數必須是 JSON 物件")
+            text = self._handlers[call["name"]](cancel=cancel, **args)
+        except TypeError as e:
+            text = f"錯誤：參數不正確（{e}）"
+        except (ToolError, ValueError, OSError, re.error) as e:  # JSON 解析錯誤是 ValueError
+            text = f"錯誤：{e}"
+        return self._clip(text), time.perf_counter() - start
+
+    def _clip(self, text: str) -> str:
+        """超過 max_bytes 時保留開頭與結尾各一半（指令輸出的錯誤訊息通常在最後）。"""
+        data = text.encode("utf-8")
+        if len(data) <= self.max_bytes:
+            return text
+        half = self.max_bytes // 2
+        return (data[:half].decode("utf-8", "ignore") +
+                f"\n…（結果共 {human_size(len(data))}，省略中間 {human_size(len(data) - 2 * half)}）…\n" +
+                data[-half:].decode("utf-8", "ignore"))
+
+    def _path(self, raw: str) -> Path:
+        path = (self.root / os.path.expanduser(raw or ".")).resolve()
+        if path != self.root and self.root not in path.parents:
+            raise ToolError(f"{raw} 不在專案目錄 {self.root} 之內")
+        if not path.exists():
+            raise ToolError(f"{raw} 不存在")
+        return path
+
+    # ---------------------- 工具 ----------------------
+    def _read_file(self, path: str, start_line: int = 1, max_lines: int = 400, cancel=None) -> str:
+        target = self._path(path)
+        if target.is_dir():
+            raise ToolError(f"{path} 是資料夾（請用 list_dir）")
+        return self.fs.read_lines(target, int(start_line), int(max_lines), max_bytes=self.max_bytes)
+
+    def _list_dir(self, path: str = ".", cancel=None) -> str:
+        target = self._path(path)
+        if not target.is_dir():
+            raise ToolError(f"{path} 不是資料夾")
+        return "\n".join(self.fs.entries(target))
+
+    def _grep(self, pattern: str, path: str = ".", cancel=None) -> str:
+        target = self._path(path)
+        hits = self.fs.grep(pattern, target)
+        return "\n".join(h[len(str(self.root)) + 1:] if h.startswith(f"{self.root}{os.sep}") else h
+                         for h in hits)
+
+    def _run_shell(self, command: str, cancel=None) -> str:
+        code, output = self.shell.capture(command, timeout=self.shell.timeout, cancel=cancel, cwd=self.root)
+        status = "已終止" if code is None else f"結束碼 {code}"
+        return f"[{status}]\n{output}"
+
+
+def _brief(arguments: str, limit: int = 120) -> str:
+    """把 JSON 參數整理成一行顯示（只取值）。"""
+    try:
+        args = json.loads(arguments or "{}")
+        text = " ".join(str(v) for v in args.values()) if isinstance(args, dict) else str(args)
+    except ValueError:
+        text = arguments
+    text = " ".join(text.split())
+    return text if len(text) <= limit else text[:limit - 1] + "…"
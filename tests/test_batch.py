@@ -0,0 +1,37 @@
+import asyncio
+import io
+import json
+import types
+
+from deepseek_cli.core.batch import BatchRunner, checkpoint_offset
+
+
+def test_checkpoint_offset_truncates_partial_line(tmp_path):
+    out = tmp_path / "out.jsonl"
+    out.write_bytes(b'{"a": 1}\n{"b": 2}\n{"c": ')
+    assert checkpoint_offset(out, block=4) == 2
+    assert out.read_bytes() == b'{"a": 1}\n{"b": 2}\n'
+    assert checkpoint_offset(out, block=4) == 2
+
+    out.write_bytes(b"no newline yet")
+    assert checkpoint_offset(out, block=4) == 0
+    assert out.read_bytes() == b""
+    assert checkpoint_offset(tmp_path / "missing.jsonl") == 0
+
+
+def test_malformed_response_becomes_error_record():
+    class Completions:
+        async def create(self, model, messages):
+            if messages[0]["content"] == "bad":
+                return types.SimpleNamespace(choices=[], usage=None)
+            msg = types.SimpleNamespace(content="ok")
+            return types.SimpleNamespace(choices=[types.SimpleNamespace(message=msg)], usage=None)
+
+    client = types.SimpleNamespace(chat=types.SimpleNamespace(completions=Completions()))
+    out = io.StringIO()
+    runner = BatchRunner(client, "m", out, concurrency=2, retries=0)
+    asyncio.run(runner.run(['"bad"\n', '"good"\n']))
+    records = [json.loads(line) for line in out.getvalue().splitlines()]
+    assert [r["index"] for r in records] == [0, 1]
+    assert "error" in records[0] and records[1]["reply"] == "ok"
+    assert (runner.ok, runner.failed) == (1, 1)
@@ -0,0 +1,83 @@
+import asyncio
+import types
+
+import deepseek_cli.main as main_mod
+from deepseek_cli.core.config import normalize_with_defaults
+
+
+def _chunk(text):
+    delta = types.SimpleNamespace(content=text, reasoning_content=None, tool_calls=None)
+    return types.SimpleNamespace(choices=[types.SimpleNamespace(delta=delta)])
+
+
+def test_stream_failure_after_first_chunk_is_not_recorded_or_applied(tmp_path):
+    target = tmp_path / "a.py"
+    target.write_text("a = 1\n")
+
+    def create(**kwargs):
+        yield _chunk(f"<<<WRITE {target}\na = 2\n>>>END\n")
+        raise ConnectionError("connection reset")
+
+    chat = main_mod.ChatManager(normalize_with_defaults(
+        {"api_key": "test", "tools": "false", "history": "false", "history_compact": "false"}), no_cache=True)
+    chat.client = types.SimpleNamespace(chat=types.SimpleNamespace(
+        completions=types.SimpleNamespace(create=create)))
+    chat.consent.session_cache.update(fs_read=True, fs_write=True)
+
+    asyncio.run(chat._handle(f"改一下 @{target}"))
+
+    assert chat.history.turns == []
+    assert target.read_text() == "a = 1\n"
+
+
+def test_response_cache_key_depends_on_tools(tmp_path):
+    from deepseek_cli.core.chat import model_say
+    from deepseek_cli.core.respcache import ResponseCache
+    from deepseek_cli.tool.toolbox import TOOL_SPECS
+
+    sent = []
+
+    def create(**kwargs):
+        sent.append("tools" in kwargs)
+        message = types.SimpleNamespace(content=f"reply {len(sent)}", tool_calls=None)
+        return types.SimpleNamespace(choices=[types.SimpleNamespace(message=message)], usage=None)
+
+    client = types.SimpleNamespace(base_url="http://x", chat=types.SimpleNamespace(
+        completions=types.SimpleNamespace(create=create)))
+    cache = ResponseCache(tmp_path / "responses.sqlite3")
+
+    assert model_say(client, "m", "hi", cache=cache) == "reply 1"
+    assert model_say(client, "m", "hi", cache=cache) == "reply 1"
+    assert model_say(client, "m", "hi", cache=cache, tools=TOOL_SPECS, calls=[]) == "reply 2"
+    assert sent == [False, True]
+
+
+def test_cancel_closes_stream_while_waiting_for_first_chunk():
+    import threading
+    from deepseek_cli.core.chat import ReplyStream, iter_model_stream
+    from deepseek_cli.core.client import ChatClient
+
+    opened, closed = threading.Event(), threading.Event()
+
+    class SlowStream:
+        def __iter__(self):
+            opened.set()
+            closed.wait(5)  # 首個 token 遲遲不來，直到連線被關閉
+            raise ConnectionError("stream closed")
+            yield
+
+        def close(self):
+            closed.set()
+
+    raw = types.SimpleNamespace(base_url="http://x", chat=types.SimpleNamespace(
+        completions=types.SimpleNamespace(create=lambda **kwargs: SlowStream())))
+    client = ChatClient(raw, max_retries=0)
+
+    async def run():
+        rs = ReplyStream(lambda on_open: iter_model_stream(client, "m", "hi", on_open=on_open, raise_errors=True))
+        done = rs.start(asyncio.get_running_loop())
+        assert await asyncio.to_thread(opened.wait, 5)
+        done.cancel()
+
+    asyncio.run(run())
+    assert closed.wait(1)
@@ -0,0 +1,20 @@
+from deepseek_cli.core.context import read_context_files, write_targets
+from deepseek_cli.core.filecache import FileCache
+
+
+def test_folder_mention_does_not_allow_symlinks_outside(tmp_path):
+    outside = tmp_path / "outside.py"
+    outside.write_text("secret = 1\n")
+    pkg = tmp_path / "pkg"
+    pkg.mkdir()
+    (pkg / "a.py").write_text("a = 1\n")
+    (pkg / "link.py").symlink_to(outside)
+
+    file_map = read_context_files([pkg], FileCache(), {})
+    assert pkg / "link.py" in file_map  # 仍可讀取作為上下文
+    targets = write_targets([pkg], file_map)
+    assert pkg / "a.py" in targets
+    assert pkg / "link.py" not in targets
+
+    # 直接 @ 提及的路徑照舊允許
+    assert outside in write_targets([outside], read_context_files([outside], FileCache(), {}))
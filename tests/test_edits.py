@@ -0,0 +1,27 @@
+from deepseek_cli.core.edits import apply_search_replace, apply_unified_diff
+
+
+def test_search_replace_keeps_crlf():
+    text = "one\r\ntwo\r\nthree\r\n"
+    body = "<<<<<<< SEARCH\ntwo\n=======\nTWO\nTWO2\n>>>>>>> REPLACE\n"
+    assert apply_search_replace(text, body) == "one\r\nTWO\r\nTWO2\r\nthree\r\n"
+
+
+def test_search_replace_lf_unchanged():
+    text = "one\ntwo\nthree\n"
+    body = "<<<<<<< SEARCH\ntwo\n=======\nTWO\n>>>>>>> REPLACE\n"
+    assert apply_search_replace(text, body) == "one\nTWO\nthree\n"
+
+
+def test_unified_diff_pure_insertion():
+    text = "a\nb\nc\n"
+    assert apply_unified_diff(text, "@@ -2,0 +3,1 @@\n+new\n") == "a\nb\nnew\nc\n"
+    assert apply_unified_diff(text, "@@ -0,0 +1,1 @@\n+top\n") == "top\na\nb\nc\n"
+    assert apply_unified_diff(text, "@@ -3,0 +4,1 @@\n+end\n") == "a\nb\nc\nend\n"
+    assert apply_unified_diff("a\nb", "@@ -2,0 +3,1 @@\n+end\n") == "a\nb\nend"
+
+
+def test_unified_diff_with_context_and_crlf():
+    text = "a\r\nb\r\nc\r\n"
+    body = "@@ -1,3 +1,3 @@\n a\n-b\n+B\n c\n"
+    assert apply_unified_diff(text, body) == "a\r\nB\r\nc\r\n"
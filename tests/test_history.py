@@ -0,0 +1,22 @@
+import threading
+
+from deepseek_cli.core.history import Conversation
+
+
+def test_clear_drops_compaction_in_flight():
+    started, release = threading.Event(), threading.Event()
+
+    def summarize(prompt: str) -> str:
+        started.set()
+        release.wait(5)
+        return "old summary"
+
+    conv = Conversation(budget=50, keep_recent=1, summarize=summarize)
+    for _ in range(3):
+        conv.add("x" * 100, "y" * 100)
+    assert started.wait(5)
+    conv.clear()
+    release.set()
+    conv.wait(5)
+    assert conv.summary == ""
+    assert conv.turns == []